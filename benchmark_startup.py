@@ -0,0 +1,95 @@
+"""Startup cost of the interpreter, broken down per dependency.
+
+Every measurement runs in a fresh Python process, so nothing is already in
+sys.modules; the best of --repeat runs is reported.
+
+    python benchmark_startup.py [--repeat N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Imported in this order, each one timed on its own.
+DEPENDENCIES = [
+    "antlr4",
+    "SimpleLangParser",
+    "interpreter",
+    "numpy",
+    "scipy.stats",
+    "simpleaudio",
+    "pygame.midi",
+]
+
+IMPORT_TIMER = """
+import importlib, sys, time
+start = time.perf_counter()
+try:
+    importlib.import_module(sys.argv[1])
+except ImportError:
+    print("missing")
+else:
+    print(time.perf_counter() - start)
+"""
+
+ARITHMETIC_SCRIPT = """
+let total: int = 0;
+let i: int = 0;
+while (i < 10) {
+    total = total + i * 2;
+    i = i + 1;
+}
+print(total);
+"""
+
+
+def best_of(command, repeat):
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run(command, cwd=HERE, capture_output=True, text=True).stdout.strip().splitlines()
+        if not output or output[-1] == "missing":
+            return None
+        times.append(float(output[-1]))
+    return min(times)
+
+
+def time_import(name, repeat):
+    return best_of([sys.executable, "-c", IMPORT_TIMER, name], repeat)
+
+
+def time_script(path, repeat):
+    timer = (
+        "import runpy, sys, time\n"
+        "start = time.perf_counter()\n"
+        "sys.argv = ['run.py', sys.argv[1], '--no-cache']\n"
+        "runpy.run_path('run.py', run_name='__main__')\n"
+        "print(time.perf_counter() - start)\n"
+    )
+    return best_of([sys.executable, "-c", timer, path], repeat)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Measure interpreter startup time per dependency.")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    print(f"{'import':<20} {'ms':>8}")
+    for name in DEPENDENCIES:
+        seconds = time_import(name, args.repeat)
+        shown = "not installed" if seconds is None else f"{seconds * 1000:8.1f}"
+        print(f"{name:<20} {shown:>8}")
+
+    with tempfile.NamedTemporaryFile("w", suffix=".arrlang", delete=False) as script:
+        script.write(ARITHMETIC_SCRIPT)
+    try:
+        seconds = time_script(script.name, args.repeat)
+    finally:
+        os.remove(script.name)
+    print(f"{'run.py (int-only)':<20} {seconds * 1000:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,609 @@
+from array import array
+from typing import Any, Dict, List
+from interpreter import ArrayType, ListType, Type, TypedArray
+from lowering import (
+    Assign,
+    BinOp,
+    Block,
+    Call,
+    CallStmt,
+    Const,
+    FuncDecl,
+    If,
+    Index,
+    Inline,
+    Invariant,
+    Lambda,
+    ListLit,
+    NumericListLit,
+    Match,
+    MethodOp,
+    Name,
+    Neg,
+    Pipeline,
+    Program,
+    Return,
+    VarDecl,
+    While,
+    vector_plan,
+)
+from resolver import LOCAL, STATISTICS, UNSET, resolve
+
+
+# Every instruction is four ints (opcode, a, b, c) laid out back to back in an
+# array('i'). Operands are register numbers unless noted otherwise; negative
+# register numbers address the constant pool, which sits reversed at the end
+# of every frame so that regs[-(k + 1)] is constant k.
+# The VM dispatch loop relies on the numbering below (globals, then binary
+# operators, then jumps), so append new opcodes at the end.
+INSTRUCTION_WIDTH = 4
+
+MOVE = 0  # regs[a] = regs[b]
+LOAD_GLOBAL = 1  # regs[a] = globals[b]
+DEFINE_GLOBAL = 2  # globals[a] = regs[b]
+STORE_GLOBAL = 3  # globals[a] = regs[b], global must already be defined
+# Binary operators: regs[a] = regs[b] <op> regs[c]
+ADD = 4
+SUB = 5
+MUL = 6
+DIV = 7
+MOD = 8
+GT = 9
+LT = 10
+GE = 11
+LE = 12
+EQ = 13
+NE = 14
+AND = 15
+OR = 16
+NEG = 17  # regs[a] = -regs[b]
+JUMP = 18  # pc = a
+JUMP_IF_FALSE = 19  # if not regs[a]: pc = b
+# Fused compare-and-branch: if not regs[a] <op> regs[b]: pc = c
+JUMP_UNLESS_GT = 20
+JUMP_UNLESS_LT = 21
+JUMP_UNLESS_GE = 22
+JUMP_UNLESS_LE = 23
+JUMP_UNLESS_EQ = 24
+JUMP_UNLESS_NE = 25
+CALL = 26  # regs[a] = regs[b](*regs[b + 1:b + 1 + c])
+RETURN = 27  # return regs[a]
+RETURN_NONE = 28
+YIELD = 29  # end of a lambda body, hands regs[a] back to map/filter
+INDEX = 30  # regs[a] = regs[b][regs[c]]
+SET_INDEX = 31  # regs[a][regs[b]] = regs[c]
+BUILD_LIST = 32  # regs[a] = regs[b:b + c]
+NEW_NDARRAY = 33  # regs[a] = np.array([])
+TO_NDARRAY = 34  # regs[a] = np.array(regs[b])
+MAKE_FUNCTION = 35  # regs[a] = function b with defaults regs[c:c + nparams], UNSET where there is none
+MATCH = 36  # regs[a] = pattern consts[c] matches regs[b]
+NO_MATCH = 37  # raise for regs[a]
+CHECK_ARRAY = 38  # regs[a] must be an array, consts[b] names it
+CHECK_LIST = 39  # regs[a] must be a list, consts[b] names it
+SORT = 40  # sort regs[a] in place, descending when b; regs[a] = what the variable holds afterwards
+STATISTIC = 41  # regs[a] = STATISTICS[c](regs[b])
+PLAY = 42  # play regs[a]
+LINREG = 43  # regs[a:a + 3] = slope, intercept, r_squared of regs[b], regs[c]
+ROTATE = 44  # regs[a] = regs[b] rotated by regs[c]
+SHIFT = 45  # regs[a] = regs[b] shifted by regs[c]
+FILTER = 46  # regs[a] = regs[b] filtered by lambda c
+MAP = 47  # regs[a] = regs[b] mapped by lambda c
+LIST_APPEND = 48  # regs[a].append(regs[b])
+LIST_REMOVE = 49  # regs[a].remove(regs[b])
+LIST_SORT = 50  # regs[a].sort(reverse=b)
+TO_MATRIX = 51  # regs[a] = regs[b] as ndarray, consts[c] names it
+MATRIX_ADD = 52  # regs[a] = regs[b] + regs[c]
+MATRIX_MULTIPLY = 53  # regs[a] = regs[b] @ regs[c]
+MATRIX_INVERT = 54  # regs[a] = inverse of regs[b], consts[c] names it
+MATRIX_TRANSPOSE = 55  # regs[a] = transpose of regs[b]
+HALT = 56
+LOAD_NUMBERS = 57  # regs[a] = aux[b] as a list
+LOAD_NDARRAY = 58  # regs[a] = aux[b] as an ndarray
+PROVEN_STATISTIC = 59  # STATISTIC without the element check, for arrays proven numeric
+PROVEN_LINREG = 60  # LINREG without the element checks, for arrays proven numeric
+JUMP_IF_BOUND = 61  # if regs[a] is not UNSET: pc = b
+TAIL_CALL = 62  # return regs[a](*regs[a + 1:a + 1 + b]), replacing the current frame
+JUMP_UNLESS_INLINE = 63  # unless regs[a] is function c with no memo, pc = b
+NEW_TYPED_ARRAY = 64  # regs[a] = an empty TypedArray of element type regs[b]
+TO_TYPED_ARRAY = 65  # regs[a] = regs[b] declared as a TypedArray of element type regs[c]
+PIPELINE = 66  # regs[a] = regs[b] through the stages aux[c]: (op, lambda, positions register or proven)
+
+OPCODES = {
+    number: name for name, number in list(globals().items())
+    if name.isupper() and isinstance(number, int) and name != "INSTRUCTION_WIDTH"
+}
+
+BINARY_OPCODES = {
+    "+": ADD, "-": SUB, "*": MUL, "/": DIV, "%": MOD,
+    ">": GT, "<": LT, ">=": GE, "<=": LE, "==": EQ, "!=": NE,
+    "and": AND, "or": OR,
+}
+COMPARE_JUMPS = {
+    ">": JUMP_UNLESS_GT, "<": JUMP_UNLESS_LT, ">=": JUMP_UNLESS_GE,
+    "<=": JUMP_UNLESS_LE, "==": JUMP_UNLESS_EQ, "!=": JUMP_UNLESS_NE,
+}
+
+
+class CodeObject:
+    """Compiled body of one function (or of the main program)."""
+
+    def __init__(self, name, nparams=0, pure=False, param_names=()):
+        self.name = name
+        self.nparams = nparams
+        self.param_names = param_names  # for the global a parameter without a default falls back to
+        self.pure = pure  # a function optimizer.py found pure, whose results may be memoized
+        self.code = array("i")
+        self.consts: List[Any] = []     # constant registers
+        self.aux: List[Any] = []        # names and patterns referenced by operands
+        self.lambdas: List[tuple] = []  # (param register, start pc, VectorLambda plan or None)
+        self.nregs = 0
+        self.debug: Dict[int, str] = {}  # pc -> source text, for error messages
+
+    def frame_template(self):
+        return [None] * self.nregs + self.consts[::-1]
+
+
+class BytecodeProgram:
+    def __init__(self, main: CodeObject, functions: List[CodeObject], global_names: List[str]):
+        self.main = main
+        self.functions = functions
+        self.global_names = global_names
+
+
+class _Builder:
+    """Per-CodeObject compile state: emitted ints, registers and constants."""
+
+    def __init__(self, code_obj: CodeObject, frame_size: int):
+        self.obj = code_obj
+        self.code: List[int] = []
+        # Registers below frame_size are the resolver's variable slots.
+        self.temp_base = frame_size
+        self.top = self.temp_base
+        self.max_top = self.top
+        self.const_index: Dict[tuple, int] = {}
+
+    def emit(self, op, a=0, b=0, c=0):
+        pos = len(self.code)
+        self.code.extend((op, a, b, c))
+        return pos
+
+    def here(self):
+        return len(self.code)
+
+    def patch(self, pos, slot, target):
+        self.code[pos + slot] = target
+
+    def alloc(self):
+        reg = self.top
+        self.top += 1
+        if self.top > self.max_top:
+            self.max_top = self.top
+        return reg
+
+    def const(self, value):
+        # 0.0 == -0.0 (and they hash alike), so floats are told apart by repr.
+        key = (float, repr(value)) if type(value) is float else (type(value), value)
+        if key not in self.const_index:
+            self.const_index[key] = len(self.obj.consts)
+            self.obj.consts.append(value)
+        return -(self.const_index[key] + 1)
+
+    def aux(self, value):
+        self.obj.aux.append(value)
+        return len(self.obj.aux) - 1
+
+    def finish(self):
+        self.obj.code = array("i", self.code)
+        self.obj.nregs = self.max_top
+        return self.obj
+
+
+class BytecodeCompiler:
+    """Compiles a lowered Program into register bytecode for vm.VirtualMachine.
+
+    Variable slots come from the resolver: global addresses become global
+    table slots and local ones are used as register numbers directly, so the
+    VM never allocates per-block environments. Temporaries live above the
+    variable slots.
+    """
+
+    def __init__(self):
+        self.functions: List[CodeObject] = []
+        self.function_index: Dict[int, int] = {}  # id of FuncDecl -> index in functions
+        self.pending: List[tuple] = []
+
+    def compile(self, program: Program) -> BytecodeProgram:
+        resolve(program)
+        main = CodeObject("<main>")
+        self.b = _Builder(main, program.frame_size)
+        self.in_main = True
+        for item in program.body:
+            self.exits = []
+            self.stmt(item)
+            for pos in self.exits:
+                self.b.patch(pos, 1, self.b.here())
+        self.b.emit(HALT)
+        main = self.b.finish()
+
+        self.in_main = False
+        while self.pending:
+            code_obj, node = self.pending.pop(0)
+            self.compile_function(code_obj, node)
+        return BytecodeProgram(main, self.functions, program.global_names)
+
+    def compile_function(self, code_obj: CodeObject, node: FuncDecl):
+        self.b = _Builder(code_obj, node.frame_size)
+        self.block(node.body)
+        self.b.emit(RETURN_NONE)
+        self.b.finish()
+
+    # Names
+
+    def load(self, address, dst=None):
+        kind, where = address
+        if kind == LOCAL:
+            if dst is not None and dst != where:
+                self.b.emit(MOVE, dst, where)
+                return dst
+            return where
+        dst = self.b.alloc() if dst is None else dst
+        self.b.emit(LOAD_GLOBAL, dst, where)
+        return dst
+
+    def store(self, address, reg, define=True):
+        kind, where = address
+        if kind == LOCAL:
+            if where != reg:
+                self.b.emit(MOVE, where, reg)
+        else:
+            self.b.emit(DEFINE_GLOBAL if define else STORE_GLOBAL, where, reg)
+
+    def target(self, address):
+        """Register an expression should be compiled into to end up at address."""
+        return address[1] if address[0] == LOCAL else self.b.alloc()
+
+    # Statements
+
+    def stmt(self, node):
+        getattr(self, "stmt_" + type(node).__name__)(node)
+        self.b.top = self.b.temp_base
+
+    def block(self, node: Block):
+        for stmt in node.body:
+            self.stmt(stmt)
+
+    def stmt_Block(self, node: Block):
+        self.block(node)
+
+    def function(self, node: FuncDecl) -> int:
+        """Index of node's CodeObject, which is created and queued for compiling on first use."""
+        index = self.function_index.get(id(node))
+        if index is None:
+            code_obj = CodeObject(node.name, len(node.params), node.pure, tuple(param.name for param in node.params))
+            index = self.function_index[id(node)] = len(self.functions)
+            self.functions.append(code_obj)
+            self.pending.append((code_obj, node))
+        return index
+
+    def stmt_FuncDecl(self, node: FuncDecl):
+        index = self.function(node)
+        base = self.b.top
+        for param in node.params:
+            reg = self.b.alloc()
+            mark = self.b.top
+            if param.default is not None:
+                self.expr(param.default, reg)
+            else:
+                self.b.emit(MOVE, reg, self.b.const(UNSET))  # VirtualMachine.new_frame reads the global instead
+            self.b.top = mark
+        dst = self.target(node.address)
+        self.b.emit(MAKE_FUNCTION, dst, index, base)
+        self.store(node.address, dst)
+
+    def stmt_VarDecl(self, node: VarDecl):
+        dst = self.target(node.address)
+        var_type = node.type
+        if isinstance(node.value, NumericListLit) and var_type == ArrayType(Type.FLOAT):
+            self.b.emit(LOAD_NDARRAY, dst, self.b.aux(node.value.literal))
+        elif node.value is not None:
+            self.expr(node.value, dst)
+            if isinstance(var_type, ArrayType) and (
+                var_type.element_type == Type.FLOAT or var_type.element_type == ArrayType(Type.FLOAT)
+            ):
+                self.b.emit(TO_NDARRAY, dst, dst)
+            elif isinstance(var_type, ArrayType) and var_type.element_type in TypedArray.CLASSES:
+                self.b.emit(TO_TYPED_ARRAY, dst, dst, self.b.const(var_type.element_type))
+        elif var_type == Type.FLOAT:
+            self.b.emit(MOVE, dst, self.b.const(0.0))
+        elif var_type == Type.INT:
+            self.b.emit(MOVE, dst, self.b.const(0))
+        elif var_type == Type.BOOL:
+            self.b.emit(MOVE, dst, self.b.const(False))
+        elif var_type == Type.STRING:
+            self.b.emit(MOVE, dst, self.b.const(""))
+        elif isinstance(var_type, ArrayType) and (
+            var_type.element_type == Type.FLOAT or var_type.element_type == ArrayType(Type.FLOAT)
+        ):
+            self.b.emit(NEW_NDARRAY, dst)
+        elif isinstance(var_type, ArrayType) and var_type.element_type in TypedArray.CLASSES:
+            self.b.emit(NEW_TYPED_ARRAY, dst, self.b.const(var_type.element_type))
+        elif isinstance(var_type, (ArrayType, ListType)):
+            self.b.emit(BUILD_LIST, dst, 0, 0)
+        else:
+            self.b.emit(MOVE, dst, self.b.const(None))
+        self.store(node.address, dst)
+
+    def stmt_Assign(self, node: Assign):
+        if node.index is not None:
+            container = self.load(node.address)
+            index = self.expr(node.index)
+            value = self.expr(node.value)
+            pos = self.b.emit(SET_INDEX, container, index, value)
+            self.b.obj.debug[pos] = node.name
+            return
+        reg = self.expr(node.value, self.target(node.address))
+        self.store(node.address, reg, define=False)
+
+    def stmt_CallStmt(self, node: CallStmt):
+        self.expr(node.call)
+
+    def stmt_Return(self, node: Return):
+        if node.tail and not self.in_main:
+            self.b.emit(TAIL_CALL, self.call_operands(node.value), len(node.value.args))
+            return
+        reg = self.expr(node.value) if node.value is not None else None
+        if self.in_main:
+            # A top-level return only ends the enclosing top-level statement.
+            self.exits.append(self.b.emit(JUMP))
+        elif reg is None:
+            self.b.emit(RETURN_NONE)
+        else:
+            self.b.emit(RETURN, reg)
+
+    def branch_unless(self, cond):
+        """Emits a jump taken when cond is falsy; returns (position, operand slot) to patch."""
+        if isinstance(cond, BinOp) and cond.op in COMPARE_JUMPS:
+            left = self.expr(cond.left)
+            right = self.expr(cond.right)
+            return self.b.emit(COMPARE_JUMPS[cond.op], left, right), 3
+        return self.b.emit(JUMP_IF_FALSE, self.expr(cond)), 2
+
+    def stmt_If(self, node: If):
+        pos, slot = self.branch_unless(node.cond)
+        self.b.top = self.b.temp_base
+        self.block(node.then)
+        if node.orelse is None:
+            self.b.patch(pos, slot, self.b.here())
+            return
+        skip = self.b.emit(JUMP)
+        self.b.patch(pos, slot, self.b.here())
+        self.block(node.orelse)
+        self.b.patch(skip, 1, self.b.here())
+
+    def stmt_While(self, node: While):
+        for invariant in node.invariants:
+            self.b.emit(MOVE, invariant.address[1], self.b.const(UNSET))
+        start = self.b.here()
+        pos, slot = self.branch_unless(node.cond)
+        self.b.top = self.b.temp_base
+        self.block(node.body)
+        self.b.emit(JUMP, start)
+        self.b.patch(pos, slot, self.b.here())
+
+    def stmt_Match(self, node: Match):
+        subject = self.expr(node.subject)
+        floor = self.b.top
+        ends = []
+        for case in node.cases:
+            pos = None
+            if case.pattern != "_":
+                matched = self.b.alloc()
+                self.b.emit(MATCH, matched, subject, self.b.aux(case.pattern))
+                pos = self.b.emit(JUMP_IF_FALSE, matched)
+            getattr(self, "stmt_" + type(case.body).__name__)(case.body)
+            self.b.top = floor
+            ends.append(self.b.emit(JUMP))
+            if pos is not None:
+                self.b.patch(pos, 2, self.b.here())
+        self.b.emit(NO_MATCH, subject)
+        for pos in ends:
+            self.b.patch(pos, 1, self.b.here())
+
+    def stmt_MethodOp(self, node: MethodOp):
+        getattr(self, f"{node.kind}_op")(node)
+
+    def array_op(self, node: MethodOp):
+        name, op = node.target, node.op
+        array_reg = self.load(node.address)
+        self.b.emit(CHECK_ARRAY, array_reg, self.b.aux(name))
+
+        if op == "sort":
+            self.b.emit(SORT, array_reg, int(node.desc))
+            self.store(node.address, array_reg, define=False)
+        elif op in STATISTICS:
+            result = self.b.alloc()
+            self.b.emit(PROVEN_STATISTIC if node.numeric else STATISTIC, result, array_reg, STATISTICS.index(op))
+            self.store(node.result_addresses[0], result)
+        elif op == "play":
+            self.b.emit(PLAY, array_reg)
+        elif op == "linreg":
+            y_reg = self.expr(node.arg)
+            base = self.b.alloc()
+            self.b.alloc()
+            self.b.alloc()
+            self.b.emit(PROVEN_LINREG if node.numeric else LINREG, base, array_reg, y_reg)
+            for offset, address in enumerate(node.result_addresses):
+                self.store(address, base + offset)
+        elif op in ("rotate", "shift"):
+            positions = self.expr(node.arg)
+            result = self.b.alloc()
+            self.b.emit(ROTATE if op == "rotate" else SHIFT, result, array_reg, positions)
+            self.store(node.result_addresses[0], result)
+        else:
+            index = self.lambda_body(node.lam)
+            result = self.b.alloc()
+            self.b.emit(FILTER if op == "filter" else MAP, result, array_reg, index)
+            self.store(node.result_addresses[0], result)
+
+    def stmt_Pipeline(self, node: Pipeline):
+        first = node.stages[0]
+        array_reg = self.load(first.address)
+        self.b.emit(CHECK_ARRAY, array_reg, self.b.aux(first.target))
+        stages = []
+        for stage in node.stages:
+            if stage.op in ("filter", "map"):
+                stages.append((stage.op, self.lambda_body(stage.lam)))
+            elif stage.op in ("rotate", "shift"):
+                stages.append((stage.op, self.expr(stage.arg)))
+            else:
+                stages.append((stage.op, stage.numeric))
+        result = self.b.alloc()
+        self.b.emit(PIPELINE, result, array_reg, self.b.aux(tuple(stages)))
+        self.store(node.stages[-1].result_addresses[0], result)
+
+    def lambda_body(self, lam: Lambda):
+        param = lam.address[1]
+        skip = self.b.emit(JUMP)
+        start = self.b.here()
+        self.b.emit(YIELD, self.expr(lam.body))
+        self.b.patch(skip, 1, self.b.here())
+        # Captured variables are read by address: a register, or a global slot.
+        self.b.obj.lambdas.append((param, start, vector_plan(lam.body, lam.param, lambda name: name.address)))
+        return len(self.b.obj.lambdas) - 1
+
+    def list_op(self, node: MethodOp):
+        list_reg = self.load(node.address)
+        self.b.emit(CHECK_LIST, list_reg, self.b.aux(node.target))
+        if node.op == "append":
+            self.b.emit(LIST_APPEND, list_reg, self.expr(node.arg))
+        elif node.op == "remove":
+            self.b.emit(LIST_REMOVE, list_reg, self.expr(node.arg))
+        else:
+            self.b.emit(LIST_SORT, list_reg, int(node.desc))
+
+    def matrix_op(self, node: MethodOp):
+        name, op = node.target, node.op
+        matrix = self.b.alloc()
+        self.b.emit(TO_MATRIX, matrix, self.load(node.address), self.b.aux(name))
+        self.store(node.address, matrix)
+
+        result = self.b.alloc()
+        if op == "add":
+            self.b.emit(MATRIX_ADD, result, matrix, self.expr(node.arg))
+        elif op == "multiply":
+            self.b.emit(MATRIX_MULTIPLY, result, matrix, self.expr(node.arg))
+        elif op == "invert":
+            self.b.emit(MATRIX_INVERT, result, matrix, self.b.aux(name))
+        else:
+            self.b.emit(MATRIX_TRANSPOSE, result, matrix)
+        self.store(node.result_addresses[0], result)
+
+    # Expressions
+
+    def expr(self, node, dst=None):
+        """Compiles node and returns the register holding its value.
+
+        When dst is given the value always ends up in dst; otherwise an
+        existing local or constant register may be returned directly.
+        """
+        return getattr(self, "expr_" + type(node).__name__)(node, dst)
+
+    def expr_Const(self, node: Const, dst):
+        reg = self.b.const(node.value)
+        if dst is None:
+            return reg
+        self.b.emit(MOVE, dst, reg)
+        return dst
+
+    def expr_Name(self, node: Name, dst):
+        return self.load(node.address, dst)
+
+    def expr_Neg(self, node: Neg, dst):
+        operand = self.expr(node.operand)
+        dst = self.b.alloc() if dst is None else dst
+        self.b.emit(NEG, dst, operand)
+        return dst
+
+    def expr_ListLit(self, node: ListLit, dst):
+        base = self.b.top
+        for item in node.items:
+            reg = self.b.alloc()
+            mark = self.b.top
+            self.expr(item, reg)
+            self.b.top = mark
+        dst = self.b.alloc() if dst is None else dst
+        self.b.emit(BUILD_LIST, dst, base, len(node.items))
+        return dst
+
+    def expr_NumericListLit(self, node: NumericListLit, dst):
+        dst = self.b.alloc() if dst is None else dst
+        self.b.emit(LOAD_NUMBERS, dst, self.b.aux(node.literal))
+        return dst
+
+    def expr_Index(self, node: Index, dst):
+        container = self.expr(node.container)
+        index = self.expr(node.index)
+        dst = self.b.alloc() if dst is None else dst
+        pos = self.b.emit(INDEX, dst, container, index)
+        self.b.obj.debug[pos] = node.text
+        return dst
+
+    def expr_Invariant(self, node: Invariant, dst):
+        slot = node.address[1]  # always a local slot, see Resolver.stmt_While
+        skip = self.b.emit(JUMP_IF_BOUND, slot)
+        self.expr(node.expr, slot)
+        self.b.patch(skip, 2, self.b.here())
+        if dst is None or dst == slot:
+            return slot
+        self.b.emit(MOVE, dst, slot)
+        return dst
+
+    def expr_BinOp(self, node: BinOp, dst):
+        left = self.expr(node.left)
+        right = self.expr(node.right)
+        dst = self.b.alloc() if dst is None else dst
+        self.b.emit(BINARY_OPCODES[node.op], dst, left, right)
+        return dst
+
+    def expr_Call(self, node: Call, dst):
+        base = self.call_operands(node)
+        dst = base if dst is None else dst
+        self.b.emit(CALL, dst, base, len(node.args))
+        return dst
+
+    def expr_Inline(self, node: Inline, dst):
+        base = self.call_operands(node.call)
+        dst = base if dst is None else dst
+        guard = self.b.emit(JUMP_UNLESS_INLINE, base, 0, self.function(node.decl))
+        for i, address in enumerate(node.addresses):
+            self.b.emit(MOVE, address[1], base + 1 + i)
+        self.expr(node.body, dst)
+        done = self.b.emit(JUMP)
+        self.b.patch(guard, 2, self.b.here())
+        self.b.emit(CALL, dst, base, len(node.call.args))
+        self.b.patch(done, 1, self.b.here())
+        return dst
+
+    def call_operands(self, node: Call):
+        """Loads the callee and then the arguments into consecutive registers; returns the first."""
+        base = self.b.alloc()
+        self.load(node.address, base)
+        for arg in node.args:
+            reg = self.b.alloc()
+            mark = self.b.top
+            self.expr(arg, reg)
+            self.b.top = mark
+        return base
+
+
+def compile_program(program: Program) -> BytecodeProgram:
+    return BytecodeCompiler().compile(program)
+
+
+def disassemble(code_obj: CodeObject) -> str:
+    lines = []
+    code = code_obj.code
+    for pos in range(0, len(code), INSTRUCTION_WIDTH):
+        op, a, b, c = code[pos:pos + INSTRUCTION_WIDTH]
+        lines.append(f"{pos:5d} {OPCODES[op]:<18} {a:4d} {b:4d} {c:4d}")
+    return "\n".join(lines)
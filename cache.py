@@ -0,0 +1,387 @@
+import atexit
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Optional
+from antlr4.PredictionContext import ArrayPredictionContext, PredictionContext, SingletonPredictionContext
+from antlr4.atn.ATNConfig import ATNConfig
+from antlr4.atn.ATNConfigSet import ATNConfigSet
+from antlr4.atn.ATNSimulator import ATNSimulator
+from antlr4.atn.SemanticContext import SemanticContext
+from antlr4.dfa.DFA import DFA
+from antlr4.dfa.DFAState import DFAState, PredPrediction
+import interpreter
+import lowering
+import optimizer
+import typecheck
+from SimpleLangParser import SimpleLangParser, serializedATN
+from lowering import Program
+
+
+CACHE_DIR_NAME = "__arrcache__"
+CACHE_SUFFIX = ".pickle"
+MAX_ENTRIES = 512
+DFA_CACHE_NAME = "SimpleLangParser.dfa" + CACHE_SUFFIX
+DFA_FORMAT = 1
+
+
+def _fingerprint() -> bytes:
+    """Hash of everything that decides the shape of a lowered program.
+
+    A change to the grammar, the lowering pass, the analyses it reads
+    (optimizer.py, typecheck.py) or the type classes it pickles produces a
+    different key, so stale entries are simply never hit again.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(serializedATN()).encode())
+    for module in (lowering, optimizer, typecheck, interpreter):
+        with open(module.__file__, "rb") as source:
+            digest.update(source.read())
+    return digest.digest()
+
+
+class ProgramCache:
+    """Stores lowered programs on disk, keyed by source hash, like __pycache__.
+
+    Entries live in an `__arrcache__` directory next to the script unless a
+    cache directory is given. Storing an entry removes older entries for the
+    same script, and the directory is trimmed to MAX_ENTRIES least recently
+    used files.
+    """
+
+    _fingerprint = None
+
+    def __init__(self, cache_dir: Optional[str] = None, max_entries: int = MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source: str) -> str:
+        if ProgramCache._fingerprint is None:
+            ProgramCache._fingerprint = _fingerprint()
+        digest = hashlib.sha256(ProgramCache._fingerprint)
+        digest.update(source.encode())
+        return digest.hexdigest()[:32]
+
+    def directory_for(self, script_path: str) -> str:
+        if self.cache_dir is not None:
+            return self.cache_dir
+        return os.path.join(os.path.dirname(os.path.abspath(script_path)), CACHE_DIR_NAME)
+
+    def entry_path(self, script_path: str, source: str) -> str:
+        name = os.path.basename(script_path)
+        return os.path.join(self.directory_for(script_path), f"{name}.{self.key(source)}{CACHE_SUFFIX}")
+
+    def load(self, script_path: str, source: str) -> Optional[Program]:
+        path = self.entry_path(script_path, source)
+        try:
+            with open(path, "rb") as entry:
+                program = pickle.load(entry)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # Unreadable or truncated entry; drop it and parse again.
+            self._remove(path)
+            self.misses += 1
+            return None
+        if not isinstance(program, Program):
+            self._remove(path)
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return program
+
+    def store(self, script_path: str, source: str, program: Program) -> bool:
+        path = self.entry_path(script_path, source)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            data = pickle.dumps(program, protocol=pickle.HIGHEST_PROTOCOL)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as entry:
+                entry.write(data)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError, RecursionError):
+            return False
+        self.evict(directory, os.path.basename(script_path), keep=path)
+        return True
+
+    def evict(self, directory: str, script_name: str, keep: str):
+        try:
+            entries = [
+                os.path.join(directory, name)
+                for name in os.listdir(directory)
+                if name.endswith(CACHE_SUFFIX)
+            ]
+        except OSError:
+            return
+        prefix = script_name + "."
+        remaining = []
+        for path in entries:
+            name = os.path.basename(path)
+            stale = (
+                path != keep
+                and name.startswith(prefix)
+                and "." not in name[len(prefix):-len(CACHE_SUFFIX)]
+            )
+            if stale:
+                self._remove(path)
+            else:
+                remaining.append(path)
+
+        if len(remaining) > self.max_entries:
+            remaining.sort(key=self._mtime)
+            for path in remaining[:len(remaining) - self.max_entries]:
+                if path != keep:
+                    self._remove(path)
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class DFACache:
+    """Keeps SimpleLangParser's prediction DFA warm across processes.
+
+    ANTLR builds the DFA for each decision lazily, by simulating the ATN the
+    first time a decision sees a new lookahead, and throws it away when the
+    process exits. install() loads the DFA states and the shared prediction
+    context cache saved by earlier runs and saves them again at exit if
+    parsing added states. The file is keyed by the serialized ATN, so a
+    grammar change simply ignores it.
+
+    The saved form is flat: ATN states are stored by number and prediction
+    contexts are rebuilt through their constructors, because their cached
+    hash codes are only valid within one process.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, parser_class=SimpleLangParser):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), CACHE_DIR_NAME)
+        self.path = os.path.join(cache_dir, DFA_CACHE_NAME)
+        self.parser_class = parser_class
+        self.loaded_states = 0
+
+    @staticmethod
+    def key() -> str:
+        digest = hashlib.sha256(repr(serializedATN()).encode())
+        digest.update(str(DFA_FORMAT).encode())
+        return digest.hexdigest()
+
+    def state_count(self) -> int:
+        return sum(len(dfa._states) for dfa in self.parser_class.decisionsToDFA)
+
+    def install(self) -> bool:
+        loaded = self.load()
+        atexit.register(self.store)
+        return loaded
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, "rb") as entry:
+                key, data = pickle.load(entry)
+        except FileNotFoundError:
+            return False
+        except Exception:
+            ProgramCache._remove(self.path)
+            return False
+        if key != self.key():
+            return False
+        try:
+            self.restore(data)
+        except Exception:
+            # Leave the parser with fresh DFAs rather than a half-restored one.
+            self.reset()
+            ProgramCache._remove(self.path)
+            return False
+        self.loaded_states = self.state_count()
+        return True
+
+    def store(self) -> bool:
+        if self.state_count() <= self.loaded_states:
+            return False
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            data = pickle.dumps((self.key(), self.snapshot()), protocol=pickle.HIGHEST_PROTOCOL)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as entry:
+                entry.write(data)
+            os.replace(tmp_path, self.path)
+        except (OSError, pickle.PicklingError, RecursionError):
+            return False
+        self.loaded_states = self.state_count()
+        return True
+
+    def reset(self):
+        parser = self.parser_class
+        for i, decision_state in enumerate(parser.atn.decisionToState):
+            parser.decisionsToDFA[i] = DFA(decision_state, i)
+        parser.sharedContextCache.cache.clear()
+
+    # Flattening
+
+    def snapshot(self):
+        contexts, context_index = [], {}
+
+        def encode_context(ctx):
+            if ctx is None:
+                return None
+            index = context_index.get(id(ctx))
+            if index is not None:
+                return index
+            if ctx is PredictionContext.EMPTY:
+                entry = ("$",)
+            elif isinstance(ctx, ArrayPredictionContext):
+                entry = ("a", tuple(encode_context(parent) for parent in ctx.parents), tuple(ctx.returnStates))
+            else:
+                entry = ("s", encode_context(ctx.parentCtx), ctx.returnState)
+            index = context_index[id(ctx)] = len(contexts)
+            contexts.append(entry)
+            return index
+
+        def encode_configs(configs):
+            return (
+                configs.fullCtx,
+                configs.readonly,
+                tuple(
+                    (
+                        config.state.stateNumber,
+                        config.alt,
+                        encode_context(config.context),
+                        None if config.semanticContext is SemanticContext.NONE else config.semanticContext,
+                        config.reachesIntoOuterContext,
+                        config.precedenceFilterSuppressed,
+                    )
+                    for config in configs.configs
+                ),
+                configs.uniqueAlt,
+                configs.conflictingAlts,
+                configs.hasSemanticContext,
+                configs.dipsIntoOuterContext,
+            )
+
+        dfas = []
+        for dfa in self.parser_class.decisionsToDFA:
+            if not dfa._states:
+                continue
+            states = list(dfa._states)
+            members = len(states)
+            if dfa.s0 is not None and dfa.s0 not in dfa._states:
+                states.append(dfa.s0)
+            state_index = {id(state): i for i, state in enumerate(states)}
+            encoded = []
+            i = 0
+            while i < len(states):
+                state = states[i]
+                edges = None
+                if state.edges is not None:
+                    edges = []
+                    for target in state.edges:
+                        if target is None:
+                            edges.append(None)
+                        elif target is ATNSimulator.ERROR:
+                            edges.append(-1)
+                        else:
+                            if id(target) not in state_index:
+                                state_index[id(target)] = len(states)
+                                states.append(target)
+                            edges.append(state_index[id(target)])
+                predicates = None
+                if state.predicates is not None:
+                    predicates = [(p.pred, p.alt) for p in state.predicates]
+                encoded.append((
+                    state.stateNumber,
+                    encode_configs(state.configs),
+                    edges,
+                    state.isAcceptState,
+                    state.prediction,
+                    state.requiresFullContext,
+                    predicates,
+                ))
+                i += 1
+            s0 = None if dfa.s0 is None else state_index[id(dfa.s0)]
+            dfas.append((dfa.decision, encoded, members, s0))
+
+        shared = [encode_context(ctx) for ctx in self.parser_class.sharedContextCache.cache]
+        return contexts, dfas, shared
+
+    def restore(self, data):
+        contexts_data, dfas, shared = data
+        parser = self.parser_class
+        atn_states = parser.atn.states
+
+        contexts = []
+        for entry in contexts_data:
+            if entry[0] == "$":
+                ctx = PredictionContext.EMPTY
+            elif entry[0] == "a":
+                parents = [None if i is None else contexts[i] for i in entry[1]]
+                ctx = ArrayPredictionContext(parents, list(entry[2]))
+            else:
+                parent = None if entry[1] is None else contexts[entry[1]]
+                ctx = SingletonPredictionContext(parent, entry[2])
+            contexts.append(ctx)
+
+        def decode_configs(encoded):
+            full_ctx, readonly, items, unique_alt, conflicting_alts, has_semantic, dips = encoded
+            configs = ATNConfigSet(full_ctx)
+            for state_number, alt, context, semantic, reaches, suppressed in items:
+                config = ATNConfig(atn_states[state_number], alt, None if context is None else contexts[context], semantic)
+                config.reachesIntoOuterContext = reaches
+                config.precedenceFilterSuppressed = suppressed
+                configs.configs.append(config)
+            configs.uniqueAlt = unique_alt
+            configs.conflictingAlts = conflicting_alts
+            configs.hasSemanticContext = has_semantic
+            configs.dipsIntoOuterContext = dips
+            if readonly:
+                configs.setReadonly(True)
+            else:
+                for config in configs.configs:
+                    configs.getOrAdd(config)
+            return configs
+
+        restored = {}
+        for decision, encoded, members, s0 in dfas:
+            dfa = DFA(parser.atn.decisionToState[decision], decision)
+            states = []
+            for number, configs, _, accept, prediction, full_context, predicates in encoded:
+                state = DFAState(number, decode_configs(configs))
+                state.isAcceptState = accept
+                state.prediction = prediction
+                state.requiresFullContext = full_context
+                if predicates is not None:
+                    state.predicates = [PredPrediction(pred, alt) for pred, alt in predicates]
+                states.append(state)
+            for state, (_, _, edges, *_) in zip(states, encoded):
+                if edges is not None:
+                    state.edges = [
+                        None if target is None else ATNSimulator.ERROR if target == -1 else states[target]
+                        for target in edges
+                    ]
+            dfa._states = {state: state for state in states[:members]}
+            if s0 is not None:
+                dfa.s0 = states[s0]
+            restored[decision] = dfa
+
+        for decision, dfa in restored.items():
+            parser.decisionsToDFA[decision] = dfa
+        parser.sharedContextCache.cache = {contexts[i]: contexts[i] for i in shared}
@@ -0,0 +1,720 @@
+from typing import Any, List, Optional
+from interpreter import (
+    BINARY_OPERATORS,
+    MISSING,
+    ArrayOperations,
+    ArrayType,
+    ListType,
+    Memo,
+    MusicPlayer,
+    ReturnValue,
+    StatisticsCache,
+    TailCall,
+    Type,
+    TypedArray,
+    VectorLambda,
+    is_ndarray,
+    memo_key,
+    np,
+    type_name,
+)
+from lowering import (
+    Assign,
+    BinOp,
+    Block,
+    Call,
+    CallStmt,
+    Const,
+    FuncDecl,
+    If,
+    Index,
+    Inline,
+    Invariant,
+    ListLit,
+    NumericListLit,
+    Match,
+    MethodOp,
+    Name,
+    Neg,
+    Pipeline,
+    Program,
+    Return,
+    VarDecl,
+    While,
+    vector_plan,
+)
+from resolver import LOCAL, STATISTICS, UNSET, Frame, GlobalFrame, resolve, result_names
+
+
+class CompiledFunction:
+    __slots__ = ("name", "params", "return_type", "body", "frame_size", "env", "memo", "decl", "defaults")
+
+    def __init__(self, name, params, return_type, body, frame_size, env, memo=None, decl=None):
+        self.name = name
+        self.params = params
+        self.return_type = return_type
+        self.body = body
+        self.frame_size = frame_size
+        self.env = env
+        self.memo = memo
+        self.decl = decl  # the FuncDecl, which Inline call sites check for
+
+    def pad(self, args: List[Any]) -> List[Any]:
+        """args and then, for each parameter the call leaves out, its default or else GlobalFrame.parameter."""
+        padded = list(args)
+        for (name, _, default), param in zip(self.params[len(args):], self.decl.params[len(args):]):
+            padded.append(default if param.default is not None else self.env.parameter(name))
+        return padded
+
+
+def match_pattern(value, pattern):
+    if pattern == "_":  # Wildcard matches anything
+        return True
+    if isinstance(pattern, list):  # Array pattern matching
+        if not isinstance(value, (list, TypedArray)) or len(value) != len(pattern):
+            return False
+        return all(match_pattern(v, p) for v, p in zip(value, pattern))
+    if type(value) != type(pattern):
+        return False
+    return value == pattern
+
+
+def declared_default(var_type):
+    """Returns a factory for the value of a `let` without an initializer."""
+    if var_type == Type.FLOAT:
+        return lambda: 0.0
+    elif var_type == Type.INT:
+        return lambda: 0
+    elif var_type == Type.BOOL:
+        return lambda: False
+    elif var_type == Type.STRING:
+        return lambda: ""
+    elif isinstance(var_type, ArrayType):
+        if var_type.element_type == Type.FLOAT or var_type.element_type == ArrayType(Type.FLOAT):
+            return lambda: np.array([])
+        if var_type.element_type in TypedArray.CLASSES:
+            return lambda: TypedArray(var_type.element_type)
+        return list
+    elif isinstance(var_type, ListType):
+        return list
+    return lambda: None
+
+
+def converts_to_ndarray(var_type):
+    return isinstance(var_type, ArrayType) and (
+        var_type.element_type == Type.FLOAT or var_type.element_type == ArrayType(Type.FLOAT)
+    )
+
+
+def typed_element(var_type) -> Optional[Type]:
+    """The element type of an array<int>, array<bool> or array<string>, which declarations store as a TypedArray."""
+    if isinstance(var_type, ArrayType) and var_type.element_type in TypedArray.CLASSES:
+        return var_type.element_type
+    return None
+
+
+class ClosureCompiler:
+    """Compiles a resolved Program into nested Python closures.
+
+    Statement closures take the current Frame and return either None or a
+    ReturnValue; expression closures take the Frame and return the value.
+    Variables are read straight out of frame slots using the addresses the
+    resolver computed, and blocks share the frame of their function.
+    """
+
+    def __init__(
+        self,
+        global_frame: GlobalFrame,
+        memo_size: int = 0,
+        memos: Optional[List[Memo]] = None,
+        statistics: Optional[StatisticsCache] = None,
+    ):
+        self.global_frame = global_frame
+        self.memo_size = memo_size
+        self.memos = [] if memos is None else memos
+        self.statistics = StatisticsCache() if statistics is None else statistics
+
+    def compile_program(self, program: Program):
+        items = [self.compile_stmt(item) for item in program.body]
+        frame_size = program.frame_size
+        global_frame = self.global_frame
+
+        def run_program():
+            frame = Frame(frame_size, global_frame)
+            for item in items:
+                item(frame)
+
+        return run_program
+
+    # Variable access
+
+    def reader(self, address, name):
+        depth, slot = address
+        if depth == LOCAL:
+            return lambda frame: frame.slots[slot]
+        global_slots = self.global_frame.slots
+
+        def read_global(frame):
+            value = global_slots[slot]
+            if value is UNSET:
+                raise NameError(f"Variable '{name}' is not defined")
+            return value
+
+        return read_global
+
+    def writer(self, address, name, define=True):
+        """Returns write(frame, value); define=False requires the variable to exist."""
+        depth, slot = address
+        if depth == LOCAL:
+            def write_local(frame, value):
+                frame.slots[slot] = value
+
+            return write_local
+        global_slots = self.global_frame.slots
+        if define:
+            def define_global(frame, value):
+                global_slots[slot] = value
+
+            return define_global
+
+        def assign_global(frame, value):
+            if global_slots[slot] is UNSET:
+                raise NameError(f"Variable '{name}' is not defined")
+            global_slots[slot] = value
+
+        return assign_global
+
+    # Statements
+
+    def compile_stmt(self, node):
+        method = getattr(self, "compile_" + type(node).__name__)
+        return method(node)
+
+    def compile_FuncDecl(self, node: FuncDecl):
+        name = node.name
+        param_names = tuple(param.name for param in node.params)
+        param_types = [param.type for param in node.params]
+        defaults = [self.compile_expr(param.default) if param.default is not None else None for param in node.params]
+        return_type = node.return_type
+        body = self.compile_Block(node.body)
+        frame_size = node.frame_size
+        define = self.writer(node.address, name)
+        global_frame = self.global_frame
+        memo_size = self.memo_size if node.pure else 0
+        memos = self.memos
+
+        def declare_function(frame):
+            params = [
+                (param_name, param_type, default(frame) if default is not None else None)
+                for param_name, param_type, default in zip(param_names, param_types, defaults)
+            ]
+            memo = None
+            if memo_size > 0:
+                memo = Memo(name, memo_size)
+                memos.append(memo)
+            define(frame, CompiledFunction(name, params, return_type, body, frame_size, global_frame, memo, node))
+
+        return declare_function
+
+    def compile_Block(self, node: Block):
+        stmts = [self.compile_stmt(stmt) for stmt in node.body]
+
+        def run_block(frame):
+            for stmt in stmts:
+                result = stmt(frame)
+                if result is not None:
+                    return result
+
+        return run_block
+
+    def compile_VarDecl(self, node: VarDecl):
+        depth, slot = node.address
+        define = self.writer(node.address, node.name)
+        if node.value is None:
+            make_default = declared_default(node.type)
+
+            def declare_default(frame):
+                define(frame, make_default())
+
+            return declare_default
+
+        if isinstance(node.value, NumericListLit) and node.type == ArrayType(Type.FLOAT):
+            literal = node.value.literal
+
+            def declare_numbers(frame):
+                define(frame, literal.as_ndarray())
+
+            return declare_numbers
+
+        value = self.compile_expr(node.value)
+        if converts_to_ndarray(node.type):
+            def declare_array(frame):
+                define(frame, np.array(value(frame)))
+
+            return declare_array
+
+        element = typed_element(node.type)
+        if element is not None:
+            def declare_typed_array(frame):
+                define(frame, TypedArray.declare(element, value(frame)))
+
+            return declare_typed_array
+
+        if depth == LOCAL:
+            def declare_local(frame):
+                frame.slots[slot] = value(frame)
+
+            return declare_local
+
+        def declare(frame):
+            define(frame, value(frame))
+
+        return declare
+
+    def compile_Assign(self, node: Assign):
+        name = node.name
+        value = self.compile_expr(node.value)
+        if node.index is None:
+            depth, slot = node.address
+            if depth == LOCAL:
+                def assign_local(frame):
+                    frame.slots[slot] = value(frame)
+
+                return assign_local
+
+            assign = self.writer(node.address, name, define=False)
+            return lambda frame: assign(frame, value(frame))
+
+        container_of = self.reader(node.address, name)
+        index = self.compile_expr(node.index)
+        statistics = self.statistics
+
+        def assign_index(frame):
+            container = container_of(frame)
+            i = index(frame)
+            v = value(frame)
+            if not (isinstance(container, (list, TypedArray)) or is_ndarray(container)):
+                raise TypeError(f"Variable '{name}' is expected to be a list or array, got {type(container)}")
+            if not isinstance(i, int):
+                raise TypeError(f"Index must be an integer, got {type(i)}")
+            container[i] = v
+            statistics.changed(container)
+
+        return assign_index
+
+    def compile_CallStmt(self, node: CallStmt):
+        call = self.compile_expr(node.call)
+
+        def call_stmt(frame):
+            call(frame)
+
+        return call_stmt
+
+    def compile_Return(self, node: Return):
+        if node.value is None:
+            return lambda frame: ReturnValue(None)
+        if node.tail:
+            return self.compile_tail_call(node.value)
+        value = self.compile_expr(node.value)
+        return lambda frame: ReturnValue(value(frame))
+
+    def compile_tail_call(self, node: Call):
+        callee = self.reader(node.address, node.name)
+        args_of = [self.compile_expr(arg) for arg in node.args]
+
+        def tail_call(frame):
+            function = callee(frame)
+            args = [arg(frame) for arg in args_of]
+            if isinstance(function, CompiledFunction):
+                return TailCall(function, args)
+            return ReturnValue(function(*args))
+
+        return tail_call
+
+    def compile_If(self, node: If):
+        cond = self.compile_expr(node.cond)
+        then = self.compile_Block(node.then)
+        if node.orelse is None:
+            def run_if(frame):
+                if cond(frame):
+                    return then(frame)
+
+            return run_if
+
+        orelse = self.compile_Block(node.orelse)
+
+        def run_if_else(frame):
+            if cond(frame):
+                return then(frame)
+            return orelse(frame)
+
+        return run_if_else
+
+    def compile_While(self, node: While):
+        cond = self.compile_expr(node.cond)
+        body = self.compile_Block(node.body)
+        invariant_slots = [invariant.address[1] for invariant in node.invariants]
+
+        def run_while(frame):
+            while cond(frame):
+                result = body(frame)
+                if result is not None:
+                    return result
+
+        if not invariant_slots:
+            return run_while
+
+        def run_while_with_invariants(frame):
+            slots = frame.slots
+            for slot in invariant_slots:
+                slots[slot] = UNSET
+            return run_while(frame)
+
+        return run_while_with_invariants
+
+    def compile_Match(self, node: Match):
+        subject = self.compile_expr(node.subject)
+        cases = [(case.pattern, self.compile_stmt(case.body)) for case in node.cases]
+
+        def run_match(frame):
+            value = subject(frame)
+            for pattern, body in cases:
+                if match_pattern(value, pattern):
+                    return body(frame)
+            raise ValueError(f"No matching pattern for value: {value}")
+
+        return run_match
+
+    def compile_MethodOp(self, node: MethodOp):
+        return getattr(self, f"compile_{node.kind}_op")(node)
+
+    def compile_array_op(self, node: MethodOp):
+        name = node.target
+        op = node.op
+        load = self.reader(node.address, name)
+        results = [self.writer(address, result) for address, result in zip(node.result_addresses, result_names(node))]
+
+        statistics = self.statistics
+
+        def load_array(frame):
+            array = load(frame)
+            ArrayOperations.check_array(name, array)
+            return array
+
+        if op == "sort":
+            desc = node.desc
+            assign = self.writer(node.address, name, define=False)
+
+            def run_sort(frame):
+                array = load_array(frame)
+                result = ArrayOperations.sort(array, desc, statistics)
+                if result is not array:
+                    assign(frame, result)
+
+            return run_sort
+
+        if op in STATISTICS:
+            store = results[0]
+
+            proven = node.numeric
+
+            def run_statistic(frame):
+                store(frame, ArrayOperations.statistic(op, load_array(frame), proven, statistics))
+
+            return run_statistic
+
+        if op == "play":
+            def run_play(frame):
+                MusicPlayer.play(load_array(frame))
+
+            return run_play
+
+        if op == "linreg":
+            y_values = self.compile_expr(node.arg)
+            store_slope, store_intercept, store_r_squared = results
+            proven = node.numeric
+
+            def run_linreg(frame):
+                array = load_array(frame)
+                result = ArrayOperations.linreg(array, y_values(frame), proven)
+                store_slope(frame, result["slope"])
+                store_intercept(frame, result["intercept"])
+                store_r_squared(frame, result["r_squared"])
+
+            return run_linreg
+
+        if op in ("rotate", "shift"):
+            positions = self.compile_expr(node.arg)
+            apply = getattr(ArrayOperations, op)
+            store = results[0]
+
+            def run_positional(frame):
+                array = load_array(frame)
+                store(frame, apply(array, positions(frame)))
+
+            return run_positional
+
+        # filter / map
+        lambda_function = self.compile_lambda(node)
+        apply = getattr(ArrayOperations, op)
+        store = results[0]
+
+        def run_lambda_op(frame):
+            store(frame, apply(load_array(frame), *lambda_function(frame)))
+
+        return run_lambda_op
+
+    def compile_lambda(self, node: MethodOp):
+        """frame -> (per-element function, VectorLambda or None) for a filter/map node."""
+        param_depth, param_slot = node.lam.address
+        body = self.compile_expr(node.lam.body)
+        plan = vector_plan(node.lam.body, node.lam.param, self.compile_expr)  # captured names keep their reader
+
+        def lambda_function(frame):
+            slots = frame.slots
+
+            def evaluate(element):
+                slots[param_slot] = element
+                return body(frame)
+
+            return evaluate, None if plan is None else VectorLambda(plan, lambda read: read(frame))
+
+        return lambda_function
+
+    def compile_Pipeline(self, node: Pipeline):
+        first, last = node.stages[0], node.stages[-1]
+        name = first.target
+        load = self.reader(first.address, name)
+        store = self.writer(last.result_addresses[0], result_names(last)[0])
+        stages = []
+        for stage in node.stages:
+            if stage.op in ("filter", "map"):
+                stages.append((stage.op, self.compile_lambda(stage)))
+            elif stage.op in ("rotate", "shift"):
+                stages.append((stage.op, self.compile_expr(stage.arg)))
+            else:
+                stages.append((stage.op, stage.numeric))
+        statistics = self.statistics
+
+        def run_pipeline(frame):
+            array = load(frame)
+            ArrayOperations.check_array(name, array)
+            ops = []
+            for op, operand in stages:
+                if op in ("filter", "map"):
+                    ops.append((op, *operand(frame)))
+                elif op in ("rotate", "shift"):
+                    ops.append((op, operand(frame), None))
+                else:
+                    ops.append((op, operand, None))
+            store(frame, ArrayOperations.pipeline(array, ops, statistics))
+
+        return run_pipeline
+
+    def compile_list_op(self, node: MethodOp):
+        name = node.target
+        op = node.op
+        load = self.reader(node.address, name)
+        value = self.compile_expr(node.arg) if node.arg is not None else None
+        desc = node.desc
+        statistics = self.statistics
+
+        def run_list_op(frame):
+            lst = load(frame)
+            ArrayOperations.check_list(name, lst)
+            if op == "append":
+                ArrayOperations.list_append(lst, value(frame), statistics)
+            elif op == "remove":
+                ArrayOperations.list_remove(lst, value(frame), statistics)
+            else:
+                ArrayOperations.list_sort(lst, desc, statistics)
+
+        return run_list_op
+
+    def compile_matrix_op(self, node: MethodOp):
+        name = node.target
+        op = node.op
+        load = self.reader(node.address, name)
+        store_matrix = self.writer(node.address, name)
+        store = self.writer(node.result_addresses[0], f"{name}_{op}")
+        other = self.compile_expr(node.arg) if node.arg is not None else None
+
+        def load_matrix(frame):
+            matrix = load(frame)
+            if not is_ndarray(matrix):
+                matrix = ArrayOperations.to_matrix(name, matrix)
+                store_matrix(frame, matrix)
+            return matrix
+
+        if op == "add" or op == "multiply":
+            apply = ArrayOperations.matrix_add if op == "add" else ArrayOperations.matrix_multiply
+
+            def run_binary_matrix(frame):
+                matrix = load_matrix(frame)
+                store(frame, apply(matrix, other(frame)))
+
+            return run_binary_matrix
+
+        if op == "invert":
+            def run_invert(frame):
+                store(frame, ArrayOperations.matrix_invert(name, load_matrix(frame)))
+
+            return run_invert
+
+        def run_transpose(frame):
+            store(frame, ArrayOperations.matrix_transpose(load_matrix(frame)))
+
+        return run_transpose
+
+    # Expressions
+
+    def compile_expr(self, node):
+        method = getattr(self, "expr_" + type(node).__name__)
+        return method(node)
+
+    def expr_Const(self, node: Const):
+        value = node.value
+        return lambda frame: value
+
+    def expr_Name(self, node: Name):
+        return self.reader(node.address, node.name)
+
+    def expr_Neg(self, node: Neg):
+        operand = self.compile_expr(node.operand)
+        return lambda frame: -operand(frame)
+
+    def expr_ListLit(self, node: ListLit):
+        items = [self.compile_expr(item) for item in node.items]
+        return lambda frame: [item(frame) for item in items]
+
+    def expr_NumericListLit(self, node: NumericListLit):
+        literal = node.literal
+        return lambda frame: literal.as_list()
+
+    def expr_Invariant(self, node: Invariant):
+        compute = self.compile_expr(node.expr)
+        slot = node.address[1]  # always a local slot, see Resolver.stmt_While
+
+        def invariant(frame):
+            value = frame.slots[slot]
+            if value is UNSET:
+                value = frame.slots[slot] = compute(frame)
+            return value
+
+        return invariant
+
+    def expr_Inline(self, node: Inline):
+        callee = self.reader(node.call.address, node.call.name)
+        args_of = [self.compile_expr(arg) for arg in node.call.args]
+        slots = [address[1] for address in node.addresses]
+        body = self.compile_expr(node.body)
+        decl = node.decl
+
+        def inline(frame):
+            function = callee(frame)
+            args = [arg(frame) for arg in args_of]
+            if type(function) is CompiledFunction and function.decl is decl and function.memo is None:
+                frame_slots = frame.slots
+                for slot, value in zip(slots, args):
+                    frame_slots[slot] = value
+                return body(frame)
+            return call_function(function, args)
+
+        return inline
+
+    def expr_Index(self, node: Index):
+        container_of = self.compile_expr(node.container)
+        index_of = self.compile_expr(node.index)
+        text = node.text
+
+        def index(frame):
+            container = container_of(frame)
+            i = index_of(frame)
+            if not (isinstance(container, (list, TypedArray)) or is_ndarray(container)):
+                raise TypeError(f"Variable '{text}' is not an array or list")
+            if not isinstance(i, int):
+                raise TypeError(f"Index must be an integer, got {type_name(i)}")
+            if i < 0 or i >= len(container):
+                raise IndexError(f"Index {i} is out of range for array of size {len(container)}.")
+            return container[i]
+
+        return index
+
+    def expr_BinOp(self, node: BinOp):
+        left_of = self.compile_expr(node.left)
+        right_of = self.compile_expr(node.right)
+        op = node.op
+        fn = BINARY_OPERATORS[op]
+        numeric = (int, float)
+
+        if node.numeric:
+            return lambda frame: fn(left_of(frame), right_of(frame))
+
+        def binary(frame):
+            left = left_of(frame)
+            right = right_of(frame)
+            if isinstance(left, numeric) and isinstance(right, numeric):
+                return fn(left, right)
+            raise TypeError(
+                f"Unsupported operation '{op}' between {type_name(left)} and {type_name(right)}"
+            )
+
+        return binary
+
+    def expr_Call(self, node: Call):
+        callee = self.reader(node.address, node.name)
+        args_of = [self.compile_expr(arg) for arg in node.args]
+
+        def call(frame):
+            function = callee(frame)
+            args = [arg(frame) for arg in args_of]
+            return call_function(function, args)
+
+        return call
+
+
+def call_function(function, args: List[Any]):
+    memos = None  # (memo, key) of this call and of its tail calls, all of which return the same result
+    while isinstance(function, CompiledFunction):
+        nparams = len(function.params)
+        if len(args) < nparams:
+            args = function.pad(args)  # before the memo key: a default may be a list changed since
+        memo = function.memo
+        if memo is not None:
+            key = memo_key(args)
+            result = memo.get(key)
+            if result is not MISSING:
+                break
+            memos = [(memo, key)] if memos is None else memos + [(memo, key)]
+        frame = Frame(function.frame_size, function.env)
+        frame.slots[:nparams] = args[:nparams]
+        result = function.body(frame)
+        if type(result) is TailCall:
+            function, args = result.function, result.args
+            continue
+        if result is not None:
+            result = result.value
+        break
+    else:
+        result = function(*args)
+    if memos is not None:
+        for memo, key in memos:
+            memo.put(key, result)
+    return result
+
+
+class CompiledInterpreter:
+    """Runs a lowered Program through the resolver and the closure compiler."""
+
+    def __init__(self, memo_size: int = 0, memos: Optional[List[Memo]] = None):
+        self.memo_size = memo_size
+        self.memos = [] if memos is None else memos
+        self.statistics = StatisticsCache()
+
+    def run(self, program: Program):
+        resolve(program)
+        self.global_env = GlobalFrame(program.global_names)
+        self.global_env.define("print", print)
+        self.global_env.define("len", len)
+        run_program = ClosureCompiler(self.global_env, self.memo_size, self.memos, self.statistics).compile_program(program)
+        return run_program()
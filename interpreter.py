@@ -1,18 +1,57 @@
+from array import array
+from collections import OrderedDict
 from contextlib import contextmanager
 import random
 from antlr4 import *
+from SimpleLangParser import SimpleLangParser
 from SimpleLangVisitor import SimpleLangVisitor
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set
 from typing import List, Dict, Union
 from typing import Any, List, Tuple, Union
 from dataclasses import dataclass
 from enum import Enum, auto
+import importlib
+import itertools
+import math
 import operator
-import numpy as np
-from scipy import stats
-import simpleaudio as sa
+import sys
 import time
-import pygame.midi
+import weakref
+
+
+class LazyModule:
+    """Stands in for a heavy module and imports it on first attribute access."""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        value = getattr(importlib.import_module(self._name), attr)
+        # Later lookups of the same attribute no longer reach __getattr__.
+        setattr(self, attr, value)
+        return value
+
+
+# numpy takes longer to import than the rest of the interpreter together, and
+# scripts that never declare a float array or use a matrix op do not need it.
+np = LazyModule("numpy")
+
+
+def is_ndarray(value) -> bool:
+    """isinstance(value, np.ndarray), without importing numpy just to find out it is not one."""
+    numpy = sys.modules.get("numpy")
+    return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+def is_array(value) -> bool:
+    return isinstance(value, (list, TypedArray)) or is_ndarray(value)
+
+
+def type_name(value) -> str:
+    """The type name error messages show; arrays are lists in the language, however they are stored."""
+    return "list" if isinstance(value, TypedArray) or is_ndarray(value) else type(value).__name__
 
 
 class Type(Enum):
@@ -40,6 +79,622 @@ class Function:
     return_type: Type
     body: Any
     env: "Environment"
+    memo: Optional["Memo"] = None
+    # When the body is just `return expr;`: expr, which calls evaluate directly.
+    expression: Any = None
+
+    def __post_init__(self):
+        # The calling convention, worked out once per declaration.
+        self.names = tuple(name for name, _, _ in self.params)
+        self.defaults = {name: default for name, _, default in self.params if default is not None}
+
+    def memo_arguments(self, args) -> Optional[list]:
+        """args with the values of the parameters a call leaves out, as the body will see them, for memo_key.
+
+        A left-out parameter without a default reads the variable of its
+        name in the declaring scope; None if there is none.
+        """
+        if len(args) >= len(self.names):
+            return args
+        padded = list(args)
+        for name in self.names[len(args):]:
+            if name in self.defaults:
+                padded.append(self.defaults[name])
+            else:
+                try:
+                    padded.append(self.env.get(name))
+                except NameError:
+                    return None
+        return padded
+
+    def bind(self, args) -> Dict[str, Any]:
+        """Parameter values for a call with args; missing arguments take their declared default."""
+        values = dict(zip(self.names, args))
+        if len(args) < len(self.names) and self.defaults:
+            for name in self.names[len(args):]:
+                if name in self.defaults:
+                    values[name] = self.defaults[name]
+        return values
+
+
+# The `constant` of expr nodes that optimizer.py could not fold.
+NOT_CONSTANT = object()
+
+
+def literal_value(token):
+    """The value of an INT, FLOAT, BOOL or STRING token."""
+    if token.type == SimpleLangParser.INT:
+        return int(token.text)
+    elif token.type == SimpleLangParser.FLOAT:
+        return float(token.text)
+    elif token.type == SimpleLangParser.BOOL:
+        return token.text == "true"
+    return token.text[1:-1]  # Remove quotes
+
+
+class NumericLiteral:
+    """An array literal whose elements are all INT or FLOAT tokens.
+
+    The tokens are decoded once, in a single pass, into a typed buffer:
+    array('q') when they are all INT, array('d') when they are all FLOAT.
+    Every evaluation then copies the buffer into a fresh list or ndarray in
+    C instead of visiting one expression node per element. A mix of INT and
+    FLOAT keeps a tuple, so the list still holds ints where the source did.
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values
+
+    @classmethod
+    def of(cls, ctx) -> Optional["NumericLiteral"]:
+        """The decoded literal for an ExprContext, or None if it is not one; cached on ctx."""
+        try:
+            return ctx.numeric_literal
+        except AttributeError:
+            ctx.numeric_literal = cls.decode(ctx)
+            return ctx.numeric_literal
+
+    @classmethod
+    def decode(cls, ctx) -> Optional["NumericLiteral"]:
+        children = ctx.children
+        if len(children) < 3 or not isinstance(children[0], TerminalNode) or children[0].symbol.text != "[":
+            return None
+        tokens = []
+        for element in children[1::2]:
+            # Each element must be expr -> primary -> INT/FLOAT; `-` is part of the INT/FLOAT token.
+            if len(element.children) != 1:
+                return None
+            primary = element.children[0]
+            if not isinstance(primary, SimpleLangParser.PrimaryContext):
+                return None
+            token = primary.children[0].symbol
+            if token.type != SimpleLangParser.INT and token.type != SimpleLangParser.FLOAT:
+                return None
+            tokens.append(token)
+        return cls.from_tokens(tokens)
+
+    @classmethod
+    def from_tokens(cls, tokens) -> Optional["NumericLiteral"]:
+        """Decodes a non-empty sequence of INT/FLOAT tokens; None if an INT does not fit in int64."""
+        texts = [token.text for token in tokens]
+        kinds = {token.type for token in tokens}
+        try:
+            if kinds == {SimpleLangParser.INT}:
+                return cls(array("q", map(int, texts)))
+        except OverflowError:  # beyond int64, keep Python ints
+            return None
+        if kinds == {SimpleLangParser.FLOAT}:
+            return cls(array("d", map(float, texts)))
+        return cls(tuple(int(token.text) if token.type == SimpleLangParser.INT else float(token.text) for token in tokens))
+
+    def as_list(self) -> list:
+        if isinstance(self.values, array):
+            return self.values.tolist()
+        return list(self.values)
+
+    def as_ndarray(self) -> "np.ndarray":
+        # int64 for all-INT literals and float64 otherwise, as np.array(self.as_list()) would give.
+        return np.array(self.values)
+
+
+def checked_position(index: int, length: int) -> int:
+    """index into a sequence of length elements, with negative indices counted from the end."""
+    if index < 0:
+        index += length
+    if not 0 <= index < length:
+        raise IndexError("array index out of range")
+    return index
+
+
+class BitArray:
+    """Booleans packed eight to a byte, the buffer of an array<bool>."""
+
+    __slots__ = ("bits", "length")
+
+    def __init__(self, values=()):
+        values = list(values)
+        self.length = len(values)
+        self.bits = bytearray((self.length + 7) // 8)
+        for index, value in enumerate(values):
+            if value:
+                self.bits[index >> 3] |= 1 << (index & 7)
+
+    @classmethod
+    def from_bits(cls, bits: bytes, length: int) -> "BitArray":
+        packed = cls()
+        packed.bits = bytearray(bits)
+        packed.length = length
+        return packed
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        index = checked_position(index, self.length)
+        return bool(self.bits[index >> 3] >> (index & 7) & 1)
+
+    def __setitem__(self, index, value):
+        index = checked_position(index, self.length)
+        if value:
+            self.bits[index >> 3] |= 1 << (index & 7)
+        else:
+            self.bits[index >> 3] &= ~(1 << (index & 7))
+
+    def __iter__(self):
+        bits = self.bits
+        return (bool(bits[index >> 3] >> (index & 7) & 1) for index in range(self.length))
+
+
+class StringBuffer:
+    """Strings stored back to back in one UTF-8 buffer, the buffer of an array<string>.
+
+    Element i is data[offsets[i]:offsets[i + 1]], so the strings cost their
+    encoded bytes plus eight bytes each instead of one str object each.
+    """
+
+    __slots__ = ("data", "offsets")
+
+    def __init__(self, values=()):
+        encoded = [value.encode() for value in values]
+        self.data = bytearray().join(encoded)
+        self.offsets = array("q", itertools.accumulate(map(len, encoded), initial=0))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        index = checked_position(index, len(self))
+        return self.data[self.offsets[index]:self.offsets[index + 1]].decode()
+
+    def __setitem__(self, index, value):
+        index = checked_position(index, len(self))
+        offsets = self.offsets
+        start, end = offsets[index], offsets[index + 1]
+        encoded = value.encode()
+        self.data[start:end] = encoded
+        growth = len(encoded) - (end - start)
+        if growth:
+            for later in range(index + 1, len(offsets)):
+                offsets[later] += growth
+
+    def __iter__(self):
+        data = self.data
+        return (data[start:end].decode() for start, end in itertools.pairwise(self.offsets))
+
+
+class TypedArray:
+    """The value of an array<int>, array<bool> or array<string>, in one contiguous buffer.
+
+    The declared element type picks the buffer: int64 in an array('q'),
+    bools in a BitArray, strings in a StringBuffer. Storing a value the
+    buffer cannot hold (a float, an int beyond 64 bits) moves the elements
+    to a plain list, so a program still reads back what it stored.
+    array<float> values are float64 ndarrays and do not use this class.
+    """
+
+    __slots__ = ("element", "buffer", "version", "__weakref__")
+
+    CLASSES = {Type.INT: int, Type.BOOL: bool, Type.STRING: str}
+    ELEMENTS = {int: Type.INT, bool: Type.BOOL, str: Type.STRING}
+    BUFFERS = {Type.INT: lambda values: array("q", values), Type.BOOL: BitArray, Type.STRING: StringBuffer}
+
+    def __init__(self, element: Type, values=()):
+        self.element = element
+        self.buffer = self.BUFFERS[element](values)
+        self.version = 0  # counts in-place changes, for StatisticsCache
+
+    @classmethod
+    def of(cls, element: Type, values: list) -> Optional["TypedArray"]:
+        """values in the buffer of element, or None if one of them does not fit it."""
+        if set(map(type, values)) - {cls.CLASSES[element]}:
+            return None
+        try:
+            return cls(element, values)
+        except OverflowError:  # beyond int64, keep Python ints
+            return None
+
+    @classmethod
+    def declare(cls, element: Type, value):
+        """The value a `let` of array<element> stores: a TypedArray if value is a list that fits one."""
+        if type(value) is list:
+            typed = cls.of(element, value)
+            if typed is not None:
+                return typed
+        return value
+
+    def like(self, values: list):
+        """New elements computed from this array, kept in a TypedArray.
+
+        They take this array's element type, or the type of the first one
+        when they do not fit that; a list that fits neither is returned as is.
+        """
+        element = self.element
+        if values and type(values[0]) is not self.CLASSES[element]:
+            element = self.ELEMENTS.get(type(values[0]))
+            if element is None:
+                return values
+        typed = TypedArray.of(element, values)
+        return values if typed is None else typed
+
+    @property
+    def numeric(self) -> bool:
+        """Whether every element is known to pass isinstance(x, (int, float)) without a scan."""
+        return self.element is not Type.STRING and type(self.buffer) is not list
+
+    def tolist(self) -> list:
+        return list(self.buffer)
+
+    def to_numpy(self) -> Optional["np.ndarray"]:
+        """The elements as an int64 ndarray (a view of the buffer) or a bool one; None for strings or a list."""
+        if type(self.buffer) is list or self.element is Type.STRING:
+            return None
+        if self.element is Type.INT:
+            return np.frombuffer(self.buffer, dtype=np.int64)
+        bits = np.frombuffer(self.buffer.bits, dtype=np.uint8)
+        return np.unpackbits(bits, count=len(self.buffer), bitorder="little").astype(bool)
+
+    @classmethod
+    def from_numpy(cls, values: "np.ndarray"):
+        """A one-dimensional int64 or bool ndarray as a TypedArray; float64 values become a list, as like() gives."""
+        typed = cls.__new__(cls)
+        typed.version = 0
+        if values.dtype.kind == "i":
+            typed.element = Type.INT
+            typed.buffer = array("q", values.astype(np.int64, copy=False).tobytes())
+        elif values.dtype.kind == "b":
+            typed.element = Type.BOOL
+            typed.buffer = BitArray.from_bits(np.packbits(values, bitorder="little").tobytes(), len(values))
+        else:
+            return values.tolist()
+        return typed
+
+    def sort(self, reverse: bool = False):
+        self.version += 1
+        if type(self.buffer) is list:
+            self.buffer.sort(reverse=reverse)
+        else:
+            self.buffer = self.BUFFERS[self.element](sorted(self.buffer, reverse=reverse))
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __iter__(self):
+        return iter(self.buffer)
+
+    def __getitem__(self, index):
+        return self.buffer[index]
+
+    def __setitem__(self, index, value):
+        self.version += 1
+        if type(value) is not self.CLASSES[self.element] and type(self.buffer) is not list:
+            self.buffer = self.tolist()
+        try:
+            self.buffer[index] = value
+        except OverflowError:
+            self.buffer = self.tolist()
+            self.buffer[index] = value
+
+    def __eq__(self, other):
+        if isinstance(other, (list, TypedArray)):
+            return self.tolist() == list(other)
+        return NotImplemented
+
+    __hash__ = None  # mutable, like the lists it replaces
+
+    def __add__(self, other):
+        if isinstance(other, (list, TypedArray)):
+            return self.like(self.tolist() + list(other))
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, list):
+            return other + self.tolist()
+        return NotImplemented
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self.tolist(), dtype=dtype)
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+
+class NotVectorizable(Exception):
+    """NumPy would not compute what evaluating the lambda body element by element does."""
+
+
+# Shorter arrays are mapped element by element: a round trip through NumPy
+# costs more than it saves, and int-only scripts need not import it at all.
+VECTOR_SIZE = 64
+ARITHMETIC = {"+", "-", "*", "/", "%"}
+COMPARISON = {">", "<", ">=", "<=", "==", "!="}
+
+
+class VectorLambda:
+    """A map/filter lambda body evaluated over the whole array at once with NumPy.
+
+    The plan is the body as nested tuples: ("param",), ("const", value),
+    ("load", key) for a captured variable, read with load(key), ("neg",
+    operand), or (op, left, right) for an operator of BINARY_OPERATORS. A
+    body with anything else (calls, indexing, list literals) has no plan.
+
+    map and filter return None when the array is not numeric or the
+    result could differ from evaluating the body per element, for example
+    on int64 overflow or division by zero. The caller then does exactly
+    that, and raises whatever error the program would have raised.
+    """
+
+    def __init__(self, plan, load):
+        self.plan = plan
+        self.load = load
+        # Elements of an ndarray are numpy scalars, of which only float64 passes
+        # BinaryOp's isinstance(x, (int, float)) check.
+        self.numpy_elements = False
+
+    @classmethod
+    def plan_of(cls, ctx, param: str) -> Optional[tuple]:
+        """The plan of a lambda body's expr parse tree; see lowering.vector_plan for lowered bodies."""
+        constant = getattr(ctx, "constant", NOT_CONSTANT)
+        if constant is not NOT_CONSTANT:
+            return ("const", constant)
+        children = ctx.children
+        if isinstance(ctx, SimpleLangParser.PrimaryContext):
+            token = children[0].symbol
+            if token.type == SimpleLangParser.IDENTIFIER:
+                return ("param",) if token.text == param else ("load", token.text)
+            return ("const", literal_value(token))
+        if len(children) == 1:
+            return cls.plan_of(children[0], param) if isinstance(children[0], SimpleLangParser.PrimaryContext) else None
+        if len(children) == 2 and children[0].getText() == "-":
+            operand = cls.plan_of(children[1], param)
+            return None if operand is None else ("neg", operand)
+        if len(children) == 3 and getattr(ctx, "op", None) is not None:
+            left, right = cls.plan_of(children[0], param), cls.plan_of(children[2], param)
+            if left is None or right is None or ctx.op.text not in BINARY_OPERATORS:
+                return None
+            return (ctx.op.text, left, right)
+        if len(children) == 3 and children[0].getText() == "(":
+            return cls.plan_of(children[1], param)
+        return None
+
+    def map(self, array):
+        values = self.values(array)
+        if values is None:
+            return None
+        try:
+            result = self.run(values, is_ndarray(array))
+        except NotVectorizable:
+            return None
+        if isinstance(array, TypedArray):
+            return TypedArray.from_numpy(result)
+        return ArrayOperations.mapped_ndarray(result)
+
+    def filter(self, array):
+        values = self.values(array)
+        if values is None:
+            return None
+        try:
+            selected = self.select(values, self.run(values, is_ndarray(array)))
+        except NotVectorizable:
+            return None
+        return TypedArray.from_numpy(selected) if isinstance(array, TypedArray) else selected
+
+    @staticmethod
+    def select(values, result) -> "np.ndarray":
+        return values[result if result.dtype.kind == "b" else result != 0]
+
+    @staticmethod
+    def values(array) -> Optional["np.ndarray"]:
+        """The one-dimensional int, float or bool ndarray a plan runs on, if array has one."""
+        if len(array) < VECTOR_SIZE:
+            return None
+        if isinstance(array, TypedArray):
+            return array.to_numpy()
+        if is_ndarray(array) and array.ndim == 1 and array.dtype.kind in "if":
+            return array
+        return None
+
+    def run(self, values, numpy_elements: bool) -> "np.ndarray":
+        """The body over values; numpy_elements tells whether the elements of the array given to the program were numpy scalars."""
+        self.numpy_elements = numpy_elements
+        result = self.evaluate(self.plan, values)
+        if not is_ndarray(result) or result.dtype.kind not in "bif":
+            raise NotVectorizable  # the body does not depend on the parameter
+        if result is values:
+            result = values.copy()  # x => x; the program may change either array afterwards
+        return result
+
+    def evaluate(self, plan, values):
+        kind = plan[0]
+        if kind == "param":
+            return values
+        if kind == "const" or kind == "load":
+            try:
+                value = plan[1] if kind == "const" else self.load(plan[1])
+            except NameError:
+                raise NotVectorizable
+            # Python scalars only: numpy scalars combine with Python ints by different rules.
+            if type(value) not in (int, float, bool) or (type(value) is int and magnitude(value) >= 2**63):
+                raise NotVectorizable
+            return value
+        if kind == "neg":
+            operand = self.evaluate(plan[1], values)
+            if kind_of(operand) == "b" or (kind_of(operand) == "i" and magnitude(operand) >= 2**63):
+                raise NotVectorizable
+            return -operand
+        left, right = self.evaluate(plan[1], values), self.evaluate(plan[2], values)
+        self.check_operands(kind, left, right)
+        try:
+            with np.errstate(divide="raise", over="raise", invalid="raise"):
+                return BINARY_OPERATORS[kind](left, right)
+        except (ArithmeticError, TypeError, ValueError):
+            raise NotVectorizable
+
+    def check_operands(self, op, left, right):
+        """Raises NotVectorizable where NumPy's result could differ from Python's."""
+        kinds = (kind_of(left), kind_of(right))
+        if self.numpy_elements and any(is_ndarray(x) and x.dtype.kind != "f" for x in (left, right)):
+            raise NotVectorizable  # per element this raises TypeError
+        if op in ARITHMETIC:
+            if "b" in kinds:
+                raise NotVectorizable  # True + True is 2 in Python and True in NumPy
+            if kinds == ("i", "i"):
+                bound = magnitude(left) * magnitude(right) if op == "*" else magnitude(left) + magnitude(right)
+                if bound >= 2**63 or (op == "/" and bound > 2**53):
+                    raise NotVectorizable  # int64 overflow, or an inexact conversion to float64
+        elif op in COMPARISON and sorted(kinds) == ["f", "i"]:
+            integer = left if kinds[0] == "i" else right
+            if magnitude(integer) > 2**53:
+                raise NotVectorizable  # NumPy compares through float64, Python exactly
+
+
+def kind_of(value) -> str:
+    """The numpy dtype kind of a plan value: "b", "i" or "f"."""
+    dtype = getattr(value, "dtype", None)
+    if dtype is not None:
+        return dtype.kind
+    return "b" if type(value) is bool else "i" if type(value) is int else "f"
+
+
+def magnitude(value) -> int:
+    """The largest absolute value of an int or a non-empty int64 ndarray, as a Python int."""
+    if type(value) is int:
+        return abs(value)
+    return max(int(value.max()), -int(value.min()))
+
+
+class MethodCall:
+    """An arrayOp, listOp or matrixOp node resolved once into its operation and operands.
+
+    The operation is the keyword token after the `.`, so operand text such
+    as a variable named `adder` can no longer select a different method.
+    """
+
+    __slots__ = (
+        "op", "target", "arg", "desc", "lambda_param", "lambda_body", "vector_plan", "result_name", "handler",
+        "proven_numeric", "stages", "fused",
+    )
+
+    def __init__(self, ctx, handlers):
+        self.op = ctx.getChild(2).getText()
+        self.target = ctx.IDENTIFIER().getText()
+        self.arg = ctx.expr()
+        self.desc = self.op == "sort" and ctx.getChild(4).getText() == "desc"
+        lambda_expr = ctx.lambdaExpr() if hasattr(ctx, "lambdaExpr") else None
+        self.lambda_param = lambda_expr.IDENTIFIER().getText() if lambda_expr else None
+        self.lambda_body = lambda_expr.expr() if lambda_expr else None
+        self.vector_plan = VectorLambda.plan_of(self.lambda_body, self.lambda_param) if lambda_expr else None
+        self.result_name = f"{self.target}_{self.op}"
+        self.handler = handlers.get(self.op)
+        # Set by typecheck.py when the operands are known to be numeric.
+        self.proven_numeric = getattr(ctx, "proven_numeric", False)
+        # Set by optimizer.Pipelines: the first statement of a pipeline runs the later ones, which do nothing.
+        pipeline = getattr(ctx, "pipeline", None)
+        self.stages = None if pipeline is None else [MethodCall.of(stage, handlers) for stage in pipeline[1:]]
+        self.fused = getattr(ctx, "fused", False)
+
+    @classmethod
+    def of(cls, ctx, handlers) -> "MethodCall":
+        """The resolved call for ctx, cached on the node."""
+        try:
+            return ctx.method_call
+        except AttributeError:
+            ctx.method_call = cls(ctx, handlers)
+            return ctx.method_call
+
+
+BINARY_OPERATORS = {
+    "*": operator.mul,
+    "/": operator.truediv,
+    "%": operator.mod,
+    "+": operator.add,
+    "-": operator.sub,
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "and": operator.and_,
+    "or": operator.or_,
+}
+
+
+class BinaryOp:
+    """A binary `expr` node specialized to its operator and operand types.
+
+    The operator function and operand nodes are looked up once. Sites that
+    typecheck.py proved numeric call it without checks; the rest keep a
+    one-entry inline cache of the last operand types that passed the
+    (int, float) check, so int*int, float*float, mixed and comparison sites
+    each pay two `type() is` tests until the types at that site change.
+    Loop invariants (see optimizer.py) are computed once per run of their loop.
+    """
+
+    __slots__ = ("op", "function", "left", "right", "left_type", "right_type", "loop", "compute", "evaluate")
+
+    def __init__(self, ctx):
+        self.op = ctx.op.text
+        self.function = BINARY_OPERATORS[self.op]
+        self.left, self.right = ctx.children[0], ctx.children[2]
+        self.left_type = self.right_type = None
+        self.compute = self.unchecked if getattr(ctx, "proven_numeric", False) else self.guarded
+        self.loop = getattr(ctx, "invariant_in", None)
+        self.evaluate = self.compute if self.loop is None else self.invariant
+
+    @classmethod
+    def of(cls, ctx) -> "BinaryOp":
+        """The specialized operation for ctx, cached on the node."""
+        try:
+            return ctx.binary_op
+        except AttributeError:
+            ctx.binary_op = cls(ctx)
+            return ctx.binary_op
+
+    def unchecked(self, visitor):
+        return self.function(self.left.accept(visitor), self.right.accept(visitor))
+
+    def guarded(self, visitor):
+        left = self.left.accept(visitor)
+        right = self.right.accept(visitor)
+        if type(left) is self.left_type and type(right) is self.right_type:
+            return self.function(left, right)
+        if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+            self.left_type, self.right_type = type(left), type(right)
+            return self.function(left, right)
+        # Raise error for unsupported types in binary operations
+        raise TypeError(
+            f"Unsupported operation '{self.op}' between {type_name(left)} and {type_name(right)}"
+        )
+
+    def invariant(self, visitor):
+        values = self.loop.invariant_values
+        try:
+            return values[self]
+        except KeyError:
+            value = values[self] = self.compute(visitor)
+            return value
 
 
 class ReturnValue:
@@ -47,6 +702,159 @@ class ReturnValue:
         self.value = value
 
 
+class TailCall(ReturnValue):
+    """`return f(...)` of a user function: the caller makes the call once the
+    current function has returned, so tail recursion does not grow the stack."""
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+
+
+# Results a Memo keeps: immutable, so no caller can change a cached value.
+MEMO_RESULT_TYPES = (int, float, bool, str, type(None))
+MISSING = object()
+
+
+def memo_key(args) -> Optional[tuple]:
+    """A hashable snapshot of argument values, or None if one cannot be taken.
+
+    Values are tagged with their type, since 1, 1.0 and true compare equal
+    but do not behave the same.
+    """
+    key = []
+    for value in args:
+        kind = type(value)
+        if kind is int or kind is bool or kind is str or value is None:
+            key.append((kind, value))
+        elif kind is float:
+            key.append((kind, value.hex()))  # tells -0.0 from 0.0
+        elif kind is list or kind is TypedArray:
+            items = memo_key(value)
+            if items is None:
+                return None
+            key.append((kind, items))
+        elif is_ndarray(value) and value.dtype.kind != "O":
+            key.append((kind, value.dtype.str, value.shape, value.tobytes()))
+        else:
+            return None
+    return tuple(key)
+
+
+class Memo:
+    """Results of one pure function by memo_key of its arguments, evicting the least recently used."""
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+        self.results: "OrderedDict[tuple, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """The cached result for key, or MISSING."""
+        if key is not None:
+            value = self.results.get(key, MISSING)
+            if value is not MISSING:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return MISSING
+
+    def put(self, key, value):
+        if key is None or type(value) not in MEMO_RESULT_TYPES:
+            return
+        self.results[key] = value
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+
+    def __str__(self):
+        return f"{self.name}: {self.hits} hit(s), {self.misses} miss(es), {len(self.results)}/{self.size} cached"
+
+
+class StatisticsCache:
+    """Statistic results per (array, version) for the `size` most recently used arrays of one interpreter.
+
+    A TypedArray counts its own in-place changes in `version`. Lists and
+    ndarrays cannot carry one, so their version is kept in their entry
+    and the backends call changed() after changing one in place (index
+    assignment, sort, append, remove). A variable assigned a new array
+    simply finds no entry.
+
+    TypedArrays and ndarrays are held by weak reference, and their entry
+    goes away with them. An ndarray view (such as a row of a matrix)
+    shares its elements with an array the program can change through
+    another name, so its results are not cached, and a change through a
+    view drops the results of the array it views. Lists cannot be, so an entry holds its list;
+    together the cached lists hold at most `elements` elements, and a
+    longer list is not cached at all.
+    """
+
+    def __init__(self, size: int = 64, elements: int = 1_000_000):
+        self.size = size
+        self.elements = elements
+        # id(array) -> [weakref.ref or list, version, {op: result}, elements held]
+        self.entries: "OrderedDict[int, list]" = OrderedDict()
+        self.held = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, op: str, array, compute):
+        """The cached result of op on array, or compute() stored as that."""
+        if is_ndarray(array) and array.base is not None:
+            self.misses += 1
+            return compute()
+        version = array.version if isinstance(array, TypedArray) else None
+        entry = self.entries.get(id(array))
+        if entry is None:
+            entry = self.entry(array, version or 0)
+            if entry is None:
+                self.misses += 1
+                return compute()
+        else:
+            self.entries.move_to_end(id(array))
+            if version is not None and entry[1] != version:
+                entry[1] = version
+                entry[2].clear()
+        results = entry[2]
+        if op in results:
+            self.hits += 1
+            return results[op]
+        self.misses += 1
+        value = results[op] = compute()
+        return value
+
+    def entry(self, array, version: int) -> Optional[list]:
+        """A new entry for array, evicting the least recently used; None for a list too long to hold."""
+        key = id(array)
+        try:
+            target, held = weakref.ref(array, lambda _: self.drop(key)), 0
+        except TypeError:
+            target, held = array, len(array)
+            if held > self.elements:
+                return None
+        entry = self.entries[key] = [target, version, {}, held]
+        self.held += held
+        while len(self.entries) > self.size or self.held > self.elements:
+            self.drop(next(iter(self.entries)))
+        return entry
+
+    def drop(self, key: int):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.held -= entry[3]
+
+    def changed(self, array):
+        """Moves array to a new version after an in-place change, dropping its results."""
+        entry = self.entries.get(id(array))
+        if entry is not None:
+            entry[1] += 1
+            entry[2].clear()
+        if is_ndarray(array) and array.base is not None:
+            self.changed(array.base)
+
+
 class Environment:
     def __init__(self, parent=None):
         self.values: Dict[str, Any] = {}
@@ -72,31 +880,146 @@ class Environment:
         raise NameError(f"Variable '{name}' is not defined")
 
 
+# Versions of GlobalEnvironment bindings; unique across interpreters, so a
+# call site cache filled by one can never look current to another.
+GLOBAL_VERSIONS = itertools.count()
+
+
+class GlobalEnvironment(Environment):
+    """The outermost scope, which changes `version` whenever a name call sites have cached is bound again."""
+
+    def __init__(self):
+        super().__init__()
+        self.version = next(GLOBAL_VERSIONS)
+        self.callees: Set[str] = set()
+
+    def define(self, name: str, value: Any):
+        if name in self.callees:
+            self.version = next(GLOBAL_VERSIONS)
+        self.values[name] = value
+
+    def assign(self, name: str, value: Any):
+        if name not in self.values:
+            raise NameError(f"Variable '{name}' is not defined")
+        if name in self.callees:
+            self.version = next(GLOBAL_VERSIONS)
+        self.values[name] = value
+
+
+class Moments:
+    """Count, mean and sum of squared deviations (M2) of a stream of numbers.
+
+    Values are read once, a chunk at a time: each chunk is summed with
+    fsum and its deviations taken from its own mean, and the chunks are
+    merged with Chan's pairwise update, which stays accurate where the
+    textbook sum-of-squares formula cancels. Partial results from
+    separate parts of the data can be merged the same way with combine,
+    so inputs that never fit in memory at once can be fed through of or
+    of_chunks.
+    """
+
+    __slots__ = ("count", "mean", "m2")
+
+    CHUNK = 4096
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def of(cls, values, label: Optional[str] = None) -> "Moments":
+        """The moments of any iterable of numbers; with a label, non-numbers raise the TypeError of that statistic."""
+        if is_ndarray(values):
+            chunks = (values[start:start + cls.CHUNK] for start in range(0, len(values), cls.CHUNK))
+        else:
+            values = iter(values)
+            chunks = iter(lambda: list(itertools.islice(values, cls.CHUNK)), [])
+        return cls.of_chunks(chunks, label)
+
+    @classmethod
+    def of_chunks(cls, chunks, label: Optional[str] = None) -> "Moments":
+        """The moments of the numbers in an iterable of lists or ndarrays."""
+        moments = cls()
+        for chunk in chunks:
+            if label is not None:
+                StatisticalFunctions.check_numbers(chunk, label)
+            moments = moments.combine(cls.of_chunk(chunk))
+        return moments
+
+    @classmethod
+    def of_chunk(cls, chunk) -> "Moments":
+        count = len(chunk)
+        if count == 0:
+            return cls()
+        if is_ndarray(chunk):
+            mean = float(np.mean(chunk))
+            return cls(count, mean, float(np.sum((chunk - mean) ** 2)))
+        mean = math.fsum(chunk) / count
+        return cls(count, mean, math.fsum((x - mean) ** 2 for x in chunk))
+
+    def combine(self, other: "Moments") -> "Moments":
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            return other
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        mean = self.mean + delta * other.count / count
+        m2 = self.m2 + other.m2 + delta * delta * self.count * other.count / count
+        return Moments(count, mean, m2)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / self.count
+
+    @property
+    def std_dev(self) -> float:
+        return self.variance ** 0.5
+
+
 class StatisticalFunctions:
+    """Statistics over lists and ndarrays.
+
+    mean, variance and std_dev are read from one Moments pass over the
+    data. Given a label, they also check that the elements are numbers
+    during that pass, raising the TypeError ArrayOperations.statistic
+    documents; otherwise callers check.
+    """
+
     @staticmethod
-    def mean(array: Union[List[Union[int, float]], np.ndarray]) -> float:
-        if isinstance(array, np.ndarray):
-            if array.size == 0:
-                raise ValueError("Cannot calculate mean of an empty array.")
-            return float(np.mean(array))
-        elif isinstance(array, list):
-            if not array:
-                raise ValueError("Cannot calculate mean of an empty list.")
-            assert all(isinstance(x, (int, float)) for x in array), "Array elements must be int or float"
-            return float(sum(array)) / len(array)
+    def check_numbers(values, label: str):
+        if not all(isinstance(elem, (int, float)) for elem in values):
+            raise TypeError(f"{label} can only be applied to numerical arrays, but got elements of different types")
+
+    @staticmethod
+    def moments(array, name: str, label: Optional[str] = None) -> Moments:
+        if is_ndarray(array):
+            kind = "array"
+        elif isinstance(array, (list, TypedArray)):
+            kind = "list"
         else:
             raise TypeError("Input must be a list or numpy array.")
+        moments = Moments.of(array, label)
+        if moments.count == 0:
+            raise ValueError(f"Cannot calculate {name} of an empty {kind}.")
+        return moments
+
+    @staticmethod
+    def mean(array: Union[List[Union[int, float]], "np.ndarray"], label: Optional[str] = None) -> float:
+        return StatisticalFunctions.moments(array, "mean", label).mean
 
     @staticmethod
-    def median(array: Union[List[Union[int, float]], np.ndarray]) -> float:
-        if isinstance(array, np.ndarray):
+    def median(array: Union[List[Union[int, float]], "np.ndarray"], label: Optional[str] = None) -> float:
+        if label is not None:
+            StatisticalFunctions.check_numbers(array, label)
+        if is_ndarray(array):
             if array.size == 0:
                 raise ValueError("Cannot calculate median of an empty array.")
             return float(np.median(array))
-        elif isinstance(array, list):
+        elif isinstance(array, (list, TypedArray)):
             if not array:
                 raise ValueError("Cannot calculate median of an empty list.")
-            assert all(isinstance(x, (int, float)) for x in array), "Array elements must be int or float"
             sorted_array = sorted(array)
             n = len(sorted_array)
             if n % 2 == 0:
@@ -106,38 +1029,18 @@ class StatisticalFunctions:
             raise TypeError("Input must be a list or numpy array.")
 
     @staticmethod
-    def variance(array: Union[List[Union[int, float]], np.ndarray]) -> float:
-        if isinstance(array, np.ndarray):
-            if array.size == 0:
-                raise ValueError("Cannot calculate variance of an empty array.")
-            return float(np.var(array))
-        elif isinstance(array, list):
-            if not array:
-                raise ValueError("Cannot calculate variance of an empty list.")
-            assert all(isinstance(x, (int, float)) for x in array), "Array elements must be int or float"
-            mean = StatisticalFunctions.mean(array)
-            return sum((x - mean) ** 2 for x in array) / len(array)
-        else:
-            raise TypeError("Input must be a list or numpy array.")
+    def variance(array: Union[List[Union[int, float]], "np.ndarray"], label: Optional[str] = None) -> float:
+        return StatisticalFunctions.moments(array, "variance", label).variance
 
     @staticmethod
-    def std_dev(array: Union[List[Union[int, float]], np.ndarray]) -> float:
-        if isinstance(array, np.ndarray):
-            if array.size == 0:
-                raise ValueError("Cannot calculate standard deviation of an empty array.")
-            return float(np.std(array))
-        elif isinstance(array, list):
-            if not array:
-                raise ValueError("Cannot calculate standard deviation of an empty list.")
-            assert all(isinstance(x, (int, float)) for x in array), "Array elements must be int or float"
-            return StatisticalFunctions.variance(array) ** 0.5
-        else:
-            raise TypeError("Input must be a list or numpy array.")
+    def std_dev(array: Union[List[Union[int, float]], "np.ndarray"], label: Optional[str] = None) -> float:
+        return StatisticalFunctions.moments(array, "standard deviation", label).std_dev
 
     @staticmethod
-    def linear_regression(x: List[Union[int, float]], y: List[Union[int, float]]) -> Dict[str, float]:
-        assert all(isinstance(i, (int, float)) for i in x), "X elements must be int or float"
-        assert all(isinstance(i, (int, float)) for i in y), "Y elements must be int or float"
+    def linear_regression(x: List[Union[int, float]], y: List[Union[int, float]], proven: bool = False) -> Dict[str, float]:
+        if not proven:
+            assert all(isinstance(i, (int, float)) for i in x), "X elements must be int or float"
+            assert all(isinstance(i, (int, float)) for i in y), "Y elements must be int or float"
         if len(x) != len(y):
             raise ValueError("Arrays must be of equal length")
 
@@ -193,6 +1096,8 @@ class MusicPlayer:
     @contextmanager
     def _midi_context():
         """Context manager for MIDI resources"""
+        import pygame.midi
+
         pygame.midi.init()
 
         print("Available MIDI devices:")
@@ -239,15 +1144,288 @@ class MusicPlayer:
                 time.sleep(0.1)
 
 
+class ArrayOperations:
+    """Implementations of the array/list/matrix methods shared by every backend.
+
+    Callers are responsible for looking the receiver up and for storing the
+    returned values under the ``<name>_<op>`` result variables.
+    """
+
+    STATISTICS = {
+        "mean": (StatisticalFunctions.mean, "Mean"),
+        "median": (StatisticalFunctions.median, "Median"),
+        "variance": (StatisticalFunctions.variance, "Variance"),
+        "stddev": (StatisticalFunctions.std_dev, "Standard deviation"),
+    }
+
+    @staticmethod
+    def check_array(name, array):
+        if not is_array(array):
+            raise TypeError(f"Variable '{name}' is not an array or list")
+
+    @staticmethod
+    def check_list(name, lst):
+        if not isinstance(lst, list):
+            raise TypeError(f"Variable '{name}' is not a list")
+
+    @staticmethod
+    def sort(array, desc, cache: Optional[StatisticsCache] = None):
+        """Sorts in place, keeping the receiver's representation, and returns the value the variable holds afterwards.
+
+        That is the array itself, except for an ndarray of non-numbers (the
+        strings numpy makes of a mixed array<float> literal), which becomes
+        a sorted list, as it always has.
+        """
+        if isinstance(array, (list, TypedArray)):
+            array.sort(reverse=desc)
+        elif is_ndarray(array) and array.dtype.kind not in "biuf":
+            return sorted(array.tolist(), reverse=desc)
+        elif is_ndarray(array):
+            array.sort()
+            if desc:
+                array[...] = array[::-1]
+        else:
+            raise TypeError(f"Unsupported type for sorting: {type(array)}")
+        if cache is not None:
+            cache.changed(array)
+        return array
+
+    @staticmethod
+    def statistic(op, array, proven=False, cache: Optional[StatisticsCache] = None):
+        """`proven` skips the element scan for arrays typecheck.py showed to hold only numbers.
+
+        With a cache, results are reused until the array changes.
+        """
+        function, label = ArrayOperations.STATISTICS[op]
+        # Ensure it's a numerical array for statistical functions; the check runs in the same pass as the statistic
+        proven = proven or (isinstance(array, TypedArray) and array.numeric)
+        if cache is None:
+            return function(array, None if proven else label)
+        return cache.get(op, array, lambda: function(array, None if proven else label))
+
+    @staticmethod
+    def linreg(array, y_array, proven=False):
+        if not proven and (not is_array(y_array) or not all(isinstance(elem, (int, float)) for elem in y_array)):
+            raise TypeError(f"Expected numerical array (list or numpy array) for linear regression, but got {type(y_array)}")
+        return StatisticalFunctions.linear_regression(array, y_array, proven)
+
+    @staticmethod
+    def rotate(array, positions):
+        positions = int(positions)
+        if isinstance(array, TypedArray):
+            return array.like(ArrayOperations.rotate(array.tolist(), positions))
+        if not isinstance(array, list):
+            raise TypeError("Rotate operation requires a list")
+        return array[-positions:] + array[:-positions]
+
+    @staticmethod
+    def shift(array, positions):
+        positions = int(positions)
+        if isinstance(array, TypedArray):
+            return array.like(ArrayOperations.shift(array.tolist(), positions))
+        array_length = len(array)
+
+        if array_length == 0:
+            return []
+        if positions > 0:
+            positions %= array_length
+            return [0] * positions + array[:array_length - positions]
+        elif positions < 0:
+            positions = abs(positions) % array_length
+            return array[positions:] + [0] * positions
+        return array[:]
+
+    @staticmethod
+    def filter(array, predicate, vector: Optional[VectorLambda] = None):
+        """vector, the lambda body compiled for NumPy if it could be, is tried before predicate."""
+        if vector is not None:
+            result = vector.filter(array)
+            if result is not None:
+                return result
+        if is_ndarray(array):
+            return array[np.array([bool(predicate(element)) for element in array], dtype=bool)]
+        result = [element for element in array if predicate(element)]
+        return array.like(result) if isinstance(array, TypedArray) else result
+
+    @staticmethod
+    def map(array, function, vector: Optional[VectorLambda] = None):
+        if vector is not None:
+            result = vector.map(array)
+            if result is not None:
+                return result
+        result = [function(element) for element in array]
+        if isinstance(array, TypedArray):
+            return array.like(result)
+        numbers = is_ndarray(array) and all(isinstance(value, (int, float, np.generic)) for value in result)
+        if numbers and array.ndim == 1:
+            values = np.array(result)
+            if values.dtype.kind in "bif":  # not strings, nor ints beyond int64
+                return ArrayOperations.mapped_ndarray(values)
+        return result
+
+    @staticmethod
+    def mapped_ndarray(values: "np.ndarray"):
+        """The result of mapping an ndarray: float64 values stay an ndarray, others become a list of Python scalars.
+
+        Only float64 elements pass the backends' isinstance(x, (int, float))
+        operand checks, and typecheck.py models the result of map as a list.
+        """
+        return values if values.dtype == np.float64 else values.tolist()
+
+    @staticmethod
+    def pipeline(array, stages, cache: Optional[StatisticsCache] = None):
+        """Runs array methods chained through results nothing else reads (see optimizer.Pipelines).
+
+        stages are (op, operand, vector) triples: for filter and map the
+        per-element function and the VectorLambda or None, for rotate and
+        shift the positions, and for a statistic whether the operands are
+        proven numeric. Consecutive vectorized filter/map stages run on a
+        single NumPy array (see fuse); everything else runs one stage at a
+        time, in order, exactly as the separate statements would.
+        """
+        position = 0
+        while position < len(stages):
+            fused = ArrayOperations.fuse(array, stages[position:])
+            if fused is not None:
+                array, count = fused
+                position += count
+                continue
+            op, operand, vector = stages[position]
+            if op == "filter":
+                array = ArrayOperations.filter(array, operand, vector)
+            elif op == "map":
+                array = ArrayOperations.map(array, operand, vector)
+            elif op in ("rotate", "shift"):
+                array = getattr(ArrayOperations, op)(array, operand)
+            else:
+                array = ArrayOperations.statistic(op, array, operand, cache)
+            position += 1
+        return array
+
+    @staticmethod
+    def fuse(array, stages) -> Optional[tuple]:
+        """(result, stages run) for the leading vectorized filter/map stages, or None if the first cannot run.
+
+        The intermediate results stay ndarrays instead of being converted to
+        the TypedArray or list each statement would store, and only the
+        last is converted: a TypedArray while every result is int or bool,
+        a list once one is float, as ArrayOperations.map gives for a list.
+        Stopping at a stage that cannot be vectorized leaves it to run on
+        its own.
+        """
+        values = VectorLambda.values(array)
+        if values is None:
+            return None
+        numpy_elements = is_ndarray(array)
+        typed = isinstance(array, TypedArray)
+        count = 0
+        for op, _, vector in stages:
+            if vector is None or op not in ("filter", "map") or len(values) == 0:
+                break
+            try:
+                result = vector.run(values, numpy_elements)
+            except NotVectorizable:
+                break
+            values = VectorLambda.select(values, result) if op == "filter" else result
+            typed = typed and values.dtype.kind != "f"
+            count += 1
+        if count == 0:
+            return None
+        if numpy_elements:
+            return ArrayOperations.mapped_ndarray(values), count
+        return (TypedArray.from_numpy(values) if typed else values.tolist()), count
+
+    @staticmethod
+    def list_append(lst, value, cache: Optional[StatisticsCache] = None):
+        lst.append(value)
+        if cache is not None:
+            cache.changed(lst)
+
+    @staticmethod
+    def list_remove(lst, value, cache: Optional[StatisticsCache] = None):
+        if value in lst:
+            lst.remove(value)
+            if cache is not None:
+                cache.changed(lst)
+        else:
+            raise ValueError(f"Value '{value}' not found in the list")
+
+    @staticmethod
+    def list_sort(lst, desc, cache: Optional[StatisticsCache] = None):
+        lst.sort(reverse=desc)
+        if cache is not None:
+            cache.changed(lst)
+
+    @staticmethod
+    def to_matrix(name, matrix):
+        if is_ndarray(matrix):
+            return matrix
+        try:
+            return np.array(matrix)
+        except Exception as e:
+            raise TypeError(f"Variable '{name}' cannot be converted to a numpy matrix: {e}")
+
+    @staticmethod
+    def matrix_add(matrix, other_matrix):
+        other_matrix = np.array(other_matrix)
+        if matrix.size == 0 or other_matrix.size == 0:
+            raise ValueError("Matrix addition requires non-empty matrices.")
+        if matrix.shape != other_matrix.shape:
+            raise ValueError("Matrix addition requires matrices of the same shape.")
+        return np.add(matrix, other_matrix)
+
+    @staticmethod
+    def matrix_multiply(matrix, other_matrix):
+        other_matrix = np.array(other_matrix)
+
+        if matrix.size == 0 or other_matrix.size == 0:
+            raise ValueError("Matrix multiplication requires non-empty matrices.")
+
+        if matrix.shape[1] != other_matrix.shape[0]:
+            raise ValueError(
+                f"Matrix multiplication requires the number of columns in the first matrix "
+                f"({matrix.shape[1]}) to match the number of rows in the second matrix "
+                f"({other_matrix.shape[0]})."
+            )
+        return np.matmul(matrix, other_matrix)
+
+    @staticmethod
+    def matrix_invert(name, matrix):
+        if matrix.size == 0:
+            raise ValueError("Matrix size should not be zero for inversion")
+
+        if matrix.shape[0] != matrix.shape[1]:
+            raise ValueError("Matrix inversion requires a square matrix")
+        try:
+            return np.linalg.inv(matrix)
+        except np.linalg.LinAlgError:
+            raise ValueError(f"Matrix '{name}' is singular and cannot be inverted")
+
+    @staticmethod
+    def matrix_transpose(matrix):
+        return np.transpose(matrix)
+
+
 class Interpreter(SimpleLangVisitor):
-    def __init__(self):
-        self.global_env = Environment()
+    def __init__(self, memo_size: int = 0, memos: Optional[List[Memo]] = None):
+        self.global_env = GlobalEnvironment()
         self.current_env = self.global_env
         self.global_env.define("print", print)
         self.global_env.define("len", len)
         self.music_player = MusicPlayer()
+        self.environments: List[Environment] = []  # released block scopes, reused by visitBlock
+        # With memo_size > 0, functions optimizer.py found pure keep up to that many results.
+        self.memo_size = memo_size
+        self.memos = [] if memos is None else memos
+        self.statistics = StatisticsCache()
 
     def visitProgram(self, ctx):
+        from optimizer import optimize
+        from typecheck import check
+
+        predefined = dict(self.global_env.values)
+        optimize(ctx, predefined)
+        check(ctx, predefined)
         for child in ctx.children[:-1]:
             self.visit(child)
 
@@ -258,11 +1436,25 @@ class Interpreter(SimpleLangVisitor):
             params = self.visit(ctx.paramList())
         return_type = self.visit(ctx.type_())
 
+        memo = None
+        if self.memo_size > 0 and getattr(ctx, "pure", False):
+            memo = Memo(name, self.memo_size)
+            self.memos.append(memo)
+
+        expression = None
+        statements = ctx.block().statement()
+        if len(statements) == 1 and statements[0].returnStmt() is not None:
+            returned = statements[0].returnStmt()
+            if returned.expr() is not None and not getattr(returned, "tail_call", False):
+                expression = returned.expr()
+
         function = Function(
             params=params,
             return_type=return_type,
             body=ctx.block(),
             env=self.current_env,
+            memo=memo,
+            expression=expression,
         )
         self.current_env.define(name, function)
 
@@ -298,11 +1490,18 @@ class Interpreter(SimpleLangVisitor):
         value = None
 
         if ctx.expr():
+            if isinstance(var_type, ArrayType) and var_type.element_type == Type.FLOAT:
+                literal = NumericLiteral.of(ctx.expr())
+                if literal is not None:
+                    self.current_env.define(name, literal.as_ndarray())
+                    return
             value = self.visit(ctx.expr())
             if isinstance(var_type, ArrayType) and var_type.element_type == ArrayType(Type.FLOAT):
                 value = np.array(value)
             elif isinstance(var_type, ArrayType) and var_type.element_type == Type.FLOAT:
                 value = np.array(value)
+            elif isinstance(var_type, ArrayType) and var_type.element_type in TypedArray.CLASSES:
+                value = TypedArray.declare(var_type.element_type, value)
         else:
             if var_type == Type.FLOAT:
                 value = 0.0
@@ -317,6 +1516,8 @@ class Interpreter(SimpleLangVisitor):
                     value = np.array([])
                 elif var_type.element_type == Type.FLOAT:
                     value = np.array([])
+                elif var_type.element_type in TypedArray.CLASSES:
+                    value = TypedArray(var_type.element_type)
                 else:
                     value = []
             elif isinstance(var_type, ListType):
@@ -333,7 +1534,7 @@ class Interpreter(SimpleLangVisitor):
             value = self.visit(exprs[1])
 
             # Ensure the container is a list or array
-            if not isinstance(container, (list, np.ndarray)):
+            if not is_array(container):
                 raise TypeError(f"Variable '{name}' is expected to be a list or array, got {type(container)}")
 
             # Ensure index is an integer
@@ -341,154 +1542,99 @@ class Interpreter(SimpleLangVisitor):
                 raise TypeError(f"Index must be an integer, got {type(index)}")
 
             container[index] = value
+            self.statistics.changed(container)
         else:
             value = self.visit(exprs[0])
             self.current_env.assign(name, value)
 
     def visitArrayOp(self, ctx):
-        array_name = ctx.IDENTIFIER().getText()
-        array = self.current_env.get(array_name)
-        op_text = ctx.getText()
+        call = MethodCall.of(ctx, self.ARRAY_OPS)
+        if call.fused:
+            return None
+        array = self.current_env.get(call.target)
 
         # Check if the variable is a list or array
-        if not isinstance(array, (list, np.ndarray)):
-            raise TypeError(f"Variable '{array_name}' is not an array or list")
-
-        if "sort" in op_text:
-            desc = "desc" in op_text
-            if isinstance(array, list):
-                array.sort(reverse=desc)
-            elif isinstance(array, np.ndarray):
-                if desc:
-                    array = np.sort(array)[::-1] 
-                else:
-                    array = np.sort(array)
-                self.current_env.assign(array_name, array.tolist())
-            else:
-                raise TypeError(f"Unsupported type for sorting: {type(array)}")
-
-        elif "mean" in op_text:
-            # Ensure it's a numerical array for statistical functions
-            if not all(isinstance(elem, (int, float)) for elem in array):
-                raise TypeError(f"Mean can only be applied to numerical arrays, but got elements of different types")
-            result = StatisticalFunctions.mean(array)
-            result_var = array_name + "_mean"
-            self.current_env.define(result_var, result)
-            return result
+        ArrayOperations.check_array(call.target, array)
 
-        elif "median" in op_text:
-            if not all(isinstance(elem, (int, float)) for elem in array):
-                raise TypeError(f"Median can only be applied to numerical arrays, but got elements of different types")
-            result = StatisticalFunctions.median(array)
-            result_var = array_name + "_median"
-            self.current_env.define(result_var, result)
-            return result
+        if call.stages is not None:
+            return self._array_pipeline(call, array)
+        if call.handler is not None:
+            return call.handler(self, call, array)
 
-        elif "variance" in op_text:
-            if not all(isinstance(elem, (int, float)) for elem in array):
-                raise TypeError(f"Variance can only be applied to numerical arrays, but got elements of different types")
-            result = StatisticalFunctions.variance(array)
-            result_var = array_name + "_variance"
-            self.current_env.define(result_var, result)
-            return result
+    def _array_sort(self, call, array):
+        result = ArrayOperations.sort(array, call.desc, self.statistics)
+        if result is not array:
+            self.current_env.assign(call.target, result)
 
-        elif "stddev" in op_text:
-            if not all(isinstance(elem, (int, float)) for elem in array):
-                raise TypeError(f"Standard deviation can only be applied to numerical arrays, but got elements of different types")
-            result = StatisticalFunctions.std_dev(array)
-            result_var = array_name + "_stddev"
-            self.current_env.define(result_var, result)
-            return result
+    def _array_statistic(self, call, array):
+        result = ArrayOperations.statistic(call.op, array, call.proven_numeric, self.statistics)
+        self.current_env.define(call.result_name, result)
+        return result
 
-        elif "play" in op_text:
-            # Play operation on array
-            MusicPlayer.play(array)
-
-        elif "linreg" in op_text:
-            y_array = self.visit(ctx.expr())
-            if not isinstance(y_array, (list, np.ndarray)) or not all(isinstance(elem, (int, float)) for elem in y_array):
-                raise TypeError(f"Expected numerical array (list or numpy array) for linear regression, but got {type(y_array)}")
-            result = StatisticalFunctions.linear_regression(array, y_array)
-            self.current_env.define(array_name + "_slope", result["slope"])
-            self.current_env.define(array_name + "_intercept", result["intercept"])
-            self.current_env.define(array_name + "_r_squared", result["r_squared"])
-            return result
+    def _array_play(self, call, array):
+        MusicPlayer.play(array)
 
-        elif "rotate" in op_text:
-            positions_expr = ctx.expr()
-            if not positions_expr:
-                raise ValueError("Missing number of positions for rotate operation")
-            positions = int(self.visit(positions_expr))
-            if not isinstance(array, list):
-                raise TypeError("Rotate operation requires a list")
-            rotated_array = array[-positions:] + array[:-positions]
-            result_var = array_name + "_rotate"
-            self.current_env.define(result_var, rotated_array)
-            return rotated_array
-
-        elif "shift" in op_text:
-            positions_expr = ctx.expr()
-            if not positions_expr:
-                raise ValueError("Missing number of positions for shift operation")
-            
-            positions = int(self.visit(positions_expr))
-            array_length = len(array)
-            
-            if array_length == 0:
-                shifted_array = []
-            else:
-                if positions > 0:
-                    positions %= array_length
-                    shifted_array = [0] * positions + array[:array_length - positions]
-                elif positions < 0:
-                    positions = abs(positions) % array_length
-                    shifted_array = array[positions:] + [0] * positions
-                else:
-                    shifted_array = array[:]
-
-            result_var = array_name + "_shift"
-            self.current_env.define(result_var, shifted_array)
-            return shifted_array
-
-        elif "filter" in op_text:
-            lambda_expr = ctx.lambdaExpr()
-            if not lambda_expr:
-                raise ValueError("Missing lambda expression for filter operation")
-            lambda_param = lambda_expr.IDENTIFIER().getText()
-            lambda_body = lambda_expr.expr()
-            filtered_array = [element for element in array if self._evaluate_lambda(lambda_param, lambda_body, element)]
-            result_var = array_name + "_filter"
-            self.current_env.define(result_var, filtered_array)
-            return filtered_array
-
-        elif "map" in op_text:
-            lambda_expr = ctx.lambdaExpr()
-            if not lambda_expr:
-                raise ValueError("Missing lambda expression for map operation")
-            lambda_param = lambda_expr.IDENTIFIER().getText()
-            lambda_body = lambda_expr.expr()
-            mapped_array = [self._evaluate_lambda(lambda_param, lambda_body, element) for element in array]
-            result_var = array_name + "_map"
-            self.current_env.define(result_var, mapped_array)
-            return mapped_array
-
-
-    def _evaluate_lambda(self, param_name, lambda_body, value):
-        previous_env = self.current_env
-        self.current_env = Environment(previous_env)
+    def _array_linreg(self, call, array):
+        result = ArrayOperations.linreg(array, self.visit(call.arg), call.proven_numeric)
+        self.current_env.define(call.target + "_slope", result["slope"])
+        self.current_env.define(call.target + "_intercept", result["intercept"])
+        self.current_env.define(call.target + "_r_squared", result["r_squared"])
+        return result
 
-        try:
-            self.current_env.define(param_name, value)
-            result = self.visit(lambda_body)
-        finally:
-            self.current_env = previous_env
+    def _array_move(self, call, array):
+        if not call.arg:
+            raise ValueError(f"Missing number of positions for {call.op} operation")
+        move = ArrayOperations.rotate if call.op == "rotate" else ArrayOperations.shift
+        moved_array = move(array, self.visit(call.arg))
+        self.current_env.define(call.result_name, moved_array)
+        return moved_array
+
+    def _array_apply_lambda(self, call, array):
+        apply = ArrayOperations.filter if call.op == "filter" else ArrayOperations.map
+        result = apply(array, *self._lambda_function(call))
+        self.current_env.define(call.result_name, result)
+        return result
 
+    def _lambda_function(self, call):
+        """The per-element function of a filter/map call, and its VectorLambda if the body has a plan."""
+        if call.lambda_body is None:
+            raise ValueError(f"Missing lambda expression for {call.op} operation")
+        param, body = call.lambda_param, call.lambda_body
+        # The body is an expression and cannot define names, so one scope serves every element.
+        env = Environment(self.current_env)
+        vector = None if call.vector_plan is None else VectorLambda(call.vector_plan, self.current_env.get)
+        return lambda element: self._evaluate_lambda(env, param, body, element), vector
+
+    def _array_pipeline(self, call, array):
+        stages = []
+        for stage in [call] + call.stages:
+            if stage.op in ("filter", "map"):
+                stages.append((stage.op, *self._lambda_function(stage)))
+            elif stage.op in ("rotate", "shift"):
+                stages.append((stage.op, self.visit(stage.arg), None))  # constant after the first stage
+            else:
+                stages.append((stage.op, stage.proven_numeric, None))
+        result = ArrayOperations.pipeline(array, stages, self.statistics)
+        self.current_env.define(call.stages[-1].result_name, result)
         return result
 
-        
-    def _evaluate_lambda(self, param_name, lambda_body, value):
+    ARRAY_OPS = {
+        "sort": _array_sort,
+        "mean": _array_statistic,
+        "median": _array_statistic,
+        "variance": _array_statistic,
+        "stddev": _array_statistic,
+        "play": _array_play,
+        "linreg": _array_linreg,
+        "rotate": _array_move,
+        "shift": _array_move,
+        "filter": _array_apply_lambda,
+        "map": _array_apply_lambda,
+    }
+
+    def _evaluate_lambda(self, env, param_name, lambda_body, value):
         previous_env = self.current_env
-        self.current_env = Environment(previous_env)
+        self.current_env = env
 
         try:
             self.current_env.define(param_name, value)
@@ -499,106 +1645,73 @@ class Interpreter(SimpleLangVisitor):
         return result
 
     def visitListOp(self, ctx):
-        list_name = ctx.IDENTIFIER().getText()
-        lst = self.current_env.get(list_name)
+        call = MethodCall.of(ctx, self.LIST_OPS)
+        lst = self.current_env.get(call.target)
 
-        if not isinstance(lst, list):
-            raise TypeError(f"Variable '{list_name}' is not a list")
+        ArrayOperations.check_list(call.target, lst)
 
-        op_text = ctx.getText()
+        if call.handler is None:
+            raise ValueError(f"Unsupported operation on list: {ctx.getText()}")
+        call.handler(self, call, lst)
 
-        if "append" in op_text:
-            value = self.visit(ctx.expr())
-            lst.append(value)
-        elif "remove" in op_text:
-            value = self.visit(ctx.expr())
-            if value in lst:
-                lst.remove(value)
-            else:
-                raise ValueError(f"Value '{value}' not found in the list")
-        elif "sort" in op_text:
-            desc = "desc" in op_text
-            lst.sort(reverse=desc)
-        else:
-            raise ValueError(f"Unsupported operation on list: {op_text}")
+    def _list_append(self, call, lst):
+        ArrayOperations.list_append(lst, self.visit(call.arg), self.statistics)
+
+    def _list_remove(self, call, lst):
+        ArrayOperations.list_remove(lst, self.visit(call.arg), self.statistics)
 
+    def _list_sort(self, call, lst):
+        ArrayOperations.list_sort(lst, call.desc, self.statistics)
+
+    LIST_OPS = {"append": _list_append, "remove": _list_remove, "sort": _list_sort}
 
     def visitMatrixOp(self, ctx):
-        matrix_name = ctx.IDENTIFIER().getText()
-        matrix = self.current_env.get(matrix_name)
+        call = MethodCall.of(ctx, self.MATRIX_OPS)
+        matrix = self.current_env.get(call.target)
 
-        if not isinstance(matrix, np.ndarray):
-            try:
-                matrix = np.array(matrix)
-                self.current_env.assign(matrix_name, matrix)
-            except Exception as e:
-                raise TypeError(f"Variable '{matrix_name}' cannot be converted to a numpy matrix: {e}")
-
-        op_text = ctx.getText()
-
-        if "add" in op_text:
-            other_matrix = self.visit(ctx.expr())
-            other_matrix = np.array(other_matrix)
-            if matrix.size == 0 or other_matrix.size == 0:
-                raise ValueError("Matrix addition requires non-empty matrices.")
-            if matrix.shape != other_matrix.shape:
-                raise ValueError("Matrix addition requires matrices of the same shape.")
-            result = np.add(matrix, other_matrix)
-            result_var = f"{matrix_name}_add"
-            self.current_env.define(result_var, result)
+        if not is_ndarray(matrix):
+            matrix = ArrayOperations.to_matrix(call.target, matrix)
+            self.current_env.assign(call.target, matrix)
+
+        if call.handler is not None:
+            result = call.handler(self, call, matrix)
+            self.current_env.define(call.result_name, result)
             return result
 
-        elif "multiply" in op_text:
-            other_matrix = self.visit(ctx.expr())
-            other_matrix = np.array(other_matrix)
+    def _matrix_add(self, call, matrix):
+        return ArrayOperations.matrix_add(matrix, self.visit(call.arg))
 
-            if matrix.size == 0 or other_matrix.size == 0:
-                raise ValueError("Matrix multiplication requires non-empty matrices.")
+    def _matrix_multiply(self, call, matrix):
+        return ArrayOperations.matrix_multiply(matrix, self.visit(call.arg))
 
-            if matrix.shape[1] != other_matrix.shape[0]:
-                raise ValueError(
-                    f"Matrix multiplication requires the number of columns in the first matrix "
-                    f"({matrix.shape[1]}) to match the number of rows in the second matrix "
-                    f"({other_matrix.shape[0]})."
-                )
-            result = np.matmul(matrix, other_matrix)
-            result_var = matrix_name + "_multiply"
-            self.current_env.define(result_var, result)
-            return result
+    def _matrix_invert(self, call, matrix):
+        return ArrayOperations.matrix_invert(call.target, matrix)
 
-        elif "invert" in op_text:
-            if matrix.size == 0: 
-                raise ValueError("Matrix size should not be zero for inversion")
+    def _matrix_transpose(self, call, matrix):
+        return ArrayOperations.matrix_transpose(matrix)
 
-            if matrix.shape[0] != matrix.shape[1]:
-                raise ValueError("Matrix inversion requires a square matrix")
-            try:
-                result = np.linalg.inv(matrix)
-                result_var = matrix_name + "_invert"
-                self.current_env.define(result_var, result)
-                return result
-            except np.linalg.LinAlgError:
-                raise ValueError(f"Matrix '{matrix_name}' is singular and cannot be inverted")
+    MATRIX_OPS = {
+        "add": _matrix_add,
+        "multiply": _matrix_multiply,
+        "invert": _matrix_invert,
+        "transpose": _matrix_transpose,
+    }
 
-        elif "transpose" in op_text:
-            result = np.transpose(matrix)
-            result_var = matrix_name + "_transpose"
-            self.current_env.define(result_var, result)
-            return result
-        
     def visitMatchStatement(self, ctx):
         value = self.visit(ctx.expr())
-        for case in ctx.matchCase():
-            pattern = self.visit(case.pattern())
+        cases = getattr(ctx, "live_cases", None)
+        if cases is None:
+            cases = [(self.visit(case.pattern()), case.statement()) for case in ctx.matchCase()]
+        for pattern, statement in cases:
             if self._match_pattern(value, pattern):
-                return self.visit(case.statement())
+                return self.visit(statement)
         raise ValueError(f"No matching pattern for value: {value}")
 
     def _match_pattern(self, value, pattern):
         if pattern == "_":  # Wildcard matches anything
             return True
         if isinstance(pattern, list):  # Array pattern matching
-            if not isinstance(value, list) or len(value) != len(pattern):
+            if not isinstance(value, (list, TypedArray)) or len(value) != len(pattern):
                 return False
             return all(self._match_pattern(v, p) for v, p in zip(value, pattern))
         # Add type checking for mismatched types
@@ -636,6 +1749,13 @@ class Interpreter(SimpleLangVisitor):
             return obj_pattern
 
     def visitIfStatement(self, ctx):
+        live_block = getattr(ctx, "live_block", NOT_CONSTANT)
+        if live_block is not NOT_CONSTANT:  # The condition is constant
+            if live_block is not None:
+                result = self.visit(live_block)
+                if isinstance(result, ReturnValue):
+                    return result
+            return
         condition = self.visit(ctx.expr())
         if condition:
             result = self.visit(ctx.block(0))
@@ -647,37 +1767,92 @@ class Interpreter(SimpleLangVisitor):
                 return result
 
     def visitWhileStatement(self, ctx):
+        if not getattr(ctx, "invariants", None):
+            return self._run_while(ctx)
+        # A fresh table of invariant values for this run; the loop may be re-entered by recursion.
+        outer_values = getattr(ctx, "invariant_values", None)
+        ctx.invariant_values = {}
+        try:
+            return self._run_while(ctx)
+        finally:
+            ctx.invariant_values = outer_values
+
+    def _run_while(self, ctx):
         while self.visit(ctx.expr()):
             result = self.visit(ctx.block())
             if isinstance(result, ReturnValue):
                 return result
 
     def visitBlock(self, ctx):
+        if not getattr(ctx, "declares", True):
+            # optimizer.py found nothing that defines a name here, so the enclosing scope will do.
+            for stmt in ctx.statement():
+                result = self.visit(stmt)
+                if isinstance(result, ReturnValue):
+                    return result
+            return
+
         previous_env = self.current_env
-        self.current_env = Environment(previous_env)
+        # Block scopes never outlive the block (functions are only declared at the
+        # top level), so they are recycled instead of allocated on every entry.
+        pool = self.environments
+        env = pool.pop() if pool else Environment()
+        env.parent = previous_env
+        self.current_env = env
 
         for stmt in ctx.statement():
             result = self.visit(stmt)
             if isinstance(result, ReturnValue):
-                self.current_env = previous_env
-                return result
+                break
+        else:
+            result = None
 
         self.current_env = previous_env
+        env.values.clear()
+        env.parent = None
+        pool.append(env)
+        return result
 
     def visitReturnStmt(self, ctx):
+        if getattr(ctx, "tail_call", False):
+            call = ctx.expr().children[0]
+            function = self.callee(call)
+            args = [self.visit(expr) for expr in call.expr()]
+            if isinstance(function, Function):
+                return TailCall(function, args)
+            return ReturnValue(function(*args))
         value = None
         if ctx.expr():
             value = self.visit(ctx.expr())
         return ReturnValue(value)
 
     def visitExpr(self, ctx):
-        if ctx.primary():
+        constant = getattr(ctx, "constant", NOT_CONSTANT)
+        if constant is not NOT_CONSTANT:
+            return constant
+        elif ctx.op is not None:  # Binary operation
+            return BinaryOp.of(ctx).evaluate(self)
+        elif ctx.primary():  # never a loop invariant
             return self.visit(ctx.primary())
-        elif ctx.functionCall():
+        loop = getattr(ctx, "invariant_in", None)
+        if loop is None:
+            return self._evaluate_expr(ctx)
+        values = loop.invariant_values  # computed once per run of the loop
+        try:
+            return values[ctx]
+        except KeyError:
+            value = values[ctx] = self._evaluate_expr(ctx)
+            return value
+
+    def _evaluate_expr(self, ctx):
+        if ctx.functionCall():
             return self.visit(ctx.functionCall())
         elif ctx.getChildCount() == 2 and ctx.getChild(0).getText() == "-":
             return -self.visit(ctx.expr(0))
         elif ctx.getChild(0).getText() == "[":  # Array/List literal
+            literal = NumericLiteral.of(ctx)
+            if literal is not None:
+                return literal.as_list()
             exprs = ctx.expr()
             return [self.visit(e) for e in exprs]
         elif (
@@ -686,11 +1861,11 @@ class Interpreter(SimpleLangVisitor):
             container = self.visit(ctx.expr(0))
             index = self.visit(ctx.expr(1))
             
-            if not isinstance(container, (list, np.ndarray)):
+            if not is_array(container):
                 raise TypeError(f"Variable '{ctx.getChild(0).getText()}' is not an array or list")
             
             if not isinstance(index, int):
-                raise TypeError(f"Index must be an integer, got {type(index).__name__}")
+                raise TypeError(f"Index must be an integer, got {type_name(index)}")
             
             if index < 0 or index >= len(container):
                 raise IndexError(
@@ -698,71 +1873,71 @@ class Interpreter(SimpleLangVisitor):
                 )
             
             return container[index]
-        elif ctx.op:  # Binary operation
-            left = self.visit(ctx.expr(0))
-            right = self.visit(ctx.expr(1))
-            op = ctx.op.text
-
-            if isinstance(left, (int, float)) and isinstance(right, (int, float)):
-                ops = {
-                    "*": operator.mul,
-                    "/": operator.truediv,
-                    "%": operator.mod,
-                    "+": operator.add,
-                    "-": operator.sub,
-                    ">": operator.gt,
-                    "<": operator.lt,
-                    ">=": operator.ge,
-                    "<=": operator.le,
-                    "==": operator.eq,
-                    "!=": operator.ne,
-                    "and": operator.and_,
-                    "or": operator.or_,
-                }
-                return ops[op](left, right)
-            else:
-                # Raise error for unsupported types in binary operations
-                raise TypeError(
-                    f"Unsupported operation '{op}' between {type(left).__name__} and {type(right).__name__}"
-                )
         elif ctx.expr(0):  # Parentheses
             return self.visit(ctx.expr(0))
 
+    def visitNumericArray(self, ctx):
+        return ctx.numeric_literal.as_list()
+
     def visitFunctionCall(self, ctx):
-        name = ctx.IDENTIFIER().getText()
-        function = self.current_env.get(name)
+        function = self.callee(ctx)
 
         args = []
         if ctx.expr():
             args = [self.visit(expr) for expr in ctx.expr()]
 
-        if isinstance(function, Function):
+        return self.call_function(function, args)
+
+    def callee(self, ctx):
+        """The value a functionCall calls, cached at the call site while its global binding stays the same."""
+        if getattr(ctx, "callee_version", None) == self.global_env.version:
+            return ctx.callee
+        name = ctx.IDENTIFIER().getText()
+        function = self.current_env.get(name)
+        if getattr(ctx, "global_callee", False):  # see Optimizer.visitFunctionCall
+            self.global_env.callees.add(name)
+            ctx.callee, ctx.callee_version = function, self.global_env.version
+        return function
+
+    def call_function(self, function, args):
+        memos = []  # (memo, key) of this call and of its tail calls, all of which return the same result
+        while isinstance(function, Function):
+            if function.memo is not None:
+                arguments = function.memo_arguments(args)
+                key = None if arguments is None else memo_key(arguments)
+                result = function.memo.get(key)
+                if result is not MISSING:
+                    break
+                memos.append((function.memo, key))
+
             previous_env = self.current_env
             self.current_env = Environment(function.env)
+            self.current_env.values = function.bind(args)
 
-        
-            for (param_name, param_type, default_value), arg in zip(
-                function.params, args
-            ):
-                self.current_env.define(param_name, arg)
-
+            if function.expression is not None:
+                result = self.visit(function.expression)
+                self.current_env = previous_env
+                break
             result = self.visit(function.body)
             self.current_env = previous_env
 
+            if isinstance(result, TailCall):
+                function, args = result.function, result.args
+                continue
             if isinstance(result, ReturnValue):
-                return result.value
-            return result
-        else: 
-            return function(*args)
+                result = result.value
+            break
+        else:
+            result = function(*args)
+        for memo, key in memos:
+            memo.put(key, result)
+        return result
 
     def visitPrimary(self, ctx):
-        if ctx.INT():
-            return int(ctx.INT().getText())
-        elif ctx.FLOAT():
-            return float(ctx.FLOAT().getText())
-        elif ctx.BOOL():
-            return ctx.BOOL().getText() == "true"
-        elif ctx.STRING():
-            return ctx.STRING().getText()[1:-1]  # Remove quotes
-        elif ctx.IDENTIFIER():
-            return self.current_env.get(ctx.IDENTIFIER().getText())
+        constant = getattr(ctx, "constant", NOT_CONSTANT)
+        if constant is not NOT_CONSTANT:
+            return constant
+        token = ctx.children[0].symbol
+        if token.type == SimpleLangParser.IDENTIFIER:
+            return self.current_env.get(token.text)
+        return literal_value(token)
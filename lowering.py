@@ -0,0 +1,449 @@
+from copy import deepcopy
+from dataclasses import dataclass, field, fields, is_dataclass
+from typing import Any, Dict, List, Optional
+from SimpleLangParser import SimpleLangParser
+from SimpleLangVisitor import SimpleLangVisitor
+from interpreter import NOT_CONSTANT, Interpreter, NumericLiteral, literal_value
+from optimizer import optimize
+from typecheck import check
+
+
+# Lowered program structure. The compiled backends never look at the ANTLR
+# parse tree again once it has been lowered into these nodes. The `address`
+# fields are (depth, slot) pairs filled in by resolver.Resolver.
+
+@dataclass
+class Program:
+    body: List[Any]
+    global_names: Optional[List[str]] = None  # filled in by resolver.Resolver
+    frame_size: int = 0
+
+
+@dataclass
+class Param:
+    name: str
+    type: Any
+    default: Any = None
+
+
+@dataclass
+class FuncDecl:
+    name: str
+    params: List[Param]
+    return_type: Any
+    body: "Block"
+    address: Any = None
+    frame_size: int = 0
+    pure: bool = False  # result depends only on the arguments; see optimizer.Purity
+
+
+@dataclass
+class Block:
+    body: List[Any]
+
+
+@dataclass
+class VarDecl:
+    name: str
+    type: Any
+    value: Any = None
+    address: Any = None
+
+
+@dataclass
+class Assign:
+    name: str
+    index: Any
+    value: Any
+    address: Any = None
+
+
+@dataclass
+class CallStmt:
+    call: "Call"
+
+
+@dataclass
+class Return:
+    value: Any = None
+    tail: bool = False  # value is a Call made after the function returns
+
+
+@dataclass
+class If:
+    cond: Any
+    then: Block
+    orelse: Optional[Block] = None
+
+
+@dataclass
+class While:
+    cond: Any
+    body: Block
+    invariants: List["Invariant"] = field(default_factory=list)
+
+
+@dataclass
+class Case:
+    pattern: Any
+    body: Any
+
+
+@dataclass
+class Match:
+    subject: Any
+    cases: List[Case]
+
+
+@dataclass
+class Lambda:
+    param: str
+    body: Any
+    address: Any = None
+
+
+@dataclass
+class MethodOp:
+    kind: str  # "array", "list" or "matrix"
+    target: str
+    op: str
+    arg: Any = None
+    desc: bool = False
+    lam: Optional[Lambda] = None
+    address: Any = None
+    result_addresses: Optional[List[Any]] = None
+    numeric: bool = False  # typecheck.py proved the array operands hold only numbers
+
+
+@dataclass
+class Pipeline:
+    stages: List[MethodOp]  # array methods chained through unread results; see optimizer.Pipelines
+
+
+@dataclass
+class Const:
+    value: Any
+
+
+@dataclass
+class Name:
+    name: str
+    address: Any = None
+
+
+@dataclass
+class Neg:
+    operand: Any
+
+
+@dataclass
+class Index:
+    container: Any
+    index: Any
+    text: str = ""  # source text of the container, for error messages
+
+
+@dataclass
+class BinOp:
+    op: str
+    left: Any
+    right: Any
+    numeric: bool = False  # typecheck.py proved both operands are int or float
+
+
+@dataclass
+class Invariant:
+    """An expression optimizer.py found invariant in its loop: computed once per run of the loop."""
+    expr: Any
+    address: Any = None  # hidden slot holding the value, UNSET at the start of each run
+
+
+@dataclass
+class ListLit:
+    items: List[Any] = field(default_factory=list)
+
+
+@dataclass
+class NumericListLit:
+    """A ListLit of INT/FLOAT constants only, already decoded into a typed buffer."""
+    literal: NumericLiteral
+
+
+@dataclass
+class Call:
+    name: str
+    args: List[Any] = field(default_factory=list)
+    address: Any = None
+
+
+@dataclass
+class Inline:
+    """A call of a small function, evaluated in the caller as a copy of the expression it returns.
+
+    The backends check at run time that the name still refers to that
+    function, and otherwise make the call as usual.
+    """
+    call: Call
+    decl: FuncDecl
+    body: Any
+    addresses: List[Any] = field(default_factory=list)  # hidden slots holding the arguments
+
+
+class Lowerer(SimpleLangVisitor):
+    """Turns a ProgramContext into the plain node structure above."""
+
+    visitType = Interpreter.visitType
+    visitPattern = Interpreter.visitPattern
+
+    def __init__(self):
+        self.loop_invariants = {}  # while ctx -> its Invariant nodes
+
+    def visitProgram(self, ctx):
+        optimize(ctx)
+        check(ctx)
+        return Program(self.visit_all(ctx.children[:-1]))
+
+    def visit_all(self, children) -> list:
+        """The lowered children, leaving out the error nodes ANTLR keeps when it recovers from a syntax error."""
+        return [node for node in map(self.visit, children) if node is not None]
+
+    def visitFunctionDecl(self, ctx):
+        params = []
+        if ctx.paramList():
+            params = [self.visit(param) for param in ctx.paramList().parameter()]
+        return FuncDecl(
+            name=ctx.IDENTIFIER().getText(),
+            params=params,
+            return_type=self.visit(ctx.type_()),
+            body=self.visit(ctx.block()),
+            pure=getattr(ctx, "pure", False),
+        )
+
+    def visitParameter(self, ctx):
+        default = self.visit(ctx.expr()) if ctx.expr() else None
+        return Param(ctx.IDENTIFIER().getText(), self.visit(ctx.type_()), default)
+
+    def visitBlock(self, ctx):
+        return Block(self.visit_all(ctx.statement()))
+
+    def visitStatement(self, ctx):
+        if ctx.functionCall():
+            return CallStmt(self.visit(ctx.functionCall()))
+        return self.visit(ctx.getChild(0))
+
+    def visitVarDecl(self, ctx):
+        value = self.visit(ctx.expr()) if ctx.expr() else None
+        return VarDecl(ctx.IDENTIFIER().getText(), self.visit(ctx.type_()), value)
+
+    def visitAssignment(self, ctx):
+        exprs = ctx.expr()
+        name = ctx.IDENTIFIER().getText()
+        if len(exprs) > 1:
+            return Assign(name, self.visit(exprs[0]), self.visit(exprs[1]))
+        return Assign(name, None, self.visit(exprs[0]))
+
+    def visitReturnStmt(self, ctx):
+        if not ctx.expr():
+            return Return()
+        value = self.visit(ctx.expr())
+        return Return(value, getattr(ctx, "tail_call", False) and isinstance(value, Call))
+
+    def visitIfStatement(self, ctx):
+        live_block = getattr(ctx, "live_block", NOT_CONSTANT)
+        if live_block is not NOT_CONSTANT:  # The condition is constant
+            return self.visit(live_block) if live_block is not None else Block([])
+        orelse = self.visit(ctx.block(1)) if ctx.block(1) else None
+        return If(self.visit(ctx.expr()), self.visit(ctx.block(0)), orelse)
+
+    def visitWhileStatement(self, ctx):
+        invariants = self.loop_invariants[ctx] = []
+        node = While(self.visit(ctx.expr()), self.visit(ctx.block()), invariants)
+        del self.loop_invariants[ctx]
+        return node
+
+    def visitMatchStatement(self, ctx):
+        live_cases = getattr(ctx, "live_cases", None)
+        if live_cases is None:
+            live_cases = [(self.visit(case.pattern()), case.statement()) for case in ctx.matchCase()]
+        cases = [Case(pattern, self.visit(statement)) for pattern, statement in live_cases]
+        return Match(self.visit(ctx.expr()), cases)
+
+    def _method_op(self, kind, ctx, lam=None):
+        op = ctx.getChild(2).getText()
+        return MethodOp(
+            kind=kind,
+            target=ctx.IDENTIFIER().getText(),
+            op=op,
+            arg=self.visit(ctx.expr()) if ctx.expr() else None,
+            desc=op == "sort" and ctx.getChild(4).getText() == "desc",
+            lam=lam,
+            numeric=getattr(ctx, "proven_numeric", False),
+        )
+
+    def visitArrayOp(self, ctx):
+        pipeline = getattr(ctx, "pipeline", None)
+        if pipeline is not None:
+            return Pipeline([self._array_op(stage) for stage in pipeline])
+        if getattr(ctx, "fused", False):
+            return Block([])  # run by the first statement of its pipeline
+        return self._array_op(ctx)
+
+    def _array_op(self, ctx):
+        lam = None
+        if ctx.lambdaExpr():
+            lam = Lambda(ctx.lambdaExpr().IDENTIFIER().getText(), self.visit(ctx.lambdaExpr().expr()))
+        return self._method_op("array", ctx, lam)
+
+    def visitListOp(self, ctx):
+        return self._method_op("list", ctx)
+
+    def visitMatrixOp(self, ctx):
+        return self._method_op("matrix", ctx)
+
+    def visitExpr(self, ctx):
+        constant = getattr(ctx, "constant", NOT_CONSTANT)
+        if constant is not NOT_CONSTANT:
+            return Const(constant)
+        loop = getattr(ctx, "invariant_in", None)
+        if loop is not None:
+            node = Invariant(self._lower_expr(ctx))
+            self.loop_invariants[loop].append(node)
+            return node
+        return self._lower_expr(ctx)
+
+    def _lower_expr(self, ctx):
+        if ctx.primary():
+            return self.visit(ctx.primary())
+        elif ctx.functionCall():
+            return self.visit(ctx.functionCall())
+        elif ctx.getChildCount() == 2 and ctx.getChild(0).getText() == "-":
+            return Neg(self.visit(ctx.expr(0)))
+        elif ctx.getChild(0).getText() == "[":  # Array/List literal
+            literal = NumericLiteral.of(ctx)
+            if literal is not None:
+                return NumericListLit(literal)
+            return ListLit([self.visit(e) for e in ctx.expr()])
+        elif ctx.getChildCount() == 4 and ctx.getChild(1).getText() == "[":
+            return Index(self.visit(ctx.expr(0)), self.visit(ctx.expr(1)), ctx.getChild(0).getText())
+        elif ctx.op:  # Binary operation
+            return BinOp(
+                ctx.op.text, self.visit(ctx.expr(0)), self.visit(ctx.expr(1)), getattr(ctx, "proven_numeric", False)
+            )
+        elif ctx.expr(0):  # Parentheses
+            return self.visit(ctx.expr(0))
+
+    def visitNumericArray(self, ctx):
+        return NumericListLit(ctx.numeric_literal)
+
+    def visitFunctionCall(self, ctx):
+        return Call(ctx.IDENTIFIER().getText(), [self.visit(e) for e in ctx.expr()])
+
+    def visitPrimary(self, ctx):
+        token = ctx.children[0].symbol
+        if token.type == SimpleLangParser.IDENTIFIER:
+            return Name(token.text)
+        return Const(literal_value(token))
+
+
+# Largest returned expression, in nodes, that is inlined at call sites.
+INLINE_SIZE = 12
+
+
+class Inliner:
+    """Replaces calls of small functions with Inline nodes.
+
+    A function is inlined when it is declared once, its body is a single
+    `return expr;` that is not a tail call, expr has at most INLINE_SIZE
+    nodes and does not call the function itself, and the call passes one
+    argument per parameter. Calls inside the inlined functions are left
+    alone, so inlining never nests.
+    """
+
+    def inline(self, program: Program) -> Program:
+        declarations: Dict[str, List[FuncDecl]] = {}
+        for item in program.body:
+            if isinstance(item, FuncDecl):
+                declarations.setdefault(item.name, []).append(item)
+        self.candidates = {
+            name: decls[0] for name, decls in declarations.items() if len(decls) == 1 and self.is_small(decls[0])
+        }
+        self.rewrite(program)
+        return program
+
+    @staticmethod
+    def expression_nodes(node):
+        yield node
+        if isinstance(node, BinOp):
+            children = [node.left, node.right]
+        elif isinstance(node, Neg):
+            children = [node.operand]
+        elif isinstance(node, Index):
+            children = [node.container, node.index]
+        elif isinstance(node, Invariant):
+            children = [node.expr]
+        elif isinstance(node, ListLit):
+            children = node.items
+        elif isinstance(node, Call):
+            children = node.args
+        else:
+            children = []
+        for child in children:
+            yield from Inliner.expression_nodes(child)
+
+    def is_small(self, decl: FuncDecl) -> bool:
+        body = decl.body.body
+        if len(body) != 1 or not isinstance(body[0], Return) or body[0].value is None or body[0].tail:
+            return False
+        nodes = list(self.expression_nodes(body[0].value))
+        return len(nodes) <= INLINE_SIZE and not any(
+            isinstance(node, Call) and node.name == decl.name for node in nodes
+        )
+
+    def rewrite(self, node):
+        """Replaces the calls below node, in place."""
+        for node_field in fields(node):
+            value = getattr(node, node_field.name)
+            if isinstance(value, list):
+                for i, item in enumerate(value):
+                    value[i] = self.rewritten(item)
+            else:
+                setattr(node, node_field.name, self.rewritten(value))
+
+    def rewritten(self, value):
+        if not is_dataclass(value) or isinstance(value, (type, Inline)):
+            return value
+        if isinstance(value, FuncDecl) and self.candidates.get(value.name) is value:
+            return value
+        self.rewrite(value)
+        if isinstance(value, Return) and isinstance(value.value, Inline):
+            value.tail = False  # the inlined expression is evaluated in place; there is no call to hand back
+        if isinstance(value, Call):
+            decl = self.candidates.get(value.name)
+            if decl is not None and len(value.args) == len(decl.params):
+                return Inline(value, decl, deepcopy(decl.body.body[0].value))
+        return value
+
+
+def vector_plan(node, param: str, key) -> Optional[tuple]:
+    """The interpreter.VectorLambda plan of a lowered lambda body, or None if it has no plan.
+
+    key(name) is what the plan keeps for a captured variable and passes
+    back to the backend's load function when the plan runs.
+    """
+    if isinstance(node, Const):
+        return ("const", node.value)
+    if isinstance(node, Name):
+        return ("param",) if node.name == param else ("load", key(node))
+    if isinstance(node, Invariant):
+        return vector_plan(node.expr, param, key)
+    if isinstance(node, Neg):
+        operand = vector_plan(node.operand, param, key)
+        return None if operand is None else ("neg", operand)
+    if isinstance(node, BinOp):
+        left, right = vector_plan(node.left, param, key), vector_plan(node.right, param, key)
+        return None if left is None or right is None else (node.op, left, right)
+    return None
+
+
+def lower(tree) -> Program:
+    return Inliner().inline(Lowerer().visit(tree))
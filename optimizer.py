@@ -0,0 +1,549 @@
+from typing import Any, Dict, List, Optional, Set
+from antlr4.tree.Tree import TerminalNode
+from SimpleLangParser import SimpleLangParser
+from SimpleLangVisitor import SimpleLangVisitor
+from interpreter import BINARY_OPERATORS, NOT_CONSTANT, Interpreter, literal_value
+
+# Method statements that only define result variables; all others may change
+# their target in place.
+READ_ONLY_METHODS = ("mean", "median", "variance", "stddev", "linreg", "play")
+
+
+class Optimizer(SimpleLangVisitor):
+    """Folds constants and prunes dead branches, before the program runs.
+
+    Nothing is rewritten; the results are recorded on the parse tree for the
+    interpreter and the lowering to use:
+
+    - `constant` on every `primary` and `expr` node: the decoded literal, or
+      the value of an expression built only from literals, or NOT_CONSTANT.
+      Only scalars are folded (a list literal must build a new list each
+      time), and an operation that would raise is left for the run time so
+      the error is reported where it happens.
+    - `live_block` on an `ifStatement` whose condition is constant: the
+      block that runs, or None if neither does.
+    - `live_cases` on a `matchStatement`: (pattern, statement) pairs with
+      the patterns decoded, up to the first case that always matches.
+    - `declares` on every `block`: whether running it can define a
+      variable in the block's own scope; blocks that cannot run in the
+      enclosing scope instead of a new Environment.
+    - `tail_call` on every `returnStmt`: whether it is `return f(...)` in a
+      function body, so the backends can make the call after returning.
+    - `global_callee` on every `functionCall`: whether no scope around it
+      (block, parameters, lambda) ever binds the name called, so the callee
+      always comes from the global scope; `callee_version` starts as None
+      for the interpreter's cache of it.
+
+    For a whole program, loop invariants, pure functions and pipelines are
+    found as well; see LoopInvariants, Purity and Pipelines.
+    """
+
+    def __init__(self, predefined: Optional[Dict[str, Any]] = None):
+        self.predefined = predefined
+        self.in_function = False
+        self.scopes: List[Set[str]] = []  # names bound by the scopes around the node being visited
+
+    def visitProgram(self, ctx):
+        self.visitChildren(ctx)
+        invariants = LoopInvariants(ctx, self.predefined)
+        invariants.find()
+        Purity(invariants).find()
+        Pipelines(ctx).find()
+
+    visitType = Interpreter.visitType
+    visitPattern = Interpreter.visitPattern
+
+    def visitPrimary(self, ctx):
+        token = ctx.children[0].symbol
+        ctx.constant = NOT_CONSTANT if token.type == SimpleLangParser.IDENTIFIER else literal_value(token)
+        return ctx.constant
+
+    def visitExpr(self, ctx):
+        ctx.constant = self.fold(ctx)
+        return ctx.constant
+
+    def fold(self, ctx):
+        children = ctx.children
+        if len(children) == 1:  # primary or functionCall
+            value = children[0].accept(self)
+            return value if isinstance(children[0], SimpleLangParser.PrimaryContext) else NOT_CONSTANT
+        if ctx.op is not None:  # Binary operation
+            left = children[0].accept(self)
+            right = children[2].accept(self)
+            if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+                try:
+                    return BINARY_OPERATORS[ctx.op.text](left, right)
+                except (ArithmeticError, TypeError):  # e.g. 1 / 0, 1.5 and true
+                    pass
+            return NOT_CONSTANT
+        first = children[0]
+        if isinstance(first, TerminalNode) and first.symbol.text == "-":
+            operand = children[1].accept(self)
+            return -operand if isinstance(operand, (int, float)) else NOT_CONSTANT
+        if isinstance(first, TerminalNode) and first.symbol.text == "(":
+            return children[1].accept(self)
+        self.visitChildren(ctx)  # list literal or indexing
+        return NOT_CONSTANT
+
+    def visitNumericArray(self, ctx):
+        # Already decoded by pratt.py; visiting the children would build them.
+        ctx.constant = NOT_CONSTANT
+        return NOT_CONSTANT
+
+    def visitIfStatement(self, ctx):
+        condition = ctx.expr().accept(self)
+        blocks = ctx.block()
+        for block in blocks:
+            block.accept(self)
+        if condition is not NOT_CONSTANT:
+            ctx.live_block = blocks[0] if condition else (blocks[1] if len(blocks) > 1 else None)
+
+    def visitFunctionDecl(self, ctx):
+        self.in_function = True
+        params = set()
+        if ctx.paramList():
+            ctx.paramList().accept(self)  # defaults are evaluated in the declaring scope
+            params = {param.IDENTIFIER().getText() for param in ctx.paramList().parameter()}
+        self.scopes.append(params)
+        ctx.block().accept(self)
+        self.scopes.pop()
+        self.in_function = False
+
+    def visitLambdaExpr(self, ctx):
+        self.scopes.append({ctx.IDENTIFIER().getText()})
+        self.visitChildren(ctx)
+        self.scopes.pop()
+
+    def visitFunctionCall(self, ctx):
+        name = ctx.IDENTIFIER().getText()
+        ctx.global_callee = not any(name in scope for scope in self.scopes)
+        ctx.callee_version = None
+        return self.visitChildren(ctx)
+
+    def visitReturnStmt(self, ctx):
+        expr = ctx.expr()
+        # A top-level return only ends its statement, so its call must still happen in place.
+        ctx.tail_call = (
+            self.in_function
+            and expr is not None
+            and isinstance(expr.children[0], SimpleLangParser.FunctionCallContext)
+        )
+        return self.visitChildren(ctx)
+
+    def visitBlock(self, ctx):
+        names = set()
+        for statement in ctx.statement():
+            names |= self.declared_names(statement)
+        ctx.declares = bool(names)
+        self.scopes.append(names)
+        self.visitChildren(ctx)
+        self.scopes.pop()
+
+    @staticmethod
+    def declared_names(statement) -> Set[str]:
+        """Names statement can define in the current scope (nested blocks have their own)."""
+        names = set()
+        stack = [statement]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, SimpleLangParser.VarDeclContext):
+                names.add(node.IDENTIFIER().getText())
+            elif isinstance(node, (SimpleLangParser.ArrayOpContext, SimpleLangParser.MatrixOpContext)):
+                target, op = node.IDENTIFIER().getText(), node.getChild(2).getText()
+                if op == "linreg":
+                    names.update((f"{target}_slope", f"{target}_intercept", f"{target}_r_squared"))
+                elif op not in ("sort", "play"):
+                    names.add(f"{target}_{op}")  # e.g. data_mean
+            elif isinstance(node, (SimpleLangParser.StatementContext, SimpleLangParser.MatchStatementContext,
+                                   SimpleLangParser.MatchCaseContext)):
+                stack.extend(node.getChildren())
+        return names
+
+    def visitMatchStatement(self, ctx):
+        ctx.expr().accept(self)
+        live_cases = []
+        for case in ctx.matchCase():
+            statement = case.statement()
+            statement.accept(self)
+            if len(live_cases) == 0 or live_cases[-1][0] != "_":
+                live_cases.append((self.visit(case.pattern()), statement))
+        ctx.live_cases = live_cases
+
+
+class Effects:
+    """What running a piece of code can change, by variable name."""
+
+    def __init__(self):
+        self.writes: Set[str] = set()
+        self.mutates = False  # changes a list or array in place
+        self.calls: Set[str] = set()
+        self.opaque = False  # calls something whose effects are unknown
+
+    def add(self, other: "Effects"):
+        self.writes |= other.writes
+        self.calls |= other.calls
+        self.mutates = self.mutates or other.mutates
+        self.opaque = self.opaque or other.opaque
+
+
+class LoopInvariants:
+    """Finds the expressions in `while` loops that give the same value on every iteration.
+
+    An expression is invariant in a loop when it calls nothing but the `len`
+    builtin, no variable it reads is declared or assigned anywhere in the
+    loop (including by the functions the loop calls, and as method results
+    or lambda parameters), and, if it reads the contents of a list or array
+    (indexing, len), nothing in the loop changes one in place. Only
+    expressions that do some work are recorded (binary, negation, indexing,
+    len), and list literals never, since each evaluation must build a new
+    list.
+
+    Each invariant expression gets `invariant_in`, the outermost loop it is
+    invariant in, and that loop lists it in `invariants`. The backends
+    compute an invariant the first time it is evaluated in a run of its
+    loop and reuse the value for the rest of that run, so a loop that runs
+    zero times, or an expression that raises, behaves exactly as before.
+    All other expressions get `invariant_in = None`.
+    """
+
+    def __init__(self, tree, predefined: Optional[Dict[str, Any]] = None):
+        self.tree = tree
+        self.predefined = {"print": print, "len": len} if predefined is None else predefined
+        self.functions: Dict[str, Effects] = {}
+        self.names: Set[str] = set()  # every variable or parameter declared or assigned anywhere
+
+    def find(self):
+        program = Effects()
+        for child in self.tree.children:
+            if isinstance(child, SimpleLangParser.FunctionDeclContext):
+                body = self.effects(child.block())
+                self.functions.setdefault(child.IDENTIFIER().getText(), Effects()).add(body)
+                program.add(body)
+                if child.paramList():
+                    program.add(self.effects(child.paramList()))
+            program.add(self.effects(child))
+        self.names = program.writes
+        # A user function may call any other, so a call to one may have the effects of all of them.
+        self.function_effects = Effects()
+        for effects in self.functions.values():
+            self.function_effects.add(effects)
+            self.function_effects.opaque = self.function_effects.opaque or any(
+                not self.is_known_call(name) for name in effects.calls
+            )
+        self.walk(self.tree, [])
+
+    # Effects of statements
+
+    def effects(self, ctx) -> Effects:
+        effects = Effects()
+        stack = [ctx]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, TerminalNode) or getattr(node, "numeric_literal", None) is not None:
+                continue
+            if isinstance(
+                node, (SimpleLangParser.VarDeclContext, SimpleLangParser.AssignmentContext, SimpleLangParser.ParameterContext)
+            ):
+                effects.writes.add(node.IDENTIFIER().getText())
+                if isinstance(node, SimpleLangParser.AssignmentContext) and len(node.expr()) > 1:
+                    effects.mutates = True  # xs[i] = v
+            elif isinstance(
+                node, (SimpleLangParser.ArrayOpContext, SimpleLangParser.ListOpContext, SimpleLangParser.MatrixOpContext)
+            ):
+                target, op = node.IDENTIFIER().getText(), node.getChild(2).getText()
+                effects.writes.update(
+                    (target, f"{target}_{op}", f"{target}_slope", f"{target}_intercept", f"{target}_r_squared")
+                )
+                if isinstance(node, SimpleLangParser.ListOpContext) or op not in READ_ONLY_METHODS:
+                    effects.mutates = True
+                if isinstance(node, SimpleLangParser.ArrayOpContext) and node.lambdaExpr():
+                    effects.writes.add(node.lambdaExpr().IDENTIFIER().getText())
+            elif isinstance(node, SimpleLangParser.FunctionDeclContext):
+                continue  # the body runs when called
+            elif isinstance(node, SimpleLangParser.FunctionCallContext):
+                effects.calls.add(node.IDENTIFIER().getText())
+            stack.extend(node.getChildren())
+        return effects
+
+    def is_builtin(self, name) -> bool:
+        """Whether calls to name always reach the print or len builtin."""
+        return (
+            name in ("print", "len")
+            and self.predefined.get(name) is {"print": print, "len": len}[name]
+            and name not in self.names
+            and name not in self.functions
+        )
+
+    def is_known_call(self, name) -> bool:
+        """Whether calls to name reach a builtin or a function declared in this program."""
+        return self.is_builtin(name) or (name in self.functions and name not in self.names)
+
+    def loop_effects(self, ctx) -> Effects:
+        effects = self.effects(ctx)
+        for name in list(effects.calls):
+            if not self.is_known_call(name):
+                effects.opaque = True
+            elif not self.is_builtin(name):
+                effects.add(self.function_effects)
+        return effects
+
+    # Expressions
+
+    def summary(self, ctx):
+        """(names read, pure, reads list/array contents) of an expr node."""
+        if ctx.constant is not NOT_CONSTANT or getattr(ctx, "numeric_literal", None) is not None:
+            return set(), True, False
+        children = ctx.children
+        first = children[0]
+        if isinstance(first, SimpleLangParser.PrimaryContext):
+            return {first.getText()}, True, False
+        names, pure, reads = set(), True, False
+        if isinstance(first, SimpleLangParser.FunctionCallContext):
+            name = first.IDENTIFIER().getText()
+            names.add(name)
+            pure = name == "len" and self.is_builtin(name)
+            reads = True
+            operands = first.expr()
+        else:
+            operands = ctx.expr()
+            reads = len(children) == 4  # expr '[' expr ']'
+        for operand in operands:
+            operand_names, operand_pure, operand_reads = self.summary(operand)
+            names |= operand_names
+            pure = pure and operand_pure
+            reads = reads or operand_reads
+        return names, pure, reads
+
+    @staticmethod
+    def does_work(ctx) -> bool:
+        if ctx.constant is not NOT_CONSTANT or getattr(ctx, "numeric_literal", None) is not None:
+            return False
+        children = ctx.children
+        if len(children) == 1:
+            return isinstance(children[0], SimpleLangParser.FunctionCallContext)
+        first = children[0]
+        return not (isinstance(first, TerminalNode) and first.symbol.text in ("[", "("))
+
+    def walk(self, node, loops: List[tuple]):
+        """Visits node with loops, the enclosing (while ctx, Effects) pairs from the outermost in."""
+        if isinstance(node, TerminalNode) or getattr(node, "numeric_literal", None) is not None:
+            return
+        if isinstance(node, SimpleLangParser.ExprContext):
+            self.hoist(node, loops)
+            return
+        if isinstance(node, SimpleLangParser.WhileStatementContext):
+            node.invariants = []
+            loops = loops + [(node, self.loop_effects(node))]
+        for child in node.getChildren():
+            self.walk(child, loops)
+
+    def hoist(self, ctx, loops: List[tuple]):
+        ctx.invariant_in = None
+        if loops and self.does_work(ctx):
+            names, pure, reads = self.summary(ctx)
+            if pure:
+                for depth, (loop, effects) in enumerate(loops):
+                    if not (effects.opaque or names & effects.writes or (reads and effects.mutates)):
+                        ctx.invariant_in = loop
+                        loop.invariants.append(ctx)
+                        loops = loops[:depth]  # parts of it may be invariant in outer loops too
+                        break
+        for child in ctx.getChildren():
+            self.walk(child, loops)
+
+
+class Purity:
+    """Finds the functions whose result depends only on their arguments.
+
+    A function is pure when its body reads and assigns only its parameters
+    and the variables it declares itself (method results and lambda
+    parameters included), changes no list or array in place, does not play
+    anything, and calls nothing but the `len` builtin and other pure
+    functions. Every functionDecl gets `pure`; a name declared more than
+    once is pure only if every declaration is.
+    """
+
+    def __init__(self, invariants: LoopInvariants):
+        self.invariants = invariants
+
+    def find(self):
+        declarations = [
+            child for child in self.invariants.tree.children if isinstance(child, SimpleLangParser.FunctionDeclContext)
+        ]
+        calls: Dict[str, Set[str]] = {}
+        impure: Set[str] = set()
+        for declaration in declarations:
+            name = declaration.IDENTIFIER().getText()
+            param_list = declaration.paramList()
+            params = {param.IDENTIFIER().getText() for param in param_list.parameter()} if param_list else set()
+            called: Set[str] = set()
+            if self.is_local(declaration.block(), [params], called):
+                calls.setdefault(name, set()).update(called)
+            else:
+                impure.add(name)
+        pure = set(calls) - impure
+        changed = True
+        while changed:  # a function calling an impure one is impure too
+            changed = False
+            for name in list(pure):
+                if not calls[name] <= pure:
+                    pure.discard(name)
+                    changed = True
+        for declaration in declarations:
+            declaration.pure = declaration.IDENTIFIER().getText() in pure
+
+    def is_local(self, node, scopes: List[Set[str]], called: Set[str]) -> bool:
+        """Whether node only touches names in scopes, declaring into scopes[-1]; adds the user functions it calls to called."""
+        if isinstance(node, TerminalNode) or getattr(node, "numeric_literal", None) is not None:
+            return True
+        children = node.getChildren()
+        if isinstance(node, SimpleLangParser.BlockContext):
+            scopes = scopes + [set()]
+        elif isinstance(node, SimpleLangParser.LambdaExprContext):
+            scopes = scopes + [{node.IDENTIFIER().getText()}]
+        elif isinstance(node, SimpleLangParser.PrimaryContext):
+            token = node.children[0].symbol
+            return token.type != SimpleLangParser.IDENTIFIER or self.declared(token.text, scopes)
+        elif isinstance(node, SimpleLangParser.AssignmentContext):
+            if len(node.expr()) > 1 or not self.declared(node.IDENTIFIER().getText(), scopes):
+                return False  # xs[i] = v changes the list in place
+        elif isinstance(node, SimpleLangParser.FunctionCallContext):
+            name = node.IDENTIFIER().getText()
+            if self.invariants.is_builtin(name):
+                if name != "len":
+                    return False  # print
+            elif self.invariants.is_known_call(name):
+                called.add(name)
+            else:
+                return False
+        elif isinstance(node, SimpleLangParser.ListOpContext):
+            return False
+        elif isinstance(node, (SimpleLangParser.ArrayOpContext, SimpleLangParser.MatrixOpContext)):
+            target, op = node.IDENTIFIER().getText(), node.getChild(2).getText()
+            if op in ("sort", "play") or not self.declared(target, scopes):
+                return False
+            if not all(self.is_local(child, scopes, called) for child in children):
+                return False
+            scopes[-1].update(
+                (f"{target}_slope", f"{target}_intercept", f"{target}_r_squared") if op == "linreg" else (f"{target}_{op}",)
+            )
+            return True
+        if not all(self.is_local(child, scopes, called) for child in children):
+            return False
+        if isinstance(node, SimpleLangParser.VarDeclContext):
+            scopes[-1].add(node.IDENTIFIER().getText())
+        return True
+
+    @staticmethod
+    def declared(name, scopes: List[Set[str]]) -> bool:
+        return any(name in scope for scope in scopes)
+
+
+class Pipelines:
+    """Finds chains of array methods whose intermediate results nothing else reads.
+
+    A pipeline is a run of consecutive statements in one block, such as
+
+        data.filter(x => x > 0);
+        data_filter.map(x => x * 2);
+        data_filter_map.mean();
+
+    where each statement after the first works on the result of the one
+    before, that result is read nowhere else in the program (a name is
+    counted wherever it appears, in any scope), every statement but the
+    last is a filter, map, rotate or shift, and the last may also be a
+    statistic. rotate and shift after the first statement need constant
+    positions, so nothing but the stages themselves runs in between.
+
+    The first arrayOp gets `pipeline`, the arrayOp nodes of the whole
+    chain, and the others `fused = True`. The backends run the chain when
+    they reach the first statement and store only the last result; the
+    others do nothing. Only the stages run in between, in order, so this
+    is unobservable to the program apart from the intermediate variables
+    never being defined.
+    """
+
+    STAGES = ("filter", "map", "rotate", "shift")
+    LAST_STAGES = STAGES + ("mean", "median", "variance", "stddev")
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.reads: Dict[str, int] = {}
+        self.statement_lists: List[list] = []
+
+    def find(self):
+        self.statement_lists.append(self.tree.children)
+        self.collect(self.tree)
+        for statements in self.statement_lists:
+            self.find_in(statements)
+
+    def collect(self, node):
+        """Counts the names read below node and gathers the statement lists of its blocks."""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, TerminalNode) or getattr(node, "numeric_literal", None) is not None:
+                continue
+            name = None
+            if isinstance(node, (SimpleLangParser.PrimaryContext, SimpleLangParser.PatternContext)):
+                token = node.children[0]
+                if isinstance(token, TerminalNode) and token.symbol.type == SimpleLangParser.IDENTIFIER:
+                    name = token.getText()
+            elif isinstance(
+                node,
+                (
+                    SimpleLangParser.FunctionCallContext,
+                    SimpleLangParser.AssignmentContext,
+                    SimpleLangParser.ArrayOpContext,
+                    SimpleLangParser.ListOpContext,
+                    SimpleLangParser.MatrixOpContext,
+                ),
+            ):
+                name = node.IDENTIFIER().getText()
+            elif isinstance(node, SimpleLangParser.BlockContext):
+                self.statement_lists.append(node.statement())
+            if name is not None:
+                self.reads[name] = self.reads.get(name, 0) + 1
+            stack.extend(node.getChildren())
+
+    def find_in(self, statements):
+        ops = [
+            statement.getChild(0)
+            if isinstance(statement, SimpleLangParser.StatementContext)
+            and isinstance(statement.getChild(0), SimpleLangParser.ArrayOpContext)
+            else None
+            for statement in statements
+        ]
+        start = 0
+        while start < len(ops):
+            chain = [ops[start]] if ops[start] is not None and self.op(ops[start]) in self.STAGES else []
+            while chain and self.op(chain[-1]) in self.STAGES and start + len(chain) < len(ops):
+                follower = ops[start + len(chain)]
+                if follower is None or not self.follows(chain[-1], follower):
+                    break
+                chain.append(follower)
+            if len(chain) > 1:
+                chain[0].pipeline = chain
+                for stage in chain[1:]:
+                    stage.fused = True
+            start += max(len(chain), 1)
+
+    def follows(self, stage, follower) -> bool:
+        result = f"{stage.IDENTIFIER().getText()}_{self.op(stage)}"
+        op = self.op(follower)
+        return (
+            follower.IDENTIFIER().getText() == result
+            and self.reads.get(result) == 1
+            and op in self.LAST_STAGES
+            and (op not in ("rotate", "shift") or follower.expr().constant is not NOT_CONSTANT)
+        )
+
+    @staticmethod
+    def op(array_op) -> str:
+        return array_op.getChild(2).getText()
+
+
+def optimize(tree, predefined: Optional[Dict[str, Any]] = None):
+    """Annotates tree with folded constants, live branches and loop invariants; see Optimizer."""
+    Optimizer(predefined).visit(tree)
+    return tree
@@ -0,0 +1,81 @@
+from antlr4 import *
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.error.ErrorListener import ConsoleErrorListener
+from antlr4.error.ErrorStrategy import BailErrorStrategy, DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
+from SimpleLangLexer import SimpleLangLexer
+from SimpleLangParser import SimpleLangParser
+
+
+FRONTENDS = ("antlr", "pratt")
+
+
+class ParseStats:
+    """Counts which pass produced each tree, and so how often SLL fell back to full LL."""
+
+    def __init__(self):
+        self.pratt = 0
+        self.sll = 0
+        self.fallbacks = 0
+
+    @property
+    def parses(self):
+        return self.pratt + self.sll + self.fallbacks
+
+    @property
+    def fallback_rate(self):
+        return self.fallbacks / self.parses if self.parses else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.parses} parse(s): {self.pratt} Pratt, {self.sll} SLL, {self.fallbacks} LL fallback(s) "
+            f"({self.fallback_rate:.0%})"
+        )
+
+
+PARSE_STATS = ParseStats()
+
+
+def parse(code: str, stats: ParseStats = PARSE_STATS, frontend: str = "antlr"):
+    """Parses code into a ProgramContext using two-stage prediction.
+
+    The first pass uses SLL prediction and bails out on the first syntax
+    error without reporting it. SLL accepts almost every valid program, so
+    the full LL pass, with the usual error reporting and recovery, only runs
+    for programs that are ambiguous under SLL or actually invalid.
+
+    With frontend="pratt" the hand-written parser in pratt.py is tried
+    first; input it rejects goes through the ANTLR passes, so syntax errors
+    are reported exactly as before.
+    """
+    if frontend == "pratt":
+        import pratt
+        try:
+            tree = pratt.parse(code)
+        except pratt.ParseError:
+            pass
+        else:
+            stats.pratt += 1
+            return tree
+
+    lexer = SimpleLangLexer(InputStream(code))
+    token_stream = CommonTokenStream(lexer)
+    parser = SimpleLangParser(token_stream)
+    parser._interp.predictionMode = PredictionMode.SLL
+    parser._errHandler = BailErrorStrategy()
+    parser.removeErrorListeners()
+    try:
+        tree = parser.program()
+    except ParseCancellationException:
+        pass
+    else:
+        stats.sll += 1
+        return tree
+
+    # reset() rewinds the token stream; the tokens themselves are reused.
+    parser.reset()
+    parser._interp.predictionMode = PredictionMode.LL
+    parser._errHandler = DefaultErrorStrategy()
+    parser.addErrorListener(ConsoleErrorListener.INSTANCE)
+    stats.fallbacks += 1
+    return parser.program()
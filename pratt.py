@@ -0,0 +1,641 @@
+import gc
+import re
+from typing import Iterable, Iterator, List
+from antlr4.Token import CommonToken, Token
+from antlr4.tree.Tree import TerminalNodeImpl
+from interpreter import NumericLiteral
+from SimpleLangParser import SimpleLangParser
+
+
+class ParseError(Exception):
+    """Raised by the hand-written front-end for any input it does not accept."""
+
+
+# Token types come from the generated parser, so SimpleLang.g4 stays the
+# source of truth for the token vocabulary.
+LITERAL_TYPES = {
+    name[1:-1]: ttype
+    for ttype, name in enumerate(SimpleLangParser.literalNames)
+    if name != "<INVALID>"
+}
+KEYWORDS = {text: ttype for text, ttype in LITERAL_TYPES.items() if text[0].isalpha() or text == "_"}
+KEYWORDS.update({"true": SimpleLangParser.BOOL, "false": SimpleLangParser.BOOL})
+
+# Longest alternatives first, so that e.g. `-5` is one INT token and `/*`
+# starts a comment rather than a division, as in the generated lexer.
+TOKEN_PATTERN = re.compile(
+    "|".join([
+        r"([ \t\r\n]+|//[^\r\n]*|/\*.*?\*/)",
+        r"(-?[0-9]+(?:\.[0-9]+)?)",
+        r"([a-zA-Z_][a-zA-Z0-9_]*)",
+        r'("(?:\\"|[^"\r\n])*")',
+        r"(->|=>|>=|<=|==|!=|[(),:=<>{};\[\].\-*/+%])",
+    ]),
+    re.DOTALL,
+)
+SKIP, NUMBER, WORD, STRING, PUNCTUATION = range(1, 6)
+
+
+def T(text):
+    return LITERAL_TYPES[text]
+
+
+EOF = Token.EOF
+INT = SimpleLangParser.INT
+FLOAT = SimpleLangParser.FLOAT
+STRING_TYPE = SimpleLangParser.STRING
+IDENTIFIER = SimpleLangParser.IDENTIFIER
+LPAREN, RPAREN, LBRACKET, RBRACKET = T("("), T(")"), T("["), T("]")
+LBRACE, RBRACE, LANGLE, RANGLE = T("{"), T("}"), T("<"), T(">")
+COMMA, MINUS, SEMICOLON, DOT = T(","), T("-"), T(";"), T(".")
+COLON, ASSIGN, ARROW, FAT_ARROW = T(":"), T("="), T("->"), T("=>")
+PRIMARY_TYPES = (INT, FLOAT, SimpleLangParser.BOOL, STRING_TYPE, IDENTIFIER)
+PATTERN_TYPES = PRIMARY_TYPES + (T("_"),)
+BASIC_TYPES = (T("int"), T("bool"), T("string"), T("float"))
+
+ARRAY_OPS = {T(name) for name in ("sort", "mean", "median", "variance", "stddev", "play", "linreg", "rotate", "shift", "filter", "map")}
+LIST_OPS = {T(name) for name in ("append", "remove")}
+MATRIX_OPS = {T(name) for name in ("add", "multiply", "invert", "transpose")}
+OPS_WITH_EXPR = {T(name) for name in ("linreg", "rotate", "shift", "append", "remove", "add", "multiply")}
+OPS_WITH_LAMBDA = {T("filter"), T("map")}
+
+# Precedences of the left-recursive `expr` alternatives, as ANTLR numbers
+# them: earlier alternatives bind tighter. The right operand of a binary
+# operator is parsed one level higher, which makes every operator
+# left-associative.
+UNARY_MINUS_PRECEDENCE = 8
+INDEX_PRECEDENCE = 7
+BINARY_PRECEDENCE = {}
+for level, operators in ((6, ("*", "/", "%")), (5, ("+", "-")), (4, (">", "<", ">=", "<=", "==", "!=")), (3, ("and", "or"))):
+    for operator in operators:
+        BINARY_PRECEDENCE[T(operator)] = level
+
+
+class SourceToken(CommonToken):
+    """A CommonToken that is built in one step, since the text is already known."""
+
+    __slots__ = ()
+
+    def __init__(self, ttype, text, start, line, column, index):
+        self.source = CommonToken.EMPTY_SOURCE
+        self.type = ttype
+        self.channel = Token.DEFAULT_CHANNEL
+        self.start = start
+        self.stop = start + len(text) - 1
+        self.tokenIndex = index
+        self.line = line
+        self.column = column
+        self._text = text
+
+
+def scan(code: str, offset=0, line=1, line_start=0, index=0, final=True):
+    """Tokenizes code, which starts at character `offset` of the source.
+
+    Returns (tokens, consumed, line, line_start), where `consumed` is how
+    much of code was used. Unless final, scanning stops before a `/*` with
+    no closing `*/` yet, since more input may complete the comment.
+    """
+    tokens = []
+    append = tokens.append
+    position = 0
+    for m in TOKEN_PATTERN.finditer(code):
+        start = m.start()
+        if start != position:
+            break
+        kind = m.lastindex
+        text = m.group(kind)
+        end = m.end()
+        if kind == SKIP:
+            if "\n" in text:
+                line += text.count("\n")
+                line_start = offset + start + text.rindex("\n") + 1
+            position = end
+            continue
+        if kind == WORD:
+            ttype = KEYWORDS.get(text, IDENTIFIER)
+        elif kind == PUNCTUATION:
+            if not final and text == "/" and code.startswith("*", end):
+                return tokens, position, line, line_start
+            ttype = LITERAL_TYPES[text]
+        elif kind == NUMBER:
+            ttype = FLOAT if "." in text else INT
+        else:
+            ttype = STRING_TYPE
+        append(SourceToken(ttype, text, offset + start, line, offset + start - line_start, index + len(tokens)))
+        position = end
+
+    if position != len(code):
+        column = offset + position - line_start
+        raise ParseError(f"line {line}:{column} token recognition error at: '{code[position]}'")
+    return tokens, position, line, line_start
+
+
+def eof_token(position, line, line_start, index):
+    token = SourceToken(EOF, "<EOF>", position, line, position - line_start, index)
+    token.stop = position - 1
+    return token
+
+
+def tokenize(code: str) -> List[CommonToken]:
+    """Splits code into tokens the way SimpleLangLexer does, ending with EOF."""
+    tokens, position, line, line_start = scan(code)
+    tokens.append(eof_token(position, line, line_start, len(tokens)))
+    return tokens
+
+
+class TokenReader:
+    """Tokenizes lines of source on demand, holding only tokens not yet released.
+
+    Indexing is by absolute token index, like a token list. Once the input
+    runs out, indexes past the end return the EOF token.
+    """
+
+    def __init__(self, lines: Iterable[str]):
+        self.lines = iter(lines)
+        self.buffer: List[CommonToken] = []
+        self.base = 0
+        self.pending = ""
+        self.offset = 0
+        self.line, self.line_start = 1, 0
+        self.done = False
+
+    def __getitem__(self, index):
+        while index - self.base >= len(self.buffer) and not self.done:
+            self.fill()
+        return self.buffer[min(index - self.base, len(self.buffer) - 1)]
+
+    def fill(self):
+        line = next(self.lines, None)
+        final = line is None
+        code = self.pending if final else self.pending + line
+        next_index = self.base + len(self.buffer)
+        tokens, consumed, self.line, self.line_start = scan(
+            code, self.offset, self.line, self.line_start, next_index, final
+        )
+        self.buffer.extend(tokens)
+        self.pending = code[consumed:]
+        self.offset += consumed
+        if final:
+            self.buffer.append(eof_token(self.offset, self.line, self.line_start, next_index + len(tokens)))
+            self.done = True
+
+    def release(self, index):
+        """Drops the tokens before index; they can no longer be read."""
+        del self.buffer[:index - self.base]
+        self.base = index
+
+
+class NumericArrayContext(SimpleLangParser.ExprContext):
+    """An `expr` that is an array literal of INT/FLOAT tokens only.
+
+    The literal is decoded while parsing (numeric_literal), and visitors
+    with a visitNumericArray method use that directly. The per-element
+    expr and primary nodes are only built if something walks the children,
+    so a long literal costs one node rather than three per element.
+    """
+
+    element_tokens = None
+
+    def __init__(self, parent, tokens, literal: NumericLiteral):
+        super().__init__(None, parent)
+        self.start, self.stop = tokens[0], tokens[-1]
+        self.element_tokens = tokens
+        self.numeric_literal = literal
+
+    @property
+    def children(self):
+        if self.element_tokens is not None:
+            tokens, self.element_tokens = self.element_tokens, None
+            self._children = [self.element(token) for token in tokens]
+        return self._children
+
+    @children.setter
+    def children(self, value):
+        self._children = value
+
+    def element(self, token):
+        if token.type != INT and token.type != FLOAT:
+            node = TerminalNodeImpl(token)
+            node.parentCtx = self
+            return node
+        expr = SimpleLangParser.ExprContext(None, self)
+        primary = SimpleLangParser.PrimaryContext(None, expr)
+        expr.start = expr.stop = primary.start = primary.stop = token
+        primary.addTokenNode(token)
+        expr.addChild(primary)
+        return expr
+
+    def accept(self, visitor):
+        if hasattr(visitor, "visitNumericArray"):
+            return visitor.visitNumericArray(self)
+        return super().accept(visitor)
+
+
+class PrattParser:
+    """Recursive-descent parser for SimpleLang.g4 with precedence climbing for `expr`.
+
+    It builds the same SimpleLangParser context objects as the generated
+    parser, so the Interpreter and the Lowerer consume its trees unchanged.
+    Any input it does not accept raises ParseError without recovery;
+    parsing.parse then re-parses with ANTLR to report the syntax errors.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    # Helpers
+
+    def peek(self, offset=0):
+        # Never reads past EOF: lookahead is only used after a token that
+        # cannot be the last one.
+        return self.tokens[self.pos + offset].type
+
+    def match(self, ctx, ttype):
+        token = self.tokens[self.pos]
+        if token.type != ttype:
+            self.error(token)
+        if ttype != EOF:
+            self.pos += 1
+        ctx.addTokenNode(token)
+        return token
+
+    def error(self, token):
+        raise ParseError(f"line {token.line}:{token.column} unexpected input '{token.text}'")
+
+    def enter(self, context_class, parent):
+        ctx = context_class(None, parent)
+        ctx.start = self.tokens[self.pos]
+        return ctx
+
+    def exit(self, ctx, parent):
+        ctx.stop = self.tokens[self.pos - 1] if self.pos else None
+        if parent is not None:
+            parent.addChild(ctx)
+        return ctx
+
+    # Rules
+
+    def items(self) -> Iterator:
+        """Yields the top-level functionDecl and statement contexts one at a time.
+
+        Each item is parsed without a parent ProgramContext, and the tokens
+        it used are released before it is yielded.
+        """
+        while self.peek() != EOF:
+            if self.peek() == T("func"):
+                item = self.functionDecl(None)
+            else:
+                item = self.statement(None)
+            self.tokens.release(self.pos)
+            yield item
+
+    def program(self):
+        ctx = self.enter(SimpleLangParser.ProgramContext, None)
+        while self.peek() != EOF:
+            if self.peek() == T("func"):
+                self.functionDecl(ctx)
+            else:
+                self.statement(ctx)
+        self.match(ctx, EOF)
+        return self.exit(ctx, None)
+
+    def functionDecl(self, parent):
+        ctx = self.enter(SimpleLangParser.FunctionDeclContext, parent)
+        self.match(ctx, T("func"))
+        self.match(ctx, IDENTIFIER)
+        self.match(ctx, LPAREN)
+        if self.peek() == IDENTIFIER:
+            self.paramList(ctx)
+        self.match(ctx, RPAREN)
+        self.match(ctx, ARROW)
+        self.type_(ctx)
+        self.block(ctx)
+        return self.exit(ctx, parent)
+
+    def paramList(self, parent):
+        ctx = self.enter(SimpleLangParser.ParamListContext, parent)
+        self.parameter(ctx)
+        while self.peek() == COMMA:
+            self.match(ctx, COMMA)
+            self.parameter(ctx)
+        return self.exit(ctx, parent)
+
+    def parameter(self, parent):
+        ctx = self.enter(SimpleLangParser.ParameterContext, parent)
+        self.match(ctx, IDENTIFIER)
+        self.match(ctx, COLON)
+        self.type_(ctx)
+        if self.peek() == ASSIGN:
+            self.match(ctx, ASSIGN)
+            self.expr(ctx)
+        return self.exit(ctx, parent)
+
+    def type_(self, parent):
+        ctx = self.enter(SimpleLangParser.TypeContext, parent)
+        ttype = self.peek()
+        if ttype in BASIC_TYPES:
+            self.match(ctx, ttype)
+        elif ttype == T("array"):
+            self.containerType(ctx, SimpleLangParser.ArrayTypeContext, ttype)
+        elif ttype == T("list"):
+            self.containerType(ctx, SimpleLangParser.ListTypeContext, ttype)
+        else:
+            self.error(self.tokens[self.pos])
+        return self.exit(ctx, parent)
+
+    def containerType(self, parent, context_class, keyword):
+        ctx = self.enter(context_class, parent)
+        self.match(ctx, keyword)
+        self.match(ctx, LANGLE)
+        self.type_(ctx)
+        self.match(ctx, RANGLE)
+        return self.exit(ctx, parent)
+
+    def block(self, parent):
+        ctx = self.enter(SimpleLangParser.BlockContext, parent)
+        self.match(ctx, LBRACE)
+        while self.peek() not in (RBRACE, EOF):
+            self.statement(ctx)
+        self.match(ctx, RBRACE)
+        return self.exit(ctx, parent)
+
+    def statement(self, parent):
+        ctx = self.enter(SimpleLangParser.StatementContext, parent)
+        ttype = self.peek()
+        if ttype == IDENTIFIER:
+            following = self.peek(1)
+            if following == LPAREN:
+                self.functionCall(ctx)
+                self.match(ctx, SEMICOLON)
+            elif following == DOT:
+                # `sort` is valid for both arrays and lists; like ANTLR, the
+                # earlier alternative (arrayOp) wins.
+                op = self.peek(2)
+                if op in ARRAY_OPS:
+                    self.methodOp(ctx, SimpleLangParser.ArrayOpContext)
+                elif op in LIST_OPS:
+                    self.methodOp(ctx, SimpleLangParser.ListOpContext)
+                elif op in MATRIX_OPS:
+                    self.methodOp(ctx, SimpleLangParser.MatrixOpContext)
+                else:
+                    self.error(self.tokens[self.pos + 2])
+            else:
+                self.assignment(ctx)
+        elif ttype == T("let"):
+            self.varDecl(ctx)
+        elif ttype == T("return"):
+            self.returnStmt(ctx)
+        elif ttype == T("if"):
+            self.ifStatement(ctx)
+        elif ttype == T("while"):
+            self.whileStatement(ctx)
+        elif ttype == LBRACE:
+            self.block(ctx)
+        elif ttype == T("match"):
+            self.matchStatement(ctx)
+        else:
+            self.error(self.tokens[self.pos])
+        return self.exit(ctx, parent)
+
+    def varDecl(self, parent):
+        ctx = self.enter(SimpleLangParser.VarDeclContext, parent)
+        self.match(ctx, T("let"))
+        self.match(ctx, IDENTIFIER)
+        self.match(ctx, COLON)
+        self.type_(ctx)
+        if self.peek() == ASSIGN:
+            self.match(ctx, ASSIGN)
+            self.expr(ctx)
+        self.match(ctx, SEMICOLON)
+        return self.exit(ctx, parent)
+
+    def assignment(self, parent):
+        ctx = self.enter(SimpleLangParser.AssignmentContext, parent)
+        self.match(ctx, IDENTIFIER)
+        if self.peek() == LBRACKET:
+            self.match(ctx, LBRACKET)
+            self.expr(ctx)
+            self.match(ctx, RBRACKET)
+        self.match(ctx, ASSIGN)
+        self.expr(ctx)
+        self.match(ctx, SEMICOLON)
+        return self.exit(ctx, parent)
+
+    def methodOp(self, parent, context_class):
+        """arrayOp, listOp and matrixOp, which differ only in the accepted names."""
+        ctx = self.enter(context_class, parent)
+        self.match(ctx, IDENTIFIER)
+        self.match(ctx, DOT)
+        op = self.peek()
+        self.match(ctx, op)
+        self.match(ctx, LPAREN)
+        if op in OPS_WITH_EXPR:
+            self.expr(ctx)
+        elif op in OPS_WITH_LAMBDA:
+            self.lambdaExpr(ctx)
+        elif op == T("sort") and self.peek() == T("desc"):
+            self.match(ctx, T("desc"))
+        self.match(ctx, RPAREN)
+        self.match(ctx, SEMICOLON)
+        return self.exit(ctx, parent)
+
+    def lambdaExpr(self, parent):
+        ctx = self.enter(SimpleLangParser.LambdaExprContext, parent)
+        self.match(ctx, IDENTIFIER)
+        self.match(ctx, FAT_ARROW)
+        self.expr(ctx)
+        return self.exit(ctx, parent)
+
+    def matchStatement(self, parent):
+        ctx = self.enter(SimpleLangParser.MatchStatementContext, parent)
+        self.match(ctx, T("match"))
+        self.expr(ctx)
+        self.match(ctx, LBRACE)
+        self.matchCase(ctx)
+        while self.peek() == T("case"):
+            self.matchCase(ctx)
+        self.match(ctx, RBRACE)
+        return self.exit(ctx, parent)
+
+    def matchCase(self, parent):
+        ctx = self.enter(SimpleLangParser.MatchCaseContext, parent)
+        self.match(ctx, T("case"))
+        self.pattern(ctx)
+        self.match(ctx, FAT_ARROW)
+        self.statement(ctx)
+        return self.exit(ctx, parent)
+
+    def pattern(self, parent):
+        ctx = self.enter(SimpleLangParser.PatternContext, parent)
+        ttype = self.peek()
+        if ttype in PATTERN_TYPES:
+            self.match(ctx, ttype)
+        elif ttype == LBRACKET:
+            self.match(ctx, LBRACKET)
+            self.pattern(ctx)
+            while self.peek() == COMMA:
+                self.match(ctx, COMMA)
+                self.pattern(ctx)
+            self.match(ctx, RBRACKET)
+        elif ttype == LBRACE:
+            self.match(ctx, LBRACE)
+            self.match(ctx, IDENTIFIER)
+            self.match(ctx, COLON)
+            self.pattern(ctx)
+            while self.peek() == COMMA:
+                self.match(ctx, COMMA)
+                self.match(ctx, IDENTIFIER)
+                self.match(ctx, COLON)
+                self.pattern(ctx)
+            self.match(ctx, RBRACE)
+        else:
+            self.error(self.tokens[self.pos])
+        return self.exit(ctx, parent)
+
+    def ifStatement(self, parent):
+        ctx = self.enter(SimpleLangParser.IfStatementContext, parent)
+        self.match(ctx, T("if"))
+        self.match(ctx, LPAREN)
+        self.expr(ctx)
+        self.match(ctx, RPAREN)
+        self.block(ctx)
+        if self.peek() == T("else"):
+            self.match(ctx, T("else"))
+            self.block(ctx)
+        return self.exit(ctx, parent)
+
+    def whileStatement(self, parent):
+        ctx = self.enter(SimpleLangParser.WhileStatementContext, parent)
+        self.match(ctx, T("while"))
+        self.match(ctx, LPAREN)
+        self.expr(ctx)
+        self.match(ctx, RPAREN)
+        self.block(ctx)
+        return self.exit(ctx, parent)
+
+    def returnStmt(self, parent):
+        ctx = self.enter(SimpleLangParser.ReturnStmtContext, parent)
+        self.match(ctx, T("return"))
+        if self.peek() != SEMICOLON:
+            self.expr(ctx)
+        self.match(ctx, SEMICOLON)
+        return self.exit(ctx, parent)
+
+    def expr(self, parent, precedence=0):
+        ctx = self.enter(SimpleLangParser.ExprContext, parent)
+        ttype = self.peek()
+        if ttype == IDENTIFIER and self.peek(1) == LPAREN:
+            self.functionCall(ctx)
+        elif ttype in PRIMARY_TYPES:
+            self.primary(ctx)
+        elif ttype == MINUS:
+            self.match(ctx, MINUS)
+            self.expr(ctx, UNARY_MINUS_PRECEDENCE)
+        elif ttype == LBRACKET:
+            numeric_array = self.numeric_array(parent)
+            if numeric_array is not None:
+                ctx = numeric_array
+            else:
+                self.match(ctx, LBRACKET)
+                if self.peek() != RBRACKET:
+                    self.expr(ctx)
+                    while self.peek() == COMMA:
+                        self.match(ctx, COMMA)
+                        self.expr(ctx)
+                self.match(ctx, RBRACKET)
+        elif ttype == LPAREN:
+            self.match(ctx, LPAREN)
+            self.expr(ctx)
+            self.match(ctx, RPAREN)
+        else:
+            self.error(self.tokens[self.pos])
+        ctx.stop = self.tokens[self.pos - 1]
+
+        # Each operator found wraps the expression parsed so far, the same
+        # shape ANTLR builds for left-recursive rules.
+        while True:
+            ttype = self.peek()
+            if ttype == LBRACKET and INDEX_PRECEDENCE >= precedence:
+                ctx = self.wrap(ctx, parent)
+                self.match(ctx, LBRACKET)
+                self.expr(ctx)
+                self.match(ctx, RBRACKET)
+            elif BINARY_PRECEDENCE.get(ttype, -1) >= precedence:
+                level = BINARY_PRECEDENCE[ttype]
+                ctx = self.wrap(ctx, parent)
+                ctx.op = self.match(ctx, ttype)
+                self.expr(ctx, level + 1)
+            else:
+                break
+            ctx.stop = self.tokens[self.pos - 1]
+        parent.addChild(ctx)
+        return ctx
+
+    def numeric_array(self, parent):
+        """Parses `[` INT/FLOAT (`,` INT/FLOAT)* `]` into a NumericArrayContext; None if the literal is anything else."""
+        tokens = self.tokens
+        end = self.pos
+        while True:
+            ttype = tokens[end + 1].type
+            if ttype != INT and ttype != FLOAT:
+                return None
+            ttype = tokens[end + 2].type
+            end += 2
+            if ttype == RBRACKET:
+                break
+            if ttype != COMMA:
+                return None
+        literal_tokens = [tokens[index] for index in range(self.pos, end + 1)]
+        literal = NumericLiteral.from_tokens(literal_tokens[1::2])
+        if literal is None:
+            return None
+        self.pos = end + 1
+        return NumericArrayContext(parent, literal_tokens, literal)
+
+    def wrap(self, operand, parent):
+        ctx = SimpleLangParser.ExprContext(None, parent)
+        ctx.start = operand.start
+        operand.parentCtx = ctx
+        ctx.addChild(operand)
+        return ctx
+
+    def functionCall(self, parent):
+        ctx = self.enter(SimpleLangParser.FunctionCallContext, parent)
+        self.match(ctx, IDENTIFIER)
+        self.match(ctx, LPAREN)
+        if self.peek() != RPAREN:
+            self.expr(ctx)
+            while self.peek() == COMMA:
+                self.match(ctx, COMMA)
+                self.expr(ctx)
+        self.match(ctx, RPAREN)
+        return self.exit(ctx, parent)
+
+    def primary(self, parent):
+        ctx = self.enter(SimpleLangParser.PrimaryContext, parent)
+        self.match(ctx, self.peek())
+        return self.exit(ctx, parent)
+
+
+def parse(code: str):
+    """Parses code into a SimpleLangParser.ProgramContext, raising ParseError on invalid input."""
+    # The tree is built from many small objects and has no garbage to find,
+    # so the cyclic collector only slows construction down.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return PrattParser(tokenize(code)).program()
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def parse_items(lines: Iterable[str]) -> Iterator:
+    """Parses a program lazily, one top-level item at a time, from an iterable of lines.
+
+    Memory use is bounded by the largest single item rather than by the
+    length of the program. Invalid input raises ParseError at the item that
+    contains it; there is no error recovery.
+    """
+    return PrattParser(TokenReader(lines)).items()
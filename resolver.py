@@ -0,0 +1,269 @@
+from typing import Dict, List
+from lowering import (
+    Assign,
+    BinOp,
+    Block,
+    Call,
+    CallStmt,
+    Const,
+    FuncDecl,
+    If,
+    Index,
+    Inline,
+    Invariant,
+    ListLit,
+    NumericListLit,
+    Match,
+    MethodOp,
+    Name,
+    Neg,
+    Pipeline,
+    Program,
+    Return,
+    VarDecl,
+    While,
+)
+
+
+# Addresses are (depth, slot) pairs. Depth 0 is the frame of the code being
+# executed (the main program or the current function call) and depth 1 is the
+# global frame. Functions can only be declared at the top level, so no other
+# depths exist; blocks never get frames of their own.
+LOCAL = 0
+GLOBAL = 1
+
+BUILTINS = ("print", "len")
+STATISTICS = ("mean", "median", "variance", "stddev")
+
+UNSET = object()
+
+
+class Frame:
+    __slots__ = ("slots", "parent")
+
+    def __init__(self, size, parent=None):
+        self.slots = [None] * size
+        self.parent = parent
+
+
+class GlobalFrame(Frame):
+    """The global frame, which can also be read by name from the host side."""
+
+    __slots__ = ("index",)
+
+    def __init__(self, names):
+        super().__init__(len(names))
+        self.slots = [UNSET] * len(names)
+        self.index = {name: i for i, name in enumerate(names)}
+
+    def get(self, name):
+        value = self.slots[self.index[name]] if name in self.index else UNSET
+        if value is UNSET:
+            raise NameError(f"Variable '{name}' is not defined")
+        return value
+
+    def define(self, name, value):
+        self.slots[self.index[name]] = value
+
+    def parameter(self, name):
+        """The value of a parameter a call leaves out and that has no default.
+
+        The tree backend leaves such a parameter unbound, so reading it
+        finds the global of the same name. Without one, the tree backend
+        raises NameError only if the parameter is read; the slot backends
+        store None instead.
+        """
+        value = self.slots[self.index[name]] if name in self.index else UNSET
+        return None if value is UNSET else value
+
+
+def result_names(node: MethodOp) -> List[str]:
+    """Variables a method statement defines, e.g. `data.mean();` defines data_mean."""
+    name, op = node.target, node.op
+    if node.kind == "list" or op in ("sort", "play"):
+        return []
+    if op == "linreg":
+        return [f"{name}_slope", f"{name}_intercept", f"{name}_r_squared"]
+    return [f"{name}_{op}"]
+
+
+class _FrameLayout:
+    def __init__(self, nparams=0):
+        self.scopes: List[Dict[str, int]] = []
+        self.next_slot = nparams
+        self.size = nparams
+
+
+class Resolver:
+    """Assigns a (depth, slot) address to every variable use and declaration.
+
+    Declarations inside blocks get slots in the enclosing function frame (or
+    the main program's frame); slots are reused once a block is left.
+    Top-level declarations, and any name that is not found in an enclosing
+    block, are addressed in the global frame by name, so functions can refer
+    to globals declared after them.
+    """
+
+    def __init__(self):
+        self.global_names: List[str] = list(BUILTINS)
+        self.global_index: Dict[str, int] = {name: i for i, name in enumerate(BUILTINS)}
+
+    def resolve(self, program: Program) -> Program:
+        self.layout = _FrameLayout()
+        self.in_main = True
+        for item in program.body:
+            self.stmt(item)
+        program.frame_size = self.layout.size
+        program.global_names = self.global_names
+        return program
+
+    # Names
+
+    def global_slot(self, name):
+        if name not in self.global_index:
+            self.global_index[name] = len(self.global_names)
+            self.global_names.append(name)
+        return self.global_index[name]
+
+    def lookup(self, name):
+        for scope in reversed(self.layout.scopes):
+            if name in scope:
+                return (LOCAL, scope[name])
+        return (GLOBAL, self.global_slot(name))
+
+    def declare(self, name):
+        """Binds name in the innermost scope and returns its address."""
+        if self.in_main and not self.layout.scopes:
+            return (GLOBAL, self.global_slot(name))
+        scope = self.layout.scopes[-1]
+        slot = self.layout.next_slot
+        self.layout.next_slot += 1
+        self.layout.size = max(self.layout.size, self.layout.next_slot)
+        scope[name] = slot
+        return (LOCAL, slot)
+
+    # Statements
+
+    def stmt(self, node):
+        getattr(self, "stmt_" + type(node).__name__)(node)
+
+    def block(self, node: Block):
+        mark = self.layout.next_slot
+        self.layout.scopes.append({})
+        for stmt in node.body:
+            self.stmt(stmt)
+        self.layout.scopes.pop()
+        self.layout.next_slot = mark
+
+    def stmt_Block(self, node: Block):
+        self.block(node)
+
+    def stmt_FuncDecl(self, node: FuncDecl):
+        for param in node.params:
+            if param.default is not None:
+                self.expr(param.default)
+        node.address = self.declare(node.name)
+
+        outer, outer_in_main = self.layout, self.in_main
+        self.layout = _FrameLayout(len(node.params))
+        self.layout.scopes.append({param.name: i for i, param in enumerate(node.params)})
+        self.in_main = False
+        self.block(node.body)
+        node.frame_size = self.layout.size
+        self.layout, self.in_main = outer, outer_in_main
+
+    def stmt_VarDecl(self, node: VarDecl):
+        if node.value is not None:
+            self.expr(node.value)
+        node.address = self.declare(node.name)
+
+    def stmt_Assign(self, node: Assign):
+        node.address = self.lookup(node.name)
+        if node.index is not None:
+            self.expr(node.index)
+        self.expr(node.value)
+
+    def stmt_CallStmt(self, node: CallStmt):
+        self.expr(node.call)
+
+    def stmt_Return(self, node: Return):
+        if node.value is not None:
+            self.expr(node.value)
+
+    def stmt_If(self, node: If):
+        self.expr(node.cond)
+        self.block(node.then)
+        if node.orelse is not None:
+            self.block(node.orelse)
+
+    def stmt_While(self, node: While):
+        if not node.invariants:
+            self.expr(node.cond)
+            self.block(node.body)
+            return
+        # Invariant values live in hidden slots of the enclosing frame for as long as the loop runs.
+        mark = self.layout.next_slot
+        self.layout.scopes.append({})
+        for i, invariant in enumerate(node.invariants):
+            invariant.address = self.declare(f"<invariant {i}>")
+        self.expr(node.cond)
+        self.block(node.body)
+        self.layout.scopes.pop()
+        self.layout.next_slot = mark
+
+    def stmt_Match(self, node: Match):
+        self.expr(node.subject)
+        for case in node.cases:
+            self.stmt(case.body)
+
+    def stmt_MethodOp(self, node: MethodOp):
+        node.address = self.lookup(node.target)
+        if node.arg is not None:
+            self.expr(node.arg)
+        if node.lam is not None:
+            self.layout.scopes.append({})
+            node.lam.address = self.declare(node.lam.param)
+            self.expr(node.lam.body)
+            self.layout.scopes.pop()
+        node.result_addresses = [self.declare(name) for name in result_names(node)]
+
+    def stmt_Pipeline(self, node: Pipeline):
+        for stage in node.stages:
+            self.stmt_MethodOp(stage)
+
+    # Expressions
+
+    def expr(self, node):
+        if isinstance(node, Name):
+            node.address = self.lookup(node.name)
+        elif isinstance(node, Call):
+            node.address = self.lookup(node.name)
+            for arg in node.args:
+                self.expr(arg)
+        elif isinstance(node, BinOp):
+            self.expr(node.left)
+            self.expr(node.right)
+        elif isinstance(node, Neg):
+            self.expr(node.operand)
+        elif isinstance(node, Index):
+            self.expr(node.container)
+            self.expr(node.index)
+        elif isinstance(node, Invariant):
+            self.expr(node.expr)
+        elif isinstance(node, Inline):
+            self.expr(node.call)
+            # The body sees the arguments, in hidden slots of this frame, and the globals, as it would in its own frame.
+            outer_scopes, mark = self.layout.scopes, self.layout.next_slot
+            self.layout.scopes = [{}]
+            node.addresses = [self.declare(param.name) for param in node.decl.params]
+            self.expr(node.body)
+            self.layout.scopes, self.layout.next_slot = outer_scopes, mark
+        elif isinstance(node, ListLit):
+            for item in node.items:
+                self.expr(item)
+        elif not isinstance(node, (Const, NumericListLit)):
+            raise TypeError(f"Unexpected expression node {type(node).__name__}")
+
+
+def resolve(program: Program) -> Program:
+    return Resolver().resolve(program)
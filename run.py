@@ -1,36 +1,153 @@
 import sys
-from antlr4 import *
-from SimpleLangLexer import SimpleLangLexer
-from SimpleLangParser import SimpleLangParser
+import argparse
 from interpreter import Interpreter
+from parsing import FRONTENDS, PARSE_STATS, parse
+
+BACKENDS = ("tree", "closure", "vm")
+
+
+def load_program(code: str, filename: str = None, cache=None, frontend: str = "antlr"):
+    """Returns the lowered program, from the on-disk cache when possible."""
+    from lowering import lower
+
+    if cache is not None and filename is not None:
+        program = cache.load(filename, code)
+        if program is not None:
+            return program
+
+    program = lower(parse(code, frontend=frontend))
+    if cache is not None and filename is not None:
+        cache.store(filename, code, program)
+    return program
+
+
+def run_code(
+    code: str,
+    backend: str = "tree",
+    filename: str = None,
+    cache=None,
+    frontend: str = "antlr",
+    memo_size: int = 0,
+    memos: list = None,
+):
+    """Runs code; with memo_size > 0, pure functions cache that many results each, and their Memo tables are added to memos."""
+    if backend == "tree":
+        interpreter = Interpreter(memo_size, memos)
+        return interpreter.visit(parse(code, frontend=frontend))
+
+    program = load_program(code, filename, cache, frontend)
+
+    if backend == "closure":
+        from compiler import CompiledInterpreter
+        interpreter = CompiledInterpreter(memo_size, memos)
+        return interpreter.run(program)
+
+    from bytecode import compile_program
+    from vm import VirtualMachine
+    return VirtualMachine(compile_program(program), memo_size, memos).run()
+
+
+def stream_code(lines, interpreter: Interpreter = None):
+    """Runs a program on the tree backend one top-level item at a time.
+
+    Each functionDecl or statement is parsed from `lines` (e.g. an open
+    file), executed and then dropped, so memory does not grow with the
+    length of the script. Parsing uses the hand-written front-end, and a
+    syntax error stops the run at the item that contains it.
+    """
+    from optimizer import optimize
+    from pratt import parse_items
+
+    if interpreter is None:
+        interpreter = Interpreter()
+    for item in parse_items(lines):
+        interpreter.visit(optimize(item))
+    return interpreter
 
-def run_code(code: str):
-    input_stream = InputStream(code)
-    lexer = SimpleLangLexer(input_stream)
-    token_stream = CommonTokenStream(lexer)
-    parser = SimpleLangParser(token_stream)
-    tree = parser.program()
-    
-    interpreter = Interpreter()
-    return interpreter.visit(tree)
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Run a SimpleLang program.")
+    arg_parser.add_argument("filename")
+    arg_parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="tree",
+        help="tree walks the parse tree; closure compiles it to Python closures; vm runs register bytecode",
+    )
+    arg_parser.add_argument(
+        "--parser",
+        choices=FRONTENDS,
+        default="antlr",
+        help="antlr uses the generated SimpleLangParser; pratt uses the faster hand-written parser in pratt.py",
+    )
+    arg_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="do not use the __arrcache__ caches: the parser DFA cache, and the program cache of the closure and vm backends",
+    )
+    arg_parser.add_argument("--cache-dir", help="directory for cached programs and the parser DFA cache instead of __arrcache__")
+    arg_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="parse and run one top-level statement at a time, for scripts too large to hold in memory (tree backend)",
+    )
+    arg_parser.add_argument(
+        "--memoize",
+        type=int,
+        default=0,
+        metavar="SIZE",
+        help="cache up to SIZE results of each function whose result depends only on its arguments (least recently used are evicted)",
+    )
+    arg_parser.add_argument(
+        "--memo-stats",
+        action="store_true",
+        help="report the cache hits and misses of each memoized function",
+    )
+    arg_parser.add_argument(
+        "--parse-stats",
+        action="store_true",
+        help="report how many parses needed the full LL fallback after the fast SLL pass",
+    )
+
     # Check if a filename is provided as a command-line argument
     if len(sys.argv) < 2:
         print("Usage: python run.py [filename].txt")
         sys.exit(1)
 
-    # Get the filename from the command-line arguments
-    filename = sys.argv[1]
-    
+    args = arg_parser.parse_args()
+    filename = args.filename
+    if args.stream and args.backend != "tree":
+        arg_parser.error("--stream is only supported by the tree backend")
+    if args.stream and args.memoize:
+        arg_parser.error("--memoize is not supported with --stream")
+    memos = []
+
     try:
-        # Open and read the file
-        with open(filename, 'r') as file:
-            code = file.read()
-        
-        # Pass the file content to the interpreter
-        interpreter = run_code(code)
+        if args.stream:
+            with open(filename, 'r') as file:
+                interpreter = stream_code(file)
+        else:
+            # Open and read the file
+            with open(filename, 'r') as file:
+                code = file.read()
+
+            if not args.no_cache:
+                from cache import DFACache
+                DFACache(args.cache_dir).install()
+
+            # Pass the file content to the interpreter
+            cache = None
+            if not args.no_cache and args.backend != "tree":
+                from cache import ProgramCache
+                cache = ProgramCache(args.cache_dir)
+            interpreter = run_code(code, args.backend, filename, cache, args.parser, args.memoize, memos)
     except FileNotFoundError:
         print(f"Error: The file '{filename}' does not exist.")
     except Exception as e:
-        print(f"An error occurred: {e}")
\ No newline at end of file
+        print(f"An error occurred: {e}")
+
+    if args.parse_stats:
+        print(f"Parse stats: {PARSE_STATS}", file=sys.stderr)
+    if args.memo_stats:
+        for memo in memos:
+            print(f"Memo stats: {memo}", file=sys.stderr)
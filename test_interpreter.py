@@ -1,8 +1,46 @@
+import glob
+import random
+import statistics
+from statistics import mean
+from array import array
+import io
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
-from interpreter import Interpreter
+from dataclasses import fields, is_dataclass
+from contextlib import redirect_stderr, redirect_stdout
+from interpreter import NOT_CONSTANT, ArrayOperations, Interpreter, Moments, StatisticsCache, Type, TypedArray, VectorLambda, memo_key, np
 from antlr4 import InputStream, CommonTokenStream
 from SimpleLangLexer import SimpleLangLexer
 from SimpleLangParser import SimpleLangParser
+from compiler import CompiledInterpreter
+from lowering import Block, Call, FuncDecl, Inline, Program, lower, vector_plan
+from cache import DFACache, ProgramCache
+from resolver import GLOBAL, LOCAL, resolve
+from bytecode import compile_program
+from vm import VirtualMachine
+from antlr4.tree.Tree import TerminalNode
+from parsing import ParseStats, parse
+from pratt import ParseError, PrattParser, TokenReader, tokenize
+from typecheck import check
+from optimizer import optimize
+import pratt
+
+
+def run_backends(code, frontend="antlr"):
+    """Runs code on the tree, closure and vm backends in turn; yields (backend, global_env) after each."""
+    tree = Interpreter()
+    tree.visit(parse(code, ParseStats(), frontend=frontend))
+    yield "tree", tree.global_env
+    closure = CompiledInterpreter()
+    closure.run(lower(parse(code, ParseStats(), frontend=frontend)))
+    yield "closure", closure.global_env
+    vm = VirtualMachine(compile_program(lower(parse(code, ParseStats(), frontend=frontend))))
+    vm.run()
+    yield "vm", vm.global_env
+
 
 class TestSimpleLangInterpreter(unittest.TestCase):
     def setUp(self):
@@ -156,6 +194,1339 @@ class TestSimpleLangInterpreter(unittest.TestCase):
         self.assertAlmostEqual(intercept, 0.18, places=2)
         self.assertAlmostEqual(r_squared, 0.9980, places=2)
 
+    def test_method_is_chosen_by_keyword_not_operand_text(self):
+        code = """
+        let means: int = 10;
+        let sorted_nums: array<int> = [3, 1, 2];
+        sorted_nums.map(x => x + means);
+        let adder: array<array<float>> = [[1.0, 0.0], [0.0, 1.0]];
+        let m: array<array<float>> = [[1.0, 2.0], [3.0, 4.0]];
+        m.multiply(adder);
+        """
+        self.run_code(code)
+        env = self.interpreter.global_env
+        self.assertEqual(env.get("sorted_nums_map"), [13, 11, 12])
+        self.assertEqual(env.get("sorted_nums"), [3, 1, 2])
+        self.assertEqual(env.get("m_multiply").tolist(), [[1.0, 2.0], [3.0, 4.0]])
+        self.assertNotIn("m_add", env.values)
+        self.assertNotIn("sorted_nums_mean", env.values)
+
+    def test_binary_site_with_changing_operand_types(self):
+        self.run_code("""
+        func half(x: int) -> float { return x / 2; }
+        let a: float = half(3);
+        let b: float = half(2.5);
+        let c: float = half(true);
+        """)
+        self.assertEqual(self.interpreter.global_env.get("a"), 1.5)
+        self.assertEqual(self.interpreter.global_env.get("b"), 1.25)
+        self.assertEqual(self.interpreter.global_env.get("c"), 0.5)
+        with self.assertRaises(TypeError):
+            self.run_code('let d: float = half("x");')
+
+
+class TestClosureCompiler(unittest.TestCase):
+    def setUp(self):
+        self.interpreter = CompiledInterpreter()
+
+    def run_code(self, code):
+        input_stream = InputStream(code)
+        lexer = SimpleLangLexer(input_stream)
+        token_stream = CommonTokenStream(lexer)
+        parser = SimpleLangParser(token_stream)
+        tree = parser.program()
+        self.interpreter.run(lower(tree))
+
+    def test_function_and_loop(self):
+        code = """
+        func sum_to(n: int) -> int {
+            let total: int = 0;
+            let i: int = 0;
+            while (i <= n) {
+                total = total + i;
+                i = i + 1;
+            }
+            return total;
+        }
+        let result: int = sum_to(10);
+        """
+        self.run_code(code)
+        self.assertEqual(self.interpreter.global_env.get("result"), 55)
+
+    def test_recursion_and_match(self):
+        code = """
+        func fib(n: int) -> int {
+            if (n < 2) { return n; }
+            return fib(n - 1) + fib(n - 2);
+        }
+        let label: string = "";
+        match fib(10) {
+            case 0 => label = "zero";
+            case 55 => label = "fifty five";
+            case _ => label = "other";
+        }
+        """
+        self.run_code(code)
+        self.assertEqual(self.interpreter.global_env.get("label"), "fifty five")
+
+    def test_array_ops(self):
+        code = """
+        let nums: array<int> = [1, 2, 3, 4, 5];
+        nums.map(x => x * x);
+        nums.filter(x => x > 2);
+        let data: array<float> = [1.0, 2.0, 3.0, 4.0, 5.0];
+        data.mean();
+        """
+        self.run_code(code)
+        self.assertEqual(self.interpreter.global_env.get("nums_map"), [1, 4, 9, 16, 25])
+        self.assertEqual(self.interpreter.global_env.get("nums_filter"), [3, 4, 5])
+        self.assertAlmostEqual(self.interpreter.global_env.get("data_mean"), 3.0)
+
+    def test_binary_type_error(self):
+        with self.assertRaises(TypeError):
+            self.run_code('let a: string = "x" + 1;')
+
+
+class TestBytecodeVM(unittest.TestCase):
+    def run_code(self, code):
+        input_stream = InputStream(code)
+        lexer = SimpleLangLexer(input_stream)
+        token_stream = CommonTokenStream(lexer)
+        parser = SimpleLangParser(token_stream)
+        tree = parser.program()
+        self.vm = VirtualMachine(compile_program(lower(tree)))
+        self.vm.run()
+        return self.vm.global_env
+
+    def test_function_and_loop(self):
+        env = self.run_code("""
+        func sum_to(n: int) -> int {
+            let total: int = 0;
+            let i: int = 0;
+            while (i <= n) {
+                total = total + i;
+                i = i + 1;
+            }
+            return total;
+        }
+        let result: int = sum_to(10);
+        """)
+        self.assertEqual(env.get("result"), 55)
+
+    def test_block_scoping(self):
+        env = self.run_code("""
+        let x: int = 1;
+        let seen: list<int> = [];
+        {
+            let x: int = x + 10;
+            seen.append(x);
+        }
+        seen.append(x);
+        """)
+        self.assertEqual(env.get("seen"), [11, 1])
+
+    def test_lambda_captures_locals(self):
+        env = self.run_code("""
+        func scaled(k: int) -> array<int> {
+            let nums: array<int> = [1, 2, 3];
+            nums.map(x => x * k);
+            return nums_map;
+        }
+        let result: array<int> = scaled(3);
+        """)
+        self.assertEqual(env.get("result"), [3, 6, 9])
+
+    def test_match_and_top_level_return(self):
+        env = self.run_code("""
+        let label: string = "";
+        let i: int = 0;
+        while (i < 10) {
+            if (i == 3) { return 0; }
+            i = i + 1;
+        }
+        match i {
+            case 2 => label = "two";
+            case 3 => label = "three";
+        }
+        """)
+        self.assertEqual(env.get("label"), "three")
+
+    def test_undefined_name(self):
+        with self.assertRaises(NameError):
+            self.run_code("print(missing);")
+
+
+class TestResolver(unittest.TestCase):
+    def resolve_code(self, code):
+        input_stream = InputStream(code)
+        lexer = SimpleLangLexer(input_stream)
+        token_stream = CommonTokenStream(lexer)
+        parser = SimpleLangParser(token_stream)
+        return resolve(lower(parser.program()))
+
+    def test_addresses(self):
+        program = self.resolve_code("""
+        let total: int = 0;
+        func f(n: int) -> int {
+            let i: int = 0;
+            while (i < n) {
+                let step: int = i * 2;
+                total = total + step;
+                i = i + 1;
+            }
+            return i;
+        }
+        """)
+        func = program.body[1]
+        loop = func.body.body[1]
+        step_decl, total_assign, i_assign = loop.body.body
+        self.assertEqual(program.body[0].address, (GLOBAL, program.global_names.index("total")))
+        self.assertEqual(func.body.body[0].address, (LOCAL, 1))
+        self.assertEqual(step_decl.address, (LOCAL, 2))
+        self.assertEqual(total_assign.address, (GLOBAL, program.global_names.index("total")))
+        self.assertEqual(total_assign.value.right.address, (LOCAL, 2))
+        self.assertEqual(loop.cond.right.address, (LOCAL, 0))
+        self.assertEqual(func.frame_size, 3)
+
+    def test_shadowing_in_blocks(self):
+        program = self.resolve_code("""
+        let x: int = 1;
+        {
+            let y: int = x;
+            let x: int = 2;
+            print(x);
+        }
+        """)
+        y_decl, x_decl, print_stmt = program.body[1].body
+        self.assertEqual(y_decl.value.address[0], GLOBAL)
+        self.assertEqual(x_decl.address, (LOCAL, 1))
+        self.assertEqual(print_stmt.call.args[0].address, (LOCAL, 1))
+
+    def test_skips_recovered_syntax_errors(self):
+        with redirect_stderr(io.StringIO()):
+            program = self.resolve_code('"" let a: int = 1; { "" let b: int = a; }')
+        self.assertEqual([type(node).__name__ for node in program.body], ["VarDecl", "Block"])
+        self.assertEqual([type(node).__name__ for node in program.body[1].body], ["VarDecl"])
+
+
+class TestProgramCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = ProgramCache(self.tmp.name)
+        self.script = os.path.join(self.tmp.name, "script.arrlang")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def lower_code(self, code):
+        input_stream = InputStream(code)
+        lexer = SimpleLangLexer(input_stream)
+        token_stream = CommonTokenStream(lexer)
+        parser = SimpleLangParser(token_stream)
+        return lower(parser.program())
+
+    def test_round_trip(self):
+        code = "let a: int = 1 + 2;"
+        self.assertIsNone(self.cache.load(self.script, code))
+        self.assertTrue(self.cache.store(self.script, code, self.lower_code(code)))
+        program = self.cache.load(self.script, code)
+        self.assertEqual(program, self.lower_code(code))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_changed_source_evicts_old_entry(self):
+        old, new = "let a: int = 1;", "let a: int = 2;"
+        self.cache.store(self.script, old, self.lower_code(old))
+        self.cache.store(self.script, new, self.lower_code(new))
+        self.assertEqual(len(os.listdir(self.tmp.name)), 1)
+        self.assertIsNone(self.cache.load(self.script, old))
+        self.assertIsNotNone(self.cache.load(self.script, new))
+
+    def test_corrupt_entry_is_a_miss(self):
+        code = "let a: int = 1;"
+        with open(self.cache.entry_path(self.script, code), "wb") as entry:
+            entry.write(b"not a pickle")
+        self.assertIsNone(self.cache.load(self.script, code))
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+
+class TestDFACache(unittest.TestCase):
+    CODE = """
+    func f(a: int) -> int { return a * 2 + 1; }
+    let xs: array<int> = [1, 2, 3];
+    xs.map(x => f(x) - 1);
+    match xs { case [1, _, 3] => print(xs); case _ => print(0); }
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = DFACache(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def tree_text(self):
+        return parse(self.CODE, ParseStats()).toStringTree(recog=SimpleLangParser)
+
+    def test_round_trip_keeps_dfa_warm(self):
+        expected = self.tree_text()
+        states = self.cache.state_count()
+        self.assertTrue(self.cache.store())
+        self.assertFalse(self.cache.store())
+
+        self.cache.reset()
+        self.assertEqual(self.cache.state_count(), 0)
+        self.assertTrue(self.cache.load())
+        self.assertEqual(self.cache.state_count(), states)
+        # Restored states are found again, so parsing the same input adds none.
+        self.assertEqual(self.tree_text(), expected)
+        self.assertEqual(self.cache.state_count(), states)
+
+    def test_entry_for_other_grammar_is_ignored(self):
+        self.tree_text()
+        self.cache.store()
+        with open(self.cache.path, "rb") as entry:
+            data = entry.read()
+        with open(self.cache.path, "wb") as entry:
+            entry.write(data.replace(self.cache.key().encode(), b"0" * 64))
+        self.assertFalse(self.cache.load())
+
+
+class TestLazyImports(unittest.TestCase):
+    def loaded_modules(self, code):
+        script = (
+            "import sys, run\n"
+            f"run.run_code({code!r})\n"
+            "print(sorted(m for m in ('numpy', 'scipy', 'simpleaudio', 'pygame') if m in sys.modules))\n"
+        )
+        here = os.path.dirname(os.path.abspath(__file__))
+        result = subprocess.run([sys.executable, "-c", script], cwd=here, capture_output=True, text=True, check=True)
+        return result.stdout.strip().splitlines()[-1]
+
+    def test_scalar_script_imports_nothing_heavy(self):
+        self.assertEqual(self.loaded_modules("let a: int = 1; let l: list<int> = [a]; print(l[0] + 1);"), "[]")
+
+    def test_float_array_imports_numpy(self):
+        self.assertEqual(self.loaded_modules("let a: array<float> = [1.0, 2.0]; a.mean();"), "['numpy']")
+
+
+class TestTwoStageParsing(unittest.TestCase):
+    def parse_ll(self, code):
+        input_stream = InputStream(code)
+        lexer = SimpleLangLexer(input_stream)
+        token_stream = CommonTokenStream(lexer)
+        parser = SimpleLangParser(token_stream)
+        return parser, parser.program()
+
+    def test_valid_program_uses_sll(self):
+        stats = ParseStats()
+        code = """
+        func scale(a: int, b: int = 2) -> int { return a + b * 3 - (a % 2); }
+        let xs: array<int> = [1, 2, 3];
+        xs.filter(x => x > 1 and x < 3);
+        """
+        tree = parse(code, stats)
+        parser, expected = self.parse_ll(code)
+        self.assertEqual(tree.toStringTree(recog=parser), expected.toStringTree(recog=parser))
+        self.assertEqual((stats.sll, stats.fallbacks), (1, 0))
+
+    def test_syntax_error_falls_back_to_ll(self):
+        stats = ParseStats()
+        errors = io.StringIO()
+        with redirect_stderr(errors):
+            parse("let a: int = ;\nlet b: int = 2;", stats)
+        self.assertEqual((stats.sll, stats.fallbacks), (0, 1))
+        self.assertEqual(stats.fallback_rate, 1.0)
+        # The error is reported once, by the recovering LL pass.
+        self.assertEqual(errors.getvalue().count("line 1:"), 1)
+
+
+class TestPrattParser(unittest.TestCase):
+    """Conformance suite: the hand-written parser must build the same trees as ANTLR."""
+
+    SNIPPETS = [
+        "",
+        "let a: int = 1 + 2 * 3 - 4 / 5 % 6;",
+        "let b: bool = 1 < 2 and 3 >= 4 or 5 == 6 and 7 != 8 or 9 <= 10 and 11 > 12;",
+        "let c: int = -x[1] + -(2 - 3) * xs[0][i + 1];",
+        "let d: int = -5 + -2.5 - f(1, g(2), [3, 4])[0];",
+        "let e: array<array<float>> = [[1.0, 2.0], [], [3.5]];",
+        "let n: array<float> = [1, -2.5, 3][0] + [1, x][1] + [1, 2 + 3][0] + [99999999999999999999][0];",
+        'let s: string = "say \\"hi\\" // not a comment";',
+        "let sorted_data: list<string>; let _x: bool = true; let mean_value: float = false;",
+        "/* block\n comment */ let a: int = 1; // trailing\n a[2] = a; a = (a);",
+        "func f() -> int { return; } func g(a: int, b: array<int> = [1]) -> list<int> { return a; }",
+        "if (x > 1) { print(x); } else { { let y: int = 2; } } while (i < 3) { i = i + 1; }",
+        "match v { case 0 => print(0); case -1.5 => { x = 1; } case _ => print(v); }",
+        'match v { case [1, _, [x]] => return x; case {a: 1, b: {c: "s"}} => print(a); case y => print(y); }',
+        "data.sort(); data.sort(desc); data.mean(); data.median(); data.variance(); data.stddev(); data.play();",
+        "x.linreg(y); x.rotate(1 + 1); x.shift(-2); x.filter(n => n % 2 == 0); x.map(n => n * n);",
+        "l.append(1); l.remove(l[0]); m.add(n); m.multiply(n); m.invert(); m.transpose();",
+    ]
+
+    def signature(self, node):
+        if isinstance(node, TerminalNode):
+            token = node.symbol
+            return (token.type, token.text, token.line, token.column)
+        op = node.op.text if getattr(node, "op", None) is not None else None
+        children = tuple(self.signature(child) for child in node.getChildren())
+        stop = node.stop.tokenIndex if node.stop is not None else None
+        rule = SimpleLangParser.ruleNames[node.getRuleIndex()]
+        return (rule, op, node.start.tokenIndex, stop, children)
+
+    def parse_antlr(self, code):
+        input_stream = InputStream(code)
+        lexer = SimpleLangLexer(input_stream)
+        token_stream = CommonTokenStream(lexer)
+        parser = SimpleLangParser(token_stream)
+        return parser.program()
+
+    def assertSameTree(self, code):
+        self.assertEqual(self.signature(pratt.parse(code)), self.signature(self.parse_antlr(code)))
+
+    def test_snippets(self):
+        for code in self.SNIPPETS:
+            with self.subTest(code=code):
+                self.assertSameTree(code)
+
+    def test_examples(self):
+        examples = glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Code_Example", "*.arrlang"))
+        self.assertTrue(examples)
+        for path in examples:
+            with open(path) as source, self.subTest(path=path):
+                self.assertSameTree(source.read())
+
+    def test_tokens_match_lexer(self):
+        code = 'x-1 1.5.2 a->b=>c>=d "\\"" sorted 1abc /* open'
+        lexer = SimpleLangLexer(InputStream(code))
+        expected = [(t.type, t.text, t.line, t.column) for t in lexer.getAllTokens()]
+        self.assertEqual([(t.type, t.text, t.line, t.column) for t in tokenize(code)[:-1]], expected)
+
+    def test_invalid_input_falls_back_to_antlr(self):
+        with self.assertRaises(ParseError):
+            pratt.parse("let a: int = x -1;")
+        stats = ParseStats()
+        with redirect_stderr(io.StringIO()) as errors:
+            parse("let a: int = x -1;", stats, frontend="pratt")
+        self.assertEqual((stats.pratt, stats.fallbacks), (0, 1))
+        self.assertIn("line 1:15", errors.getvalue())
+
+    def test_runs_programs(self):
+        interpreter = Interpreter()
+        interpreter.visit(parse("let a: int = 2; let b: int = a * 3 + 1;", ParseStats(), frontend="pratt"))
+        self.assertEqual(interpreter.global_env.get("b"), 7)
+
+
+class TestNumericLiterals(unittest.TestCase):
+    CODE = """
+    let floats: array<float> = [1.5, -2.0];
+    let ints: array<float> = [1, 2];
+    let mixed: array<int> = [1, 2.5];
+    let big: array<int> = [99999999999999999999, 1];
+    let copies: list<array<int>> = [];
+    let i: int = 0;
+    while (i < 2) {
+        let xs: array<int> = [1, 2];
+        xs[0] = xs[0] + i;
+        copies.append(xs);
+        i = i + 1;
+    }
+    """
+
+    def test_values_match_element_by_element_evaluation(self):
+        for frontend in ("antlr", "pratt"):
+            for backend, env in run_backends(self.CODE, frontend):
+                with self.subTest(frontend=frontend, backend=backend):
+                    self.assertEqual(env.get("floats").dtype, "float64")
+                    self.assertEqual(env.get("floats").tolist(), [1.5, -2.0])
+                    self.assertEqual(env.get("ints").dtype, "int64")
+                    self.assertEqual([type(x) for x in env.get("mixed")], [int, float])
+                    self.assertEqual(env.get("big"), [99999999999999999999, 1])
+                    self.assertEqual(env.get("copies"), [[1, 2], [2, 2]])
+
+    def test_pratt_builds_elements_on_demand(self):
+        tree = pratt.parse("let xs: array<float> = [1.0, 2.5, 3];")
+        literal = tree.statement(0).varDecl().expr()
+        self.assertIsInstance(literal, pratt.NumericArrayContext)
+        self.assertEqual(literal.numeric_literal.as_list(), [1.0, 2.5, 3])
+        self.assertIsNotNone(literal.element_tokens)
+        self.assertEqual(literal.getText(), "[1.0,2.5,3]")
+        self.assertIsNone(literal.element_tokens)
+
+
+class TestTypeCheck(unittest.TestCase):
+    def proofs(self, code):
+        """Maps the text of each node the checker looked at to whether it was proven numeric."""
+        found = {}
+        stack = [check(parse(code, ParseStats()))]
+        while stack:
+            node = stack.pop()
+            if hasattr(node, "proven_numeric"):
+                found[node.getText()] = node.proven_numeric
+            if not isinstance(node, TerminalNode):
+                stack.extend(node.getChildren())
+        return found
+
+    def test_numeric_program_is_proven(self):
+        proofs = self.proofs("""
+        let xs: array<float> = [1.5, 2.5];
+        xs.sort();
+        xs.mean();
+        let n: int = len(xs) * 2;
+        let m: float = n / 3 + xs_mean;
+        """)
+        self.assertTrue(proofs["xs.mean();"])
+        self.assertTrue(proofs["len(xs)*2"])
+        self.assertTrue(proofs["n/3+xs_mean"])
+
+    def test_runtime_representation_is_not_trusted(self):
+        proofs = self.proofs("""
+        let ints: array<float> = [1, 2];
+        ints.mean();
+        let words: list<int> = [1];
+        words.append("a");
+        let nums: list<int> = [2];
+        nums.mean();
+        func double(x: int) -> int { return x * 2; }
+        let alias: int = double;
+        let s: int = "a" + 1;
+        """)
+        self.assertFalse(proofs["ints.mean();"])  # an int64 ndarray
+        self.assertFalse(proofs["nums.mean();"])  # an append may reach any list
+        self.assertFalse(proofs["x*2"])  # double escapes and may be called with anything
+        self.assertFalse(proofs["\"a\"+1"])
+
+    def test_omitted_parameter_is_not_proven(self):
+        proofs = self.proofs("func f(n: int) -> int { return n + 1; } let r: int = f();")
+        self.assertFalse(proofs["n+1"])  # n is bound to None, there is no global n
+
+    def test_unproven_errors_are_still_raised(self):
+        code = """
+        func double(x: int) -> int { return x * 2; }
+        let alias: int = double;
+        let twice: string = alias("ab");
+        """
+        runs = {
+            "tree": lambda: Interpreter().visit(parse(code, ParseStats())),
+            "closure": lambda: CompiledInterpreter().run(lower(parse(code, ParseStats()))),
+            "vm": lambda: VirtualMachine(compile_program(lower(parse(code, ParseStats())))).run(),
+        }
+        for backend, run in runs.items():
+            with self.subTest(backend=backend), self.assertRaises(TypeError):
+                run()
+
+
+class TestOptimizer(unittest.TestCase):
+    def initializers(self, code):
+        tree = optimize(parse(code, ParseStats()))
+        return {stmt.varDecl().IDENTIFIER().getText(): stmt.varDecl().expr() for stmt in tree.statement()}
+
+    def test_folds_scalar_constants(self):
+        exprs = self.initializers("""
+        let a: int = 2 * 3 + 4 % 3 - -1;
+        let b: float = (1 + 2) / 4;
+        let c: bool = 1 < 2 and true;
+        let s: string = "hi";
+        let n: int = a + 1;
+        let xs: list<int> = [1 + 1];
+        let z: float = 1 / 0;
+        let t: int = "a" + 1;
+        """)
+        self.assertEqual(exprs["a"].constant, 8)
+        self.assertEqual(exprs["b"].constant, 0.75)
+        self.assertIs(exprs["c"].constant, True)
+        self.assertEqual(exprs["s"].constant, "hi")
+        for name in ("n", "xs", "z", "t"):
+            self.assertIs(exprs[name].constant, NOT_CONSTANT, name)
+        self.assertEqual(exprs["xs"].expr(0).constant, 2)
+
+    def test_dead_branches_are_dropped(self):
+        code = """
+        let out: list<string> = [];
+        if (1 > 2) { out.append("then"); } else { out.append("else"); }
+        if (0) { out.append("never"); }
+        match 3 {
+            case 1 => out.append("one");
+            case _ => out.append("other");
+            case 3 => out.append("three");
+        }
+        """
+        tree = optimize(parse(code, ParseStats()))
+        match = tree.statement(3).matchStatement()
+        self.assertEqual([pattern for pattern, _ in match.live_cases], [1, "_"])
+        self.assertIsNone(tree.statement(2).ifStatement().live_block)
+
+        program = lower(parse(code, ParseStats()))
+        self.assertIsInstance(program.body[1], Block)
+        self.assertEqual(len(program.body[3].cases), 2)
+
+        tree = Interpreter()
+        tree.visit(parse(code, ParseStats()))
+        closure = CompiledInterpreter()
+        closure.run(lower(parse(code, ParseStats())))
+        vm = VirtualMachine(compile_program(lower(parse(code, ParseStats()))))
+        vm.run()
+        for backend, env in (("tree", tree.global_env), ("closure", closure.global_env), ("vm", vm.global_env)):
+            with self.subTest(backend=backend):
+                self.assertEqual(env.get("out"), ["else", "other"])
+
+
+class TestLoopInvariants(unittest.TestCase):
+    CODE = """
+    let data: list<int> = [4, 8, 15, 16];
+    let n: int = 2;
+    let i: int = 0;
+    let total: int = 0;
+    while (i < len(data) - 1) {
+        total = total + data[i] * (n * 3);
+        i = i + 1;
+    }
+    func bump() -> int { n = n + 1; return n; }
+    let j: int = 0;
+    while (j < 2) {
+        data.append(n * 5 + bump());
+        j = j + 1;
+    }
+    func depth(d: int) -> int {
+        let s: int = 0;
+        let q: int = 0;
+        while (q < 2) {
+            s = s + d * 10;
+            if (d > 0) { s = s + depth(d - 1); }
+            q = q + 1;
+        }
+        return s;
+    }
+    let deep: int = depth(2);
+    while (i < 0) { print(missing * 2); }
+    """
+
+    def test_finds_invariants(self):
+        tree = optimize(parse(self.CODE, ParseStats()))
+        loops = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, SimpleLangParser.WhileStatementContext):
+                loops.append([expr.getText() for expr in node.invariants])
+            if not isinstance(node, TerminalNode):
+                stack.extend(reversed(list(node.getChildren())))
+        self.assertEqual(loops[0], ["len(data)-1", "n*3"])
+        self.assertEqual(loops[1], [])  # bump() assigns n
+        self.assertEqual(loops[2], ["d*10", "d>0", "d-1"])
+        self.assertEqual(loops[3], ["i<0", "missing*2"])
+
+    def test_backends_compute_once_per_run(self):
+        tree = Interpreter()
+        tree.visit(parse(self.CODE, ParseStats()))
+        closure = CompiledInterpreter()
+        closure.run(lower(parse(self.CODE, ParseStats())))
+        vm = VirtualMachine(compile_program(lower(parse(self.CODE, ParseStats()))))
+        vm.run()
+        for backend, env in (("tree", tree.global_env), ("closure", closure.global_env), ("vm", vm.global_env)):
+            with self.subTest(backend=backend):
+                self.assertEqual(env.get("total"), (4 + 8 + 15) * 6)
+                self.assertEqual(env.get("data"), [4, 8, 15, 16, 13, 19])
+                self.assertEqual(env.get("deep"), 80)
+
+
+class TestScopeElision(unittest.TestCase):
+    CODE = """
+    let data: list<int> = [3, 1, 2];
+    let i: int = 0;
+    while (i < 3) { i = i + 1; }
+    if (i > 2) { let hidden: int = i; i = hidden * 2; }
+    if (i > 0) { data.sort(); }
+    if (i > 0) { match i { case 6 => let seen: int = 1; case _ => print(i); } }
+    if (i > 0) { data.mean(); }
+    func fact(n: int) -> int {
+        if (n < 2) { return 1; }
+        let rest: int = fact(n - 1);
+        return n * rest;
+    }
+    let f: int = fact(6);
+    """
+
+    def test_declares(self):
+        tree = optimize(parse(self.CODE, ParseStats()))
+        blocks = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, SimpleLangParser.BlockContext):
+                blocks.append(node.declares)
+            if not isinstance(node, TerminalNode):
+                stack.extend(reversed(list(node.getChildren())))
+        self.assertEqual(blocks, [False, True, False, True, True, True, False])
+
+    def test_block_scopes_are_kept(self):
+        interpreter = Interpreter()
+        interpreter.visit(parse(self.CODE, ParseStats()))
+        env = interpreter.global_env
+        self.assertEqual(env.get("i"), 6)
+        self.assertEqual(env.get("data"), [1, 2, 3])
+        self.assertEqual(env.get("f"), 720)
+        for name in ("hidden", "seen", "data_mean", "rest"):
+            with self.assertRaises(NameError):
+                env.get(name)
+        self.assertTrue(all(not env.values and env.parent is None for env in interpreter.environments))
+
+
+class TestTailCalls(unittest.TestCase):
+    CODE = """
+    func count(n: int, acc: int) -> int {
+        if (n == 0) { return acc; }
+        return count(n - 1, acc + n);
+    }
+    func even(n: int) -> bool {
+        if (n == 0) { return true; }
+        return odd(n - 1);
+    }
+    func odd(n: int) -> bool {
+        if (n == 0) { return false; }
+        return even(n - 1);
+    }
+    func size(xs: list<int>) -> int { return len(xs); }
+    let total: int = count(20000, 0);
+    let parity: bool = even(20001);
+    let three: int = size([1, 2, 3]);
+    let calls: int = 0;
+    while (calls < 1) { calls = calls + 1; return count(1, 0); }
+    """
+
+    def test_marks_tail_calls(self):
+        tree = optimize(parse(self.CODE + "func inc(n: int) -> int { return 1 + count(n, 0); }", ParseStats()))
+        marks = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, SimpleLangParser.ReturnStmtContext):
+                marks.append(node.tail_call)
+            if not isinstance(node, TerminalNode):
+                stack.extend(reversed(list(node.getChildren())))
+        self.assertEqual(marks, [False, True, False, True, False, True, True, False, False])
+
+    def test_tail_calls_do_not_grow_the_stack(self):
+        for backend, env in run_backends(self.CODE):
+            with self.subTest(backend=backend):
+                self.assertEqual(env.get("total"), 20000 * 20001 // 2)
+                self.assertFalse(env.get("parity"))
+                self.assertEqual(env.get("three"), 3)
+                self.assertEqual(env.get("calls"), 1)
+
+    def test_vm_keeps_calls_on_the_heap(self):
+        code = """
+        func down(n: int) -> int {
+            if (n == 0) { return 0; }
+            return 1 + down(n - 1);
+        }
+        let depth: int = down(20000);
+        let data: list<int> = [1, 2, 3];
+        data.map(x => down(x) * 2);
+        """
+        vm = VirtualMachine(compile_program(lower(parse(code, ParseStats()))))
+        vm.run()
+        self.assertEqual(vm.global_env.get("depth"), 20000)
+        self.assertEqual(vm.global_env.get("data_map"), [2, 4, 6])
+
+
+class TestMemoization(unittest.TestCase):
+    CODE = """
+    let scale: int = 3;
+    func fib(n: int) -> int {
+        if (n < 2) { return n; }
+        return fib(n - 1) + fib(n - 2);
+    }
+    func scaled(n: int) -> int { return n * scale; }
+    func shout(n: int) -> int { print(n); return n; }
+    func total(xs: list<int>) -> float {
+        xs.mean();
+        return xs_mean * len(xs);
+    }
+    func first(xs: list<int>) -> int { xs.sort(); return xs[0]; }
+    func square(n: int) -> int { return n * n; }
+    let f: int = fib(20);
+    let data: list<int> = [3, 1, 2];
+    let before: float = total(data);
+    data.append(6);
+    let after: float = total(data);
+    let squares: list<int> = [square(1), square(2), square(1), square(3), square(4), square(2)];
+    let same: bool = square(2.0) == 4.0;
+    """
+
+    def test_finds_pure_functions(self):
+        tree = optimize(parse(self.CODE, ParseStats()))
+        pure = {
+            child.IDENTIFIER().getText(): child.pure
+            for child in tree.children
+            if isinstance(child, SimpleLangParser.FunctionDeclContext)
+        }
+        self.assertEqual(
+            pure, {"fib": True, "scaled": False, "shout": False, "total": True, "first": False, "square": True}
+        )
+
+    def test_backends_cache_results(self):
+        runs = []
+        memos = []
+        tree = Interpreter(3, memos)
+        tree.visit(parse(self.CODE, ParseStats()))
+        runs.append(("tree", tree.global_env, memos))
+        memos = []
+        closure = CompiledInterpreter(3, memos)
+        closure.run(lower(parse(self.CODE, ParseStats())))
+        runs.append(("closure", closure.global_env, memos))
+        memos = []
+        vm = VirtualMachine(compile_program(lower(parse(self.CODE, ParseStats()))), 3, memos)
+        vm.run()
+        runs.append(("vm", vm.global_env, memos))
+        for backend, env, memos in runs:
+            with self.subTest(backend=backend):
+                self.assertEqual(env.get("f"), 6765)
+                self.assertEqual((env.get("before"), env.get("after")), (6.0, 12.0))
+                self.assertEqual(env.get("squares"), [1, 4, 1, 9, 16, 4])
+                self.assertTrue(env.get("same"))
+                stats = {memo.name: (memo.hits, memo.misses, len(memo.results)) for memo in memos}
+                # each fib(n) is computed once; from fib(3) on, fib(n - 2) is still cached when needed
+                self.assertEqual(stats["fib"], (18, 21, 3))
+                self.assertEqual(stats["total"], (0, 2, 2))
+                # square(4) evicts square(2), the least recently used; 2.0 is not the same argument as 2
+                self.assertEqual(stats["square"], (1, 6, 3))
+
+    def test_key_includes_bound_defaults(self):
+        from run import run_code
+
+        code = "let xs: list<int> = [1, 2]; func f(a: list<int> = xs) -> int { return len(a); } print(f()); xs.append(3); print(f());"
+        for backend in ("tree", "closure", "vm"):
+            with self.subTest(backend=backend):
+                stdout = io.StringIO()
+                with redirect_stdout(stdout):
+                    run_code(code, backend, memo_size=8)
+                self.assertEqual(stdout.getvalue(), "2\n3\n")
+
+    def test_key_snapshots_arguments(self):
+        self.assertNotEqual(memo_key([1]), memo_key([1.0]))
+        self.assertNotEqual(memo_key([0.0]), memo_key([-0.0]))
+        self.assertEqual(memo_key([[1, [2]], "a"]), memo_key([[1, [2]], "a"]))
+        self.assertIsNone(memo_key([print]))
+
+
+class TestInlining(unittest.TestCase):
+    CODE = """
+    let k: int = 10;
+    func plus(a: int, b: int = k * 2) -> int { return a + b; }
+    func scale(x: int) -> int { return x * k; }
+    func twice(x: int) -> int { return scale(x) + scale(x); }
+    func down(n: int) -> int { if (n == 0) { return 0; } return down(n - 1); }
+    func again(n: int) -> int { return n; }
+    func again(n: int) -> int { return n + 1; }
+    k = 100;
+    let sum: int = plus(1, 2);
+    let defaulted: int = plus(1);
+    let i: int = 0;
+    let total: int = 0;
+    while (i < 3) {
+        let k: int = 1;
+        total = total + twice(i) + again(i);
+        i = i + 1;
+    }
+    """
+
+    def test_inlines_small_functions(self):
+        program = lower(parse(self.CODE, ParseStats()))
+        inlined, called = [], []
+        stack = [program]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Inline):
+                inlined.append(node.call.name)
+                node = node.call
+            elif isinstance(node, Call):
+                called.append(node.name)
+            if is_dataclass(node) and not isinstance(node, FuncDecl) or isinstance(node, Program):
+                for node_field in fields(node):
+                    value = getattr(node, node_field.name)
+                    stack.extend(value if isinstance(value, list) else [value])
+        # the calls in `twice` and `down` are not inlined; `again` is declared twice; plus(1) leaves out an argument
+        self.assertEqual(sorted(inlined), ["plus", "twice"])
+        self.assertEqual(sorted(called), ["again", "plus"])
+
+    def test_calls_bind_defaults_and_keep_scopes(self):
+        for backend, env in run_backends(self.CODE):
+            with self.subTest(backend=backend):
+                self.assertEqual(env.get("sum"), 3)
+                self.assertEqual(env.get("defaulted"), 21)  # the default is evaluated at declaration
+                self.assertEqual(env.get("total"), 2 * 100 * 3 + 6)  # scale reads the global k
+
+    def test_inlined_tail_call(self):
+        code = """
+        let k: int = 5;
+        func h(a: int) -> int { return a + k; }
+        func user(k: int) -> int { return h(k); }
+        let r: int = user(100);
+        """
+        for backend, env in run_backends(code):
+            with self.subTest(backend=backend):
+                self.assertEqual(env.get("r"), 105)
+
+    def test_omitted_argument_reads_the_global(self):
+        code = """
+        let x: int = 7;
+        func f(x: int) -> int { return x + 1; }
+        func g(unused: int) -> int { return 1; }
+        let r: int = f();
+        let s: int = g();
+        """
+        for backend, env in run_backends(code):
+            with self.subTest(backend=backend):
+                self.assertEqual((env.get("r"), env.get("s")), (8, 1))
+
+    def test_call_before_declaration_fails(self):
+        code = "let r: int = helper(2); func helper(x: int) -> int { return x; }"
+        runs = (
+            lambda: Interpreter().visit(parse(code, ParseStats())),
+            lambda: CompiledInterpreter().run(lower(parse(code, ParseStats()))),
+            lambda: VirtualMachine(compile_program(lower(parse(code, ParseStats())))).run(),
+        )
+        for backend, run in zip(("tree", "closure", "vm"), runs):
+            with self.subTest(backend=backend):
+                with self.assertRaises(NameError):
+                    run()
+
+class TestCallSiteCache(unittest.TestCase):
+    CODE = """
+    func f() -> int { return 1; }
+    func g() -> int { return f(); }
+    func h(f: int) -> int { return g(); }
+    let a: int = g();
+    func f() -> int { return 2; }
+    let b: int = g();
+    let data: list<int> = [1, 2];
+    if (true) { print(f()); let f: int = 0; }
+    data.map(g => g());
+    """
+
+    def test_marks_global_callees(self):
+        tree = optimize(parse(self.CODE, ParseStats()))
+        marks = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, SimpleLangParser.FunctionCallContext):
+                marks.append((node.IDENTIFIER().getText(), node.global_callee))
+            if not isinstance(node, TerminalNode):
+                stack.extend(reversed(list(node.getChildren())))
+        self.assertEqual(
+            marks,
+            [("f", True), ("g", True), ("g", True), ("g", True),
+             ("print", True), ("f", False), ("g", False)],
+        )
+
+    def test_redefinition_invalidates(self):
+        interpreter = Interpreter()
+        interpreter.visit(parse(self.CODE.split("let data")[0], ParseStats()))
+        self.assertEqual((interpreter.global_env.get("a"), interpreter.global_env.get("b")), (1, 2))
+        self.assertEqual(interpreter.global_env.callees, {"f", "g"})
+
+
+class TestTypedArrays(unittest.TestCase):
+    CODE = """
+    let ints: array<int> = [3, 1, 2];
+    ints.sort(desc);
+    ints[0] = ints[0] + 10;
+    let flags: array<bool> = [true, false, true, false, false, false, false, false, true];
+    flags[1] = true;
+    let words: array<string> = ["pear", "fig", "apple"];
+    words[1] = "kiwi";
+    words.sort();
+    let empty: array<int>;
+    let boxed: array<int> = [1, 2];
+    boxed[0] = 0.5;
+    ints.filter(x => x < 10);
+    ints.map(x => x > 1);
+    ints.rotate(1);
+    let floats: array<float> = [2.0, 3.0, 1.0];
+    floats.sort(desc);
+    """
+
+    def test_declared_element_type_picks_the_buffer(self):
+        for backend, env in run_backends(self.CODE):
+            with self.subTest(backend=backend):
+                self.assertIsInstance(env.get("ints"), TypedArray)
+                self.assertEqual(env.get("ints").buffer, array("q", [13, 2, 1]))
+                self.assertEqual(env.get("flags").buffer.bits, bytearray([0b00000111, 0b00000001]))
+                self.assertEqual(list(env.get("flags")), [True, True, True] + [False] * 5 + [True])
+                self.assertEqual(bytes(env.get("words").buffer.data), b"applekiwipear")
+                self.assertEqual(list(env.get("words")), ["apple", "kiwi", "pear"])
+                self.assertEqual((env.get("empty").element, len(env.get("empty"))), (Type.INT, 0))
+
+    def test_values_that_do_not_fit_fall_back_to_a_list(self):
+        for backend, env in run_backends(self.CODE):
+            with self.subTest(backend=backend):
+                self.assertEqual(env.get("boxed").buffer, [0.5, 2])
+                self.assertEqual(repr(env.get("boxed")), "[0.5, 2]")
+
+    def test_sorting_mixed_float_array_gives_a_list(self):
+        code = 'let mixed: array<float> = [5, 12.0, "Banana", true]; mixed.sort(desc);'
+        for backend, env in run_backends(code):
+            with self.subTest(backend=backend):
+                self.assertEqual(env.get("mixed"), ["True", "Banana", "5", "12.0"])
+                self.assertIs(type(env.get("mixed")), list)
+
+    def test_errors_name_the_language_type(self):
+        code = "let ints: array<int> = [1, 2]; let floats: array<float> = [1.5]; let r: bool = ints == floats;"
+        runs = (
+            lambda: Interpreter().visit(parse(code, ParseStats())),
+            lambda: CompiledInterpreter().run(lower(parse(code, ParseStats()))),
+            lambda: VirtualMachine(compile_program(lower(parse(code, ParseStats())))).run(),
+        )
+        for backend, run in zip(("tree", "closure", "vm"), runs):
+            with self.subTest(backend=backend):
+                with self.assertRaisesRegex(TypeError, "'==' between list and list$"):
+                    run()
+
+    def test_operations_keep_the_representation(self):
+        for backend, env in run_backends(self.CODE):
+            with self.subTest(backend=backend):
+                self.assertEqual((env.get("ints_filter").element, env.get("ints_filter")), (Type.INT, [2, 1]))
+                self.assertEqual((env.get("ints_map").element, env.get("ints_map")), (Type.BOOL, [True, True, False]))
+                self.assertEqual((env.get("ints_rotate").element, env.get("ints_rotate")), (Type.INT, [1, 13, 2]))
+                self.assertEqual(env.get("floats").tolist(), [3.0, 2.0, 1.0])
+                self.assertEqual(env.get("floats").dtype, "float64")
+
+
+class TestVectorizedLambdas(unittest.TestCase):
+    INTS = list(range(-50, 50))
+    CODE = f"""
+    let ints: array<int> = {INTS};
+    let floats: array<float> = {[x / 4 for x in INTS]};
+    let k: int = 3;
+    ints.map(x => x + x * k);
+    ints.filter(x => x % 2 == 0 or x > 40);
+    floats.map(x => -x / 2.0);
+    floats.filter(x => x > 10.0);
+    """
+
+    def test_plans(self):
+        tree = optimize(parse("xs.map(x => -(x + 1) * k > 2 * 3);", ParseStats()))
+        lambda_expr = tree.statement(0).arrayOp().lambdaExpr()
+        expected = (">", ("*", ("neg", ("+", ("param",), ("const", 1))), ("load", "k")), ("const", 6))
+        self.assertEqual(VectorLambda.plan_of(lambda_expr.expr(), "x"), expected)
+        lam = lower(parse("xs.map(x => -(x + 1) * k > 2 * 3);", ParseStats())).body[0].lam
+        self.assertEqual(vector_plan(lam.body, "x", lambda name: name.name), expected)
+        for body in ("f(x)", "x[0]", "[x]"):
+            lambda_expr = parse(f"xs.map(x => {body});", ParseStats()).statement(0).arrayOp().lambdaExpr()
+            self.assertIsNone(VectorLambda.plan_of(lambda_expr.expr(), "x"))
+
+    def test_results_match_per_element_evaluation(self):
+        floats = [x / 4 for x in self.INTS]
+        for backend, env in run_backends(self.CODE):
+            with self.subTest(backend=backend):
+                self.assertIsInstance(env.get("ints_map"), TypedArray)
+                self.assertEqual(env.get("ints_map"), [x + x * 3 for x in self.INTS])
+                self.assertEqual(env.get("ints_filter"), [x for x in self.INTS if x % 2 == 0 or x > 40])
+                self.assertEqual(env.get("floats_map").tolist(), [-x / 2.0 for x in floats])
+                self.assertEqual(env.get("floats_filter").tolist(), [x for x in floats if x > 10.0])
+
+    def test_map_results_are_new_lists_or_float_arrays(self):
+        code = f"""
+        let floats: array<float> = {[x / 4 for x in self.INTS]};
+        floats.map(x => x);
+        floats_map[0] = 99.0;
+        let first: float = floats[0];
+        floats.map(x => x > 0.0);
+        let small: array<float> = [1.0, 2.0];
+        small.map(x => 1);
+        let sum: int = small_map[0] + 1;
+        """
+        for backend, env in run_backends(code):
+            with self.subTest(backend=backend):
+                self.assertEqual(env.get("first"), -12.5)
+                self.assertEqual(env.get("floats_map"), [x > 0 for x in self.INTS])
+                self.assertEqual(type(env.get("floats_map")[0]), bool)
+                self.assertEqual(env.get("sum"), 2)
+
+    def test_falls_back_where_numpy_differs(self):
+        code = f"""
+        let ints: array<int> = {self.INTS};
+        ints.map(x => x * 9223372036854775807);
+        let flags: array<bool> = {[True] * 100};
+        flags.map(x => x + x);
+        """.replace("True", "true")
+        for backend, env in run_backends(code):
+            with self.subTest(backend=backend):
+                self.assertEqual(env.get("ints_map"), [x * 9223372036854775807 for x in self.INTS])  # beyond int64
+                self.assertEqual(env.get("flags_map"), [2] * 100)
+                with self.assertRaises(ZeroDivisionError):
+                    list(run_backends(code + "ints.map(x => 1 / x);"))
+
+
+class TestPipelines(unittest.TestCase):
+    INTS = list(range(-50, 50))
+    CODE = f"""
+    let data: array<int> = {INTS};
+    let k: int = 2;
+    data.filter(x => x > 0);
+    data_filter.map(x => x * k);
+    data_filter_map.rotate(1);
+    data_filter_map_rotate.filter(x => x != 16);
+    data_filter_map_rotate_filter.mean();
+    let small: list<int> = [1, 2, 3];
+    small.map(x => x * 1.5);
+    small_map.shift(1);
+    print(small_map_shift);
+    data.map(x => x + 1);
+    data_map.filter(x => x > 0);
+    print(data_map);
+    """
+
+    def test_marks_chains_with_unread_results(self):
+        tree = optimize(parse(self.CODE, ParseStats()))
+        ops = [statement.arrayOp() for statement in tree.statement() if statement.arrayOp() is not None]
+        self.assertEqual(len(ops[0].pipeline), 5)
+        self.assertTrue(all(getattr(op, "fused", False) for op in ops[1:5]))
+        self.assertEqual(len(ops[5].pipeline), 2)
+        # data_map is printed, so it is computed and stored as before
+        self.assertEqual([getattr(op, "pipeline", None) for op in ops[7:]], [None, None])
+
+    def test_results_match_separate_statements(self):
+        rotated = [x * 2 for x in self.INTS if x > 0]
+        rotated = rotated[-1:] + rotated[:-1]
+        for backend, env in run_backends(self.CODE):
+            with self.subTest(backend=backend):
+                self.assertEqual(env.get("data_filter_map_rotate_filter_mean"), mean(x for x in rotated if x != 16))
+                self.assertEqual(env.get("small_map_shift"), [0, 1.5, 3.0])
+                self.assertEqual(env.get("data_map_filter"), [x + 1 for x in self.INTS if x + 1 > 0])
+                self.assertEqual(env.get("data_map"), [x + 1 for x in self.INTS])
+                with self.assertRaises(NameError):
+                    env.get("data_filter")
+
+class TestMoments(unittest.TestCase):
+    def test_chunks_combine_to_the_whole(self):
+        values = [random.uniform(-100, 100) for _ in range(10000)]
+        whole = Moments.of(values)
+        parts = Moments.of(values[:3]).combine(Moments.of(iter(values[3:])))
+        chunked = Moments.of_chunks([values[:5000], np.array(values[5000:])])
+        for moments in (whole, parts, chunked):
+            self.assertEqual(moments.count, 10000)
+            self.assertAlmostEqual(moments.mean, statistics.fmean(values), places=9)
+            self.assertAlmostEqual(moments.variance, statistics.pvariance(values), places=6)
+            self.assertAlmostEqual(moments.std_dev, statistics.pstdev(values), places=6)
+
+    def test_stable_with_a_large_offset(self):
+        values = [1e9 + x for x in (4, 7, 13, 16)] * 2000
+        self.assertAlmostEqual(Moments.of(values).variance, 22.5, places=6)
+
+    def test_statistics_check_elements_in_the_same_pass(self):
+        with self.assertRaisesRegex(TypeError, "^Variance can only be applied"):
+            ArrayOperations.statistic("variance", [1, 2, "3"])
+        with self.assertRaisesRegex(ValueError, "standard deviation of an empty list"):
+            ArrayOperations.statistic("stddev", [])
+        self.assertEqual(ArrayOperations.statistic("stddev", TypedArray.declare(Type.INT, [2, 4, 4, 4, 5, 5, 7, 9])), 2.0)
+
+class TestStatisticsCache(unittest.TestCase):
+    CODE = """
+    let data: array<int> = [4, 8, 15, 16, 23, 42];
+    let floats: array<float> = [1.0, 2.0, 3.0];
+    let xs: list<int> = [3, 1, 2];
+    let seen: list<float> = [];
+    let i: int = 0;
+    while (i < 3) {
+        data.mean();
+        floats.variance();
+        xs.median();
+        seen = [data_mean, floats_variance, xs_median];
+        i = i + 1;
+    }
+    data[0] = 100;
+    floats[0] = 4.0;
+    xs.append(10);
+    data.mean();
+    floats.variance();
+    xs.median();
+    xs.sort(desc);
+    xs.remove(10);
+    xs.median();
+    """
+
+    def test_results_are_reused_until_the_array_changes(self):
+        tree = Interpreter()
+        tree.visit(parse(self.CODE, ParseStats()))
+        closure = CompiledInterpreter()
+        closure.run(lower(parse(self.CODE, ParseStats())))
+        vm = VirtualMachine(compile_program(lower(parse(self.CODE, ParseStats()))))
+        vm.run()
+        for backend, interpreter in (("tree", tree), ("closure", closure), ("vm", vm)):
+            with self.subTest(backend=backend):
+                get = interpreter.global_env.get
+                self.assertEqual(interpreter.statistics.hits, 6)  # the last two loop iterations
+                self.assertEqual(get("seen"), [18.0, 2 / 3, 2])
+                self.assertEqual(get("data_mean"), 34.0)
+                self.assertAlmostEqual(get("floats_variance"), 2 / 3)
+                self.assertEqual(get("xs_median"), 2)
+
+    def test_views_follow_the_viewed_array(self):
+        from run import run_code
+
+        code = """
+        let m: array<array<float>> = [[1.0, 2.0], [3.0, 4.0]];
+        let r: array<float> = [0.0];
+        r = m[0];
+        r.mean();
+        print(r_mean);
+        m[0] = [5.0, 6.0];
+        r.mean();
+        print(r_mean);
+        """
+        for backend in ("tree", "closure", "vm"):
+            with self.subTest(backend=backend):
+                stdout = io.StringIO()
+                with redirect_stdout(stdout):
+                    run_code(code, backend)
+                self.assertEqual(stdout.getvalue(), "1.5\n5.5\n")
+
+    def test_counts_hits_and_evicts(self):
+        cache = StatisticsCache(2)
+        typed, xs, ys = TypedArray(Type.INT, [1, 2]), [1, 2], [3]
+        self.assertEqual(cache.get("mean", typed, lambda: 1.5), 1.5)
+        self.assertEqual(cache.get("mean", typed, lambda: 0), 1.5)
+        typed[0] = 5  # a TypedArray counts its own changes
+        self.assertEqual(cache.get("mean", typed, lambda: 3.5), 3.5)
+        cache.get("mean", xs, lambda: 1.5)
+        cache.changed(xs)
+        self.assertEqual(cache.get("mean", xs, lambda: 2.0), 2.0)
+        cache.get("mean", ys, lambda: 3.0)  # evicts typed, the least recently used
+        self.assertEqual(list(cache.entries), [id(xs), id(ys)])
+        self.assertEqual((cache.hits, cache.misses), (1, 5))
+
+    def test_does_not_keep_arrays_alive(self):
+        cache = StatisticsCache(elements=5)
+        typed, floats = TypedArray(Type.INT, [1, 2]), np.array([1.0, 2.0])
+        cache.get("mean", typed, lambda: 1.5)
+        cache.get("mean", floats, lambda: 1.5)
+        self.assertEqual(len(cache.entries), 2)
+        del typed, floats  # held weakly, so their entries go with them
+        self.assertEqual(len(cache.entries), 0)
+        short, long = [1, 2, 3], [1] * 6
+        cache.get("mean", short, lambda: 2.0)
+        cache.get("mean", long, lambda: 1.0)  # longer than the bound, not cached
+        self.assertEqual((list(cache.entries), cache.held), ([id(short)], 3))
+        cache.get("mean", [4, 5, 6], lambda: 5.0)  # the two lists would hold 6 elements, so short goes
+        self.assertEqual(cache.held, 3)
+        self.assertNotIn(id(short), cache.entries)
+
+
+class TestBackendsAgree(unittest.TestCase):
+    CODE = """
+    let k: int = 5;
+    let x: int = 7;
+    func h(a: int) -> int { return a + k; }
+    func user(k: int) -> int { return h(k); }
+    func f(x: int, step: int = 2) -> int { return x + step; }
+    func fact(n: int, acc: int) -> int { if (n <= 1) { return acc; } return fact(n - 1, acc * n); }
+    print(user(100));
+    print(f());
+    print(f(1, 10));
+    print(fact(10, 1));
+    let d: array<float> = [1.0, 2.5, 3.0, -4.0];
+    d.map(x => 1);
+    print(d_map[0] + 1);
+    d.map(x => x > 2.0);
+    print(d_map);
+    d.mean();
+    d.variance();
+    d.stddev();
+    d.median();
+    print(d_mean, d_variance, d_stddev, d_median);
+    let ints: array<int> = [9, 3, 7, 1, 8];
+    ints.filter(x => x > 2);
+    ints_filter.map(x => x * 3);
+    ints_filter_map.rotate(2);
+    ints_filter_map_rotate.mean();
+    print(ints_filter_map_rotate_mean);
+    ints.sort(desc);
+    ints[0] = ints[0] - 100;
+    ints.mean();
+    print(ints, ints_mean);
+    let xs: list<int> = [4, 1, 3];
+    xs.append(2);
+    xs.sort();
+    print(xs);
+    let i: int = 0;
+    let total: float = 0.0;
+    while (i < 10) {
+        total = total + i * 0.5 - i % 3;
+        i = i + 1;
+    }
+    print(total);
+    match total {
+        case 13.5 => print("thirteen and a half");
+        case _ => print("other");
+    }
+    """
+
+    def output(self, run):
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            run()
+        return stdout.getvalue()
+
+    def test_negative_zero_constant(self):
+        from run import run_code
+
+        code = "let a: float = 0.0; let b: float = -0.0; print(a, b);"
+        for backend in ("tree", "closure", "vm"):
+            with self.subTest(backend=backend):
+                self.assertEqual(self.output(lambda: run_code(code, backend)), "0.0 -0.0\n")
+
+    def test_same_output_on_every_backend(self):
+        from run import run_code, stream_code
+
+        expected = self.output(lambda: run_code(self.CODE, "tree"))
+        self.assertEqual(expected.splitlines()[:4], ["105", "9", "11", "3628800"])
+        for backend in ("closure", "vm"):
+            with self.subTest(backend=backend):
+                self.assertEqual(self.output(lambda: run_code(self.CODE, backend)), expected)
+        with self.subTest(backend="stream"):
+            self.assertEqual(self.output(lambda: stream_code(io.StringIO(self.CODE))), expected)
+
+class TestStreaming(unittest.TestCase):
+    CODE = """
+    func plus(a: int, b: int) -> int { return a + b; }
+    let total: int = 0;
+    /* a comment
+       over several lines */ let i: int = 0;
+    while (i < 5) {
+        total = plus(total, i);
+        i = i + 1;
+    }
+    let xs: list<int> = [total, i];
+    """
+
+    def test_matches_full_run(self):
+        from run import stream_code
+
+        expected = Interpreter()
+        expected.visit(parse(self.CODE, ParseStats()))
+        streamed = stream_code(io.StringIO(self.CODE))
+        for name in ("total", "i", "xs"):
+            self.assertEqual(streamed.global_env.get(name), expected.global_env.get(name))
+
+    def test_tokens_are_released(self):
+        lines = ("let a%d: int = %d + 1;\n" % (i, i) for i in range(1000))
+        reader = TokenReader(lines)
+        largest = 0
+        for item in PrattParser(reader).items():
+            largest = max(largest, len(reader.buffer))
+        self.assertEqual(item.getText(), "leta999:int=999+1;")
+        self.assertLess(largest, 20)
+
+    def test_syntax_error_stops_at_item(self):
+        from run import stream_code
+
+        interpreter = Interpreter()
+        with self.assertRaises(ParseError):
+            stream_code(io.StringIO("let a: int = 1;\nlet b: int = ;\n"), interpreter)
+        self.assertEqual(interpreter.global_env.get("a"), 1)
+
 
 if __name__ == "__main__":
     unittest.main()
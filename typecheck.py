@@ -0,0 +1,456 @@
+import gc
+from array import array
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+from antlr4.tree.Tree import TerminalNode
+from SimpleLangParser import SimpleLangParser
+from SimpleLangVisitor import SimpleLangVisitor
+from interpreter import ArrayType, Interpreter, ListType, NumericLiteral, Type
+
+
+# Static types describe how a value is represented at run time, because that
+# is what the runtime checks look at: an array<float> declared from integer
+# literals is an int64 ndarray whose elements fail isinstance(x, float).
+#
+#   None                  unknown, anything at all
+#   frozenset of classes  a scalar of one of these classes: "int", "float",
+#                         "bool", "str", or "f64" for numpy.float64
+#   Seq(element, kinds)   a Python list or a TypedArray, which holds the same
+#                         values ("list" in kinds), or a one-dimensional
+#                         float64 ndarray ("ndarray" in kinds)
+#
+# NOTHING, the empty set, is the type of an expression that never produces a
+# value, and the starting point of the inference.
+
+NOTHING = frozenset()
+NUMERIC = frozenset({"int", "float", "bool", "f64"})
+LIST = frozenset({"list"})
+NDARRAY = frozenset({"ndarray"})
+MAX_NESTING = 4
+
+COMPARISONS = {">", "<", ">=", "<=", "==", "!="}
+STATISTICS = ("mean", "median", "variance", "stddev")
+
+# type_of closures of the literal tokens, shared by every literal
+LITERAL_TYPES = {
+    SimpleLangParser.INT: lambda: frozenset({"int"}),
+    SimpleLangParser.FLOAT: lambda: frozenset({"float"}),
+    SimpleLangParser.BOOL: lambda: frozenset({"bool"}),
+    SimpleLangParser.STRING: lambda: frozenset({"str"}),
+}
+
+
+@dataclass(frozen=True)
+class Seq:
+    element: Any
+    kinds: frozenset = LIST
+
+
+FLOAT_ARRAY = Seq(frozenset({"f64"}), NDARRAY)
+
+
+def seq(element, kinds=LIST):
+    """Seq(element, kinds), widened to unknown past MAX_NESTING so that `x = [x];` still converges."""
+    depth, inner = 1, element
+    while isinstance(inner, Seq):
+        depth, inner = depth + 1, inner.element
+    return Seq(element, kinds) if depth <= MAX_NESTING else None
+
+
+def join(a, b):
+    """The least type that covers both a and b."""
+    if a == NOTHING:
+        return b
+    if b == NOTHING or a == b:
+        return a
+    if isinstance(a, frozenset) and isinstance(b, frozenset):
+        return a | b
+    if isinstance(a, Seq) and isinstance(b, Seq):
+        return seq(join(a.element, b.element), a.kinds | b.kinds)
+    return None
+
+
+def is_numeric(static_type) -> bool:
+    """Whether every value of the type passes isinstance(value, (int, float))."""
+    return isinstance(static_type, frozenset) and static_type <= NUMERIC
+
+
+def is_proven(static_type) -> bool:
+    """is_numeric for a solved type. NOTHING is numeric only vacuously: after
+    solving, it is left on a parameter that a call omits and that has no
+    default, which the slot backends bind to None."""
+    return static_type != NOTHING and is_numeric(static_type)
+
+
+def negate(operand):
+    if not is_numeric(operand):
+        return None
+    return frozenset("int" if cls == "bool" else cls for cls in operand)
+
+
+def binary_class(op, left, right):
+    """Class of `left op right` for two numeric classes; None where it is not one of ours."""
+    if op == "and" or op == "or":
+        if left == right == "bool":
+            return "bool"
+        if left in ("int", "bool") and right in ("int", "bool"):
+            return "int"
+        return None  # & and | raise TypeError for floats
+    if op in COMPARISONS:
+        return None if "f64" in (left, right) else "bool"  # numpy comparisons give numpy.bool_
+    if "f64" in (left, right):
+        return "f64"
+    if op == "/" or "float" in (left, right):
+        return "float"
+    return "int"
+
+
+def binary(op, left, right):
+    if not (is_numeric(left) and is_numeric(right)):
+        return None  # the runtime raises TypeError
+    classes = set()
+    for left_class in left:
+        for right_class in right:
+            cls = binary_class(op, left_class, right_class)
+            if cls is None:
+                return None
+            classes.add(cls)
+    return frozenset(classes)
+
+
+class TypeChecker(SimpleLangVisitor):
+    """Proves where the runtime's numeric checks cannot fail, before the program runs.
+
+    Declared types are not enforced at run time (`let x: int = "a";` and
+    passing any argument to any parameter both work), so the checker does
+    not trust them. It infers the representation of every variable from the
+    values that can be written to it, and uses the declarations only where
+    the runtime acts on them: array<float> conversion and default values.
+
+    Variables are tracked by name, so all variables sharing a name share one
+    type, and an element stored into any list in place (`xs[i] = v`,
+    `xs.append(v)`) is assumed to reach every list, which covers aliasing.
+    The result is a least fixpoint over all writes; the checker never
+    rejects a program.
+
+    Proven facts are recorded on the parse tree as `proven_numeric`:
+    on binary `expr` nodes whose operands are always int or float, and on
+    `arrayOp` statistics and linreg whose arrays hold only numbers.
+    """
+
+    MAX_ITERATIONS = 50
+
+    visitType = Interpreter.visitType
+
+    def __init__(self, predefined: Optional[Dict[str, Any]] = None):
+        # Names that already hold values, e.g. in an interpreter that has run before.
+        self.predefined = {"print": print, "len": len} if predefined is None else predefined
+        self.names: Dict[str, Any] = {}
+        self.mutated = NOTHING  # join of all elements stored into lists in place
+        self.returns: Dict[str, Any] = {}
+        self.writes: List[tuple] = []  # (name, type_of)
+        self.element_writes: List[Callable] = []
+        self.return_writes: List[tuple] = []  # (function name, type_of)
+        self.calls: List[tuple] = []  # (function name, [type_of per argument])
+        self.functions: Dict[str, List[list]] = {}  # name -> parameter names of each declaration
+        self.proofs: List[tuple] = []  # (ctx, proven)
+        self.read_names = set()
+        self.function = None
+
+    def check(self, tree):
+        # Like parsing, this only allocates (closures over a live tree), so the
+        # cyclic collector has no garbage to find and would rescan the tree.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.visit(tree)
+            self.bind_calls()
+            if self.solve():
+                for ctx, proven in self.proofs:
+                    ctx.proven_numeric = proven()
+                    # Resolved again with the new proof.
+                    ctx.__dict__.pop("method_call", None)
+                    ctx.__dict__.pop("binary_op", None)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return tree
+
+    def bind_calls(self):
+        for name, value in self.predefined.items():
+            if not (name == "len" and value is len):
+                self.writes.append((name, lambda: None))
+        for name, args in self.calls:
+            for params in self.functions.get(name, ()):
+                for param, arg in zip(params, args):
+                    self.writes.append((param, arg))
+        # A function read as a value can be called under any name, with anything.
+        for name in self.read_names & self.functions.keys():
+            for params in self.functions[name]:
+                for param in params:
+                    self.writes.append((param, lambda: None))
+
+    def solve(self) -> bool:
+        """Iterates the writes to a fixpoint; False if it did not settle, and nothing is proven."""
+        for _ in range(self.MAX_ITERATIONS):
+            changed = False
+            for name, type_of in self.writes:
+                old = self.names.get(name, NOTHING)
+                new = join(old, type_of())
+                if new != old:
+                    self.names[name] = new
+                    changed = True
+            for name, type_of in self.return_writes:
+                old = self.returns.get(name, NOTHING)
+                new = join(old, type_of())
+                if new != old:
+                    self.returns[name] = new
+                    changed = True
+            for type_of in self.element_writes:
+                new = join(self.mutated, type_of())
+                if new != self.mutated:
+                    self.mutated = new
+                    changed = True
+            if not changed:
+                return True
+        return False
+
+    # Queries used by the type_of closures
+
+    def read(self, name):
+        if name in self.functions:
+            return None  # a Function object
+        return self.names.get(name, NOTHING)
+
+    def elements(self, container):
+        """Type of the values found by indexing or iterating over container."""
+        if not isinstance(container, Seq):
+            return None
+        if "list" in container.kinds:
+            return join(container.element, self.mutated)
+        return container.element  # ndarray assignments convert to float64
+
+    def holds_numbers(self, container) -> bool:
+        return isinstance(container, Seq) and is_numeric(self.elements(container))
+
+    def proves_numbers(self, container) -> bool:
+        return isinstance(container, Seq) and is_proven(self.elements(container))
+
+    def to_ndarray(self, value):
+        """Type of np.array(value) for a one-dimensional array<float> declaration."""
+        elements = self.elements(value)
+        if isinstance(elements, frozenset) and elements <= {"float", "f64"}:
+            return FLOAT_ARRAY
+        return None
+
+    def call(self, name):
+        if name in self.functions and name not in self.names and name not in self.predefined:
+            return self.returns.get(name, NOTHING)
+        if name == "len" and self.predefined.get("len") is len and name not in self.names:
+            return frozenset({"int"})
+        return None
+
+    # Declarations and statements
+
+    def write(self, name, type_of):
+        self.writes.append((name, type_of))
+
+    def visitFunctionDecl(self, ctx):
+        name = ctx.IDENTIFIER().getText()
+        params = ctx.paramList().parameter() if ctx.paramList() else []
+        self.functions.setdefault(name, []).append([param.IDENTIFIER().getText() for param in params])
+        for param in params:
+            if param.expr():
+                self.write(param.IDENTIFIER().getText(), self.visit(param.expr()))
+        previous, self.function = self.function, name
+        self.visit(ctx.block())
+        self.function = previous
+        if not self.always_returns(ctx.block()):
+            self.return_writes.append((name, lambda: None))
+
+    def always_returns(self, ctx) -> bool:
+        """Whether running ctx (a block or statement) always ends in a return or an error."""
+        if isinstance(ctx, SimpleLangParser.BlockContext):
+            return any(self.always_returns(statement) for statement in ctx.statement())
+        if ctx.returnStmt():
+            return True
+        if ctx.block():
+            return self.always_returns(ctx.block())
+        if ctx.ifStatement():
+            blocks = ctx.ifStatement().block()
+            return len(blocks) == 2 and all(self.always_returns(block) for block in blocks)
+        if ctx.matchStatement():
+            # A value that matches no case raises ValueError.
+            return all(self.always_returns(case.statement()) for case in ctx.matchStatement().matchCase())
+        return False
+
+    def visitVarDecl(self, ctx):
+        name = ctx.IDENTIFIER().getText()
+        var_type = self.visit(ctx.type_())
+        converts = isinstance(var_type, ArrayType) and (
+            var_type.element_type == Type.FLOAT or var_type.element_type == ArrayType(Type.FLOAT)
+        )
+        if ctx.expr():
+            value = self.visit(ctx.expr())
+            if converts and var_type.element_type == Type.FLOAT:
+                self.write(name, lambda: self.to_ndarray(value()))
+            elif converts:
+                self.write(name, lambda: None)
+            else:
+                self.write(name, value)
+        else:
+            default = self.default(var_type)
+            self.write(name, lambda: default)
+
+    @staticmethod
+    def default(var_type):
+        if isinstance(var_type, ArrayType) and (
+            var_type.element_type == Type.FLOAT or var_type.element_type == ArrayType(Type.FLOAT)
+        ):
+            return FLOAT_ARRAY  # np.array([])
+        if isinstance(var_type, (ArrayType, ListType)):
+            return seq(NOTHING)
+        return {
+            Type.INT: frozenset({"int"}),
+            Type.FLOAT: frozenset({"float"}),
+            Type.BOOL: frozenset({"bool"}),
+            Type.STRING: frozenset({"str"}),
+        }.get(var_type)
+
+    def visitAssignment(self, ctx):
+        exprs = ctx.expr()
+        values = [self.visit(expr) for expr in exprs]
+        if len(exprs) > 1:
+            self.element_writes.append(values[1])
+        else:
+            self.write(ctx.IDENTIFIER().getText(), values[0])
+
+    def visitReturnStmt(self, ctx):
+        value = self.visit(ctx.expr()) if ctx.expr() else (lambda: None)
+        if self.function is not None:
+            self.return_writes.append((self.function, value))
+
+    def visitArrayOp(self, ctx):
+        op = ctx.getChild(2).getText()
+        target = ctx.IDENTIFIER().getText()
+        array_of = lambda: self.read(target)  # noqa: E731
+
+        # sort works in place, keeping the representation, so it writes nothing.
+        if op in STATISTICS:
+            self.proofs.append((ctx, lambda: self.proves_numbers(array_of())))
+            if op == "median":
+                self.write(f"{target}_median", lambda: self.median_result(array_of()))
+            else:
+                self.write(f"{target}_{op}", lambda: frozenset({"float"}))
+        elif op == "linreg":
+            y_of = self.visit(ctx.expr())
+            self.proofs.append((ctx, lambda: self.proves_numbers(array_of()) and self.proves_numbers(y_of())))
+            for suffix in ("slope", "intercept", "r_squared"):
+                self.write(f"{target}_{suffix}", lambda: frozenset({"float", "f64"}))
+        elif op in ("rotate", "shift"):
+            self.visit(ctx.expr())
+            moved = self.rotate_result if op == "rotate" else self.shift_result
+            self.write(f"{target}_{op}", lambda: moved(array_of()))
+        elif op in ("filter", "map"):
+            lambda_expr = ctx.lambdaExpr()
+            self.write(lambda_expr.IDENTIFIER().getText(), lambda: self.elements(array_of()))
+            body = self.visit(lambda_expr.expr())
+            if op == "filter":
+                self.write(f"{target}_filter", lambda: seq(self.elements(array_of())))
+            else:
+                self.write(f"{target}_map", lambda: seq(body()))
+
+    # Types of what the array methods store, given the type of the array
+
+    def median_result(self, array):
+        """The middle element of a list, or the mean of the two middle ones."""
+        if not self.holds_numbers(array):
+            return None
+        return join(self.elements(array), frozenset({"float"}))
+
+    def rotate_result(self, array):
+        if not isinstance(array, Seq):
+            return None
+        return seq(self.elements(array)) if "list" in array.kinds else NOTHING  # ndarrays raise
+
+    def shift_result(self, array):
+        if not isinstance(array, Seq) or "ndarray" in array.kinds:
+            return None
+        return seq(join(self.elements(array), frozenset({"int"})))  # pads with 0
+
+    def visitListOp(self, ctx):
+        if ctx.expr():
+            value = self.visit(ctx.expr())
+            if ctx.getChild(2).getText() == "append":
+                self.element_writes.append(value)
+
+    def visitMatrixOp(self, ctx):
+        if ctx.expr():
+            self.visit(ctx.expr())
+        target = ctx.IDENTIFIER().getText()
+        self.write(target, lambda: None)  # converted to a matrix in place
+        self.write(f"{target}_{ctx.getChild(2).getText()}", lambda: None)
+
+    # Expressions return a closure computing their type from the current solution
+
+    def visitExpr(self, ctx):
+        children = ctx.children
+        first = children[0]
+        if len(children) == 1:  # primary or functionCall
+            return first.accept(self)
+        if ctx.op is not None:  # Binary operation
+            left = children[0].accept(self)
+            right = children[2].accept(self)
+            op = ctx.op.text
+            self.proofs.append((ctx, lambda: is_proven(left()) and is_proven(right())))
+            return lambda: binary(op, left(), right())
+        if not isinstance(first, TerminalNode):  # Indexing: expr '[' expr ']'
+            container = first.accept(self)
+            children[2].accept(self)
+            return lambda: self.elements(container())
+        token = first.symbol.text
+        if token == "-":
+            operand = children[1].accept(self)
+            return lambda: negate(operand())
+        if token == "(":  # Parentheses
+            return children[1].accept(self)
+        literal = NumericLiteral.of(ctx)  # Array/List literal
+        if literal is not None:
+            return self.visitNumericArray(ctx)
+        items = [item.accept(self) for item in children[1:-1:2]]
+
+        def list_literal():
+            element = NOTHING
+            for item in items:
+                element = join(element, item())
+            return seq(element)
+
+        return list_literal
+
+    def visitNumericArray(self, ctx):
+        values = ctx.numeric_literal.values
+        if isinstance(values, array):
+            element = frozenset({"int"}) if values.typecode == "q" else frozenset({"float"})
+        else:
+            element = frozenset({"int", "float"})
+        static_type = seq(element)
+        return lambda: static_type
+
+    def visitFunctionCall(self, ctx):
+        name = ctx.IDENTIFIER().getText()
+        args = [self.visit(expr) for expr in ctx.expr()]
+        self.calls.append((name, args))
+        return lambda: self.call(name)
+
+    def visitPrimary(self, ctx):
+        token = ctx.children[0].symbol
+        if token.type == SimpleLangParser.IDENTIFIER:
+            name = token.text
+            self.read_names.add(name)
+            return lambda: self.read(name)
+        return LITERAL_TYPES[token.type]
+
+
+def check(tree, predefined: Optional[Dict[str, Any]] = None):
+    """Annotates tree with the numeric checks the runtime can skip; see TypeChecker."""
+    return TypeChecker(predefined).check(tree)
@@ -1,14 +1,8 @@
-from antlr4 import *
-from SimpleLangLexer import SimpleLangLexer
-from SimpleLangParser import SimpleLangParser
 from interpreter import Interpreter
+from parsing import parse
 
 def run_code(code: str):
-    input_stream = InputStream(code)
-    lexer = SimpleLangLexer(input_stream)
-    token_stream = CommonTokenStream(lexer)
-    parser = SimpleLangParser(token_stream)
-    tree = parser.program()
+    tree = parse(code)
     
     interpreter = Interpreter()
     return interpreter.visit(tree)
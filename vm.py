@@ -0,0 +1,378 @@
+from typing import List, Optional
+from interpreter import (
+    MISSING, ArrayOperations, Memo, MusicPlayer, StatisticsCache, TypedArray, VectorLambda, is_ndarray, memo_key, np,
+    type_name,
+)
+from compiler import match_pattern
+from bytecode import (
+    ADD, SUB, MUL, DIV, MOD, GT, LT, GE, LE, EQ, NE, AND, OR,
+    JUMP, JUMP_IF_FALSE, NEG,
+    JUMP_UNLESS_GT, JUMP_UNLESS_LT, JUMP_UNLESS_GE, JUMP_UNLESS_LE, JUMP_UNLESS_EQ, JUMP_UNLESS_NE,
+    CALL, RETURN, RETURN_NONE, YIELD, INDEX, SET_INDEX, BUILD_LIST, NEW_NDARRAY, TO_NDARRAY,
+    MAKE_FUNCTION, MATCH, NO_MATCH, CHECK_ARRAY, CHECK_LIST, SORT, STATISTIC, PLAY, LINREG,
+    ROTATE, SHIFT, FILTER, MAP, LIST_APPEND, LIST_REMOVE, LIST_SORT, TO_MATRIX,
+    MATRIX_ADD, MATRIX_MULTIPLY, MATRIX_INVERT, MATRIX_TRANSPOSE, HALT,
+    LOAD_NUMBERS, LOAD_NDARRAY, PROVEN_STATISTIC, PROVEN_LINREG, JUMP_IF_BOUND, TAIL_CALL,
+    JUMP_UNLESS_INLINE, NEW_TYPED_ARRAY, TO_TYPED_ARRAY, PIPELINE,
+    BytecodeProgram, CodeObject,
+)
+from resolver import BUILTINS, LOCAL, STATISTICS, UNSET, GlobalFrame
+
+
+NUMERIC = (int, float)
+
+BINARY_SYMBOLS = {
+    ADD: "+", SUB: "-", MUL: "*", DIV: "/", MOD: "%",
+    GT: ">", LT: "<", GE: ">=", LE: "<=", EQ: "==", NE: "!=",
+    AND: "and", OR: "or",
+    JUMP_UNLESS_GT: ">", JUMP_UNLESS_LT: "<", JUMP_UNLESS_GE: ">=",
+    JUMP_UNLESS_LE: "<=", JUMP_UNLESS_EQ: "==", JUMP_UNLESS_NE: "!=",
+}
+
+
+def binary_error(op, left, right):
+    return TypeError(
+        f"Unsupported operation '{BINARY_SYMBOLS[op]}' between {type_name(left)} and {type_name(right)}"
+    )
+
+
+class VMFunction:
+    __slots__ = ("name", "code", "defaults", "memo")
+
+    def __init__(self, name, code, defaults, memo=None):
+        self.name = name
+        self.code = code
+        self.defaults = defaults
+        self.memo = memo
+
+
+class VirtualMachine:
+    """Executes a BytecodeProgram with one flat register list per call.
+
+    Calls between user functions do not recurse in Python: execute keeps the
+    suspended callers on a list of frames, so recursion depth is limited only
+    by memory. Only map/filter lambdas re-enter execute.
+    """
+
+    def __init__(self, program: BytecodeProgram, memo_size: int = 0, memos: Optional[List[Memo]] = None):
+        self.program = program
+        self.memo_size = memo_size
+        self.memos = [] if memos is None else memos
+        self.global_env = GlobalFrame(program.global_names)
+        self.globals = self.global_env.slots
+        for name in BUILTINS:
+            self.global_env.define(name, {"print": print, "len": len}[name])
+        self.templates = {}
+        self.instructions = {}
+        self.statistics = StatisticsCache()
+
+    def run(self):
+        main = self.program.main
+        return self.execute(main, main.frame_template(), 0)
+
+    def new_frame(self, function: VMFunction, args):
+        code_obj = function.code
+        template = self.templates.get(code_obj)
+        if template is None:
+            template = self.templates[code_obj] = code_obj.frame_template()
+        regs = template[:]
+        nparams = code_obj.nparams
+        args = self.arguments(function, args)
+        regs[:nparams] = args[:nparams]
+        return regs
+
+    def arguments(self, function: VMFunction, args):
+        """args followed by the values of the parameters the call leaves out, as in CompiledFunction.pad.
+
+        Calls key their memo on this, since a default may be a list changed since.
+        """
+        nparams = function.code.nparams
+        if len(args) >= nparams:
+            return args
+        return args + [
+            self.global_env.parameter(name) if default is UNSET else default
+            for name, default in zip(function.code.param_names[len(args):], function.defaults[len(args):])
+        ]
+
+    def decode(self, code_obj: CodeObject):
+        code = self.instructions.get(code_obj)
+        if code is None:
+            # Decoding the array once per code object keeps indexing cheap in the loop.
+            code = self.instructions[code_obj] = code_obj.code.tolist()
+        return code
+
+    def lambda_caller(self, code_obj, regs, index):
+        param, start, _ = code_obj.lambdas[index]
+        execute = self.execute
+
+        def evaluate(element):
+            regs[param] = element
+            return execute(code_obj, regs, start)
+
+        return evaluate
+
+    def vector(self, code_obj, regs, index) -> Optional[VectorLambda]:
+        plan = code_obj.lambdas[index][2]
+        if plan is None:
+            return None
+        names = self.program.global_names
+
+        def load(address):
+            kind, where = address
+            if kind == LOCAL:
+                return regs[where]
+            value = self.globals[where]
+            if value is UNSET:
+                raise NameError(f"Variable '{names[where]}' is not defined")
+            return value
+
+        return VectorLambda(plan, load)
+
+    def execute(self, code_obj: CodeObject, regs, pc):
+        code = self.decode(code_obj)
+        g = self.globals
+        functions = self.program.functions
+        numeric = NUMERIC
+        callers = []  # (code_obj, code, regs, pc, result register, pending) of each suspended call
+        pending = None  # (memo, key) of the current call and of its tail calls, to store the result under
+
+        # The hot opcodes are tested by number and by range; see the numbering
+        # in bytecode.py before reordering anything there.
+        while True:
+            op = code[pc]
+            a = code[pc + 1]
+            b = code[pc + 2]
+            c = code[pc + 3]
+            pc += 4
+
+            if op == 0:  # MOVE
+                regs[a] = regs[b]
+            elif op == 1:  # LOAD_GLOBAL
+                value = g[b]
+                if value is UNSET:
+                    raise NameError(f"Variable '{self.program.global_names[b]}' is not defined")
+                regs[a] = value
+            elif op <= 16:
+                if op <= 3:
+                    if op == 3 and g[a] is UNSET:  # STORE_GLOBAL
+                        raise NameError(f"Variable '{self.program.global_names[a]}' is not defined")
+                    g[a] = regs[b]
+                    continue
+                left = regs[b]
+                right = regs[c]
+                if not (isinstance(left, numeric) and isinstance(right, numeric)):
+                    raise binary_error(op, left, right)
+                if op == 4:
+                    regs[a] = left + right
+                elif op == 5:
+                    regs[a] = left - right
+                elif op == 6:
+                    regs[a] = left * right
+                elif op == 7:
+                    regs[a] = left / right
+                elif op == 8:
+                    regs[a] = left % right
+                elif op == 9:
+                    regs[a] = left > right
+                elif op == 10:
+                    regs[a] = left < right
+                elif op == 11:
+                    regs[a] = left >= right
+                elif op == 12:
+                    regs[a] = left <= right
+                elif op == 13:
+                    regs[a] = left == right
+                elif op == 14:
+                    regs[a] = left != right
+                elif op == 15:
+                    regs[a] = left & right
+                else:
+                    regs[a] = left | right
+            elif op <= 25:
+                if op == JUMP:
+                    pc = a
+                elif op == JUMP_IF_FALSE:
+                    if not regs[a]:
+                        pc = b
+                elif op == NEG:
+                    regs[a] = -regs[b]
+                else:
+                    left = regs[a]
+                    right = regs[b]
+                    if not (isinstance(left, numeric) and isinstance(right, numeric)):
+                        raise binary_error(op, left, right)
+                    if op == 21:
+                        taken = left < right
+                    elif op == 23:
+                        taken = left <= right
+                    elif op == 20:
+                        taken = left > right
+                    elif op == 22:
+                        taken = left >= right
+                    elif op == 24:
+                        taken = left == right
+                    else:
+                        taken = left != right
+                    if not taken:
+                        pc = c
+            elif op == CALL:
+                function = regs[b]
+                if isinstance(function, VMFunction):
+                    args = self.arguments(function, regs[b + 1:b + 1 + c])
+                    memo = function.memo
+                    if memo is not None:
+                        key = memo_key(args)
+                        value = memo.get(key)
+                        if value is not MISSING:
+                            regs[a] = value
+                            continue
+                    callers.append((code_obj, code, regs, pc, a, pending))
+                    pending = None if memo is None else [(memo, key)]
+                    code_obj = function.code
+                    code = self.decode(code_obj)
+                    regs = self.new_frame(function, args)
+                    pc = 0
+                else:
+                    regs[a] = function(*regs[b + 1:b + 1 + c])
+            elif op == RETURN or op == RETURN_NONE or op == TAIL_CALL:
+                if op == TAIL_CALL:
+                    function = regs[a]
+                    args = regs[a + 1:a + 1 + b]
+                    value = MISSING
+                    if not isinstance(function, VMFunction):
+                        value = function(*args)
+                    elif function.memo is not None:
+                        args = self.arguments(function, args)
+                        key = memo_key(args)
+                        value = function.memo.get(key)
+                        if value is MISSING:
+                            pending = [(function.memo, key)] if pending is None else pending + [(function.memo, key)]
+                    if value is MISSING:
+                        code_obj = function.code
+                        code = self.decode(code_obj)
+                        regs = self.new_frame(function, args)
+                        pc = 0
+                        continue
+                else:
+                    value = regs[a] if op == RETURN else None
+                if pending is not None:
+                    for memo, key in pending:
+                        memo.put(key, value)
+                if not callers:
+                    return value
+                code_obj, code, regs, pc, a, pending = callers.pop()
+                regs[a] = value
+            elif op == HALT:
+                return None
+            elif op == YIELD:
+                return regs[a]
+            elif op == INDEX:
+                container = regs[b]
+                index = regs[c]
+                if not (isinstance(container, (list, TypedArray)) or is_ndarray(container)):
+                    raise TypeError(f"Variable '{code_obj.debug[pc - 4]}' is not an array or list")
+                if not isinstance(index, int):
+                    raise TypeError(f"Index must be an integer, got {type_name(index)}")
+                if index < 0 or index >= len(container):
+                    raise IndexError(f"Index {index} is out of range for array of size {len(container)}.")
+                regs[a] = container[index]
+            elif op == BUILD_LIST:
+                regs[a] = regs[b:b + c]
+            elif op == JUMP_IF_BOUND:
+                if regs[a] is not UNSET:
+                    pc = b
+            elif op == JUMP_UNLESS_INLINE:
+                function = regs[a]
+                if not (type(function) is VMFunction and function.code is functions[c] and function.memo is None):
+                    pc = b
+            else:
+                self.execute_rare(op, a, b, c, code_obj, regs, pc)
+
+    def execute_rare(self, op, a, b, c, code_obj, regs, pc):
+        """Instructions outside the arithmetic/control-flow core."""
+        aux = code_obj.aux
+
+        if op == SET_INDEX:
+            container = regs[a]
+            index = regs[b]
+            if not (isinstance(container, (list, TypedArray)) or is_ndarray(container)):
+                raise TypeError(
+                    f"Variable '{code_obj.debug[pc - 4]}' is expected to be a list or array, got {type(container)}"
+                )
+            if not isinstance(index, int):
+                raise TypeError(f"Index must be an integer, got {type(index)}")
+            container[index] = regs[c]
+            self.statistics.changed(container)
+        elif op == NEW_NDARRAY:
+            regs[a] = np.array([])
+        elif op == TO_NDARRAY:
+            regs[a] = np.array(regs[b])
+        elif op == MAKE_FUNCTION:
+            function_code = self.program.functions[b]
+            memo = None
+            if self.memo_size > 0 and function_code.pure:
+                memo = Memo(function_code.name, self.memo_size)
+                self.memos.append(memo)
+            regs[a] = VMFunction(function_code.name, function_code, regs[c:c + function_code.nparams], memo)
+        elif op == MATCH:
+            regs[a] = match_pattern(regs[b], aux[c])
+        elif op == NO_MATCH:
+            raise ValueError(f"No matching pattern for value: {regs[a]}")
+        elif op == CHECK_ARRAY:
+            ArrayOperations.check_array(aux[b], regs[a])
+        elif op == CHECK_LIST:
+            ArrayOperations.check_list(aux[b], regs[a])
+        elif op == SORT:
+            regs[a] = ArrayOperations.sort(regs[a], bool(b), self.statistics)
+        elif op == STATISTIC or op == PROVEN_STATISTIC:
+            regs[a] = ArrayOperations.statistic(STATISTICS[c], regs[b], op == PROVEN_STATISTIC, self.statistics)
+        elif op == PLAY:
+            MusicPlayer.play(regs[a])
+        elif op == LINREG or op == PROVEN_LINREG:
+            result = ArrayOperations.linreg(regs[b], regs[c], op == PROVEN_LINREG)
+            regs[a] = result["slope"]
+            regs[a + 1] = result["intercept"]
+            regs[a + 2] = result["r_squared"]
+        elif op == ROTATE:
+            regs[a] = ArrayOperations.rotate(regs[b], regs[c])
+        elif op == SHIFT:
+            regs[a] = ArrayOperations.shift(regs[b], regs[c])
+        elif op == FILTER or op == MAP:
+            apply = ArrayOperations.filter if op == FILTER else ArrayOperations.map
+            regs[a] = apply(regs[b], self.lambda_caller(code_obj, regs, c), self.vector(code_obj, regs, c))
+        elif op == LIST_APPEND:
+            ArrayOperations.list_append(regs[a], regs[b], self.statistics)
+        elif op == LIST_REMOVE:
+            ArrayOperations.list_remove(regs[a], regs[b], self.statistics)
+        elif op == LIST_SORT:
+            ArrayOperations.list_sort(regs[a], bool(b), self.statistics)
+        elif op == TO_MATRIX:
+            regs[a] = ArrayOperations.to_matrix(aux[c], regs[b])
+        elif op == MATRIX_ADD:
+            regs[a] = ArrayOperations.matrix_add(regs[b], regs[c])
+        elif op == MATRIX_MULTIPLY:
+            regs[a] = ArrayOperations.matrix_multiply(regs[b], regs[c])
+        elif op == MATRIX_INVERT:
+            regs[a] = ArrayOperations.matrix_invert(aux[c], regs[b])
+        elif op == MATRIX_TRANSPOSE:
+            regs[a] = ArrayOperations.matrix_transpose(regs[b])
+        elif op == LOAD_NUMBERS:
+            regs[a] = aux[b].as_list()
+        elif op == LOAD_NDARRAY:
+            regs[a] = aux[b].as_ndarray()
+        elif op == NEW_TYPED_ARRAY:
+            regs[a] = TypedArray(regs[b])
+        elif op == TO_TYPED_ARRAY:
+            regs[a] = TypedArray.declare(regs[c], regs[b])
+        elif op == PIPELINE:
+            stages = []
+            for stage_op, operand in aux[c]:
+                if stage_op == "filter" or stage_op == "map":
+                    stages.append((stage_op, self.lambda_caller(code_obj, regs, operand), self.vector(code_obj, regs, operand)))
+                elif stage_op == "rotate" or stage_op == "shift":
+                    stages.append((stage_op, regs[operand], None))
+                else:
+                    stages.append((stage_op, operand, None))
+            regs[a] = ArrayOperations.pipeline(regs[b], stages, self.statistics)
+        else:
+            raise RuntimeError(f"Unknown opcode {op}")